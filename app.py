@@ -9,8 +9,13 @@ from flask import Flask
 from tf_serving_flask_app import settings
 from tf_serving_flask_app.base.utils import as_boolean
 from tf_serving_flask_app.rest.api import create_prediction_api_from_spec
+from tf_serving_flask_app.rest.fast_path import FastPredictionMiddleware
 from tf_serving_flask_app.core import spec_borg
+from tf_serving_flask_app.core import conversion_plans
+from tf_serving_flask_app.core import memory_profiling
 from tf_serving_flask_app.core import metrics
+from tf_serving_flask_app.core import model_metadata
+from tf_serving_flask_app.core import warmup
 
 
 def create_app():
@@ -29,25 +34,76 @@ def bootstrap_spec(pipeline_spec_path):
     borg.initialize_from_json(pipeline_spec_path)
 
 
+def validate_model_signature():
+    """Validates the spec against the signature of the served model and
+    keeps the signature around on the spec borg.
+    """
+    if not as_boolean(os.getenv('VALIDATE_MODEL_SIGNATURE', settings.DEFAULT_VALIDATE_MODEL_SIGNATURE)):
+        return
+    timeout_secs = int(os.getenv('MODEL_METADATA_TIMEOUT_SECS', settings.DEFAULT_MODEL_METADATA_TIMEOUT_SECS))
+    borg = spec_borg.SpecBorg()
+    borg.signature_def = model_metadata.validate_spec_against_served_model(borg, timeout_secs)
+    if borg.signature_def is not None:
+        borg.input_conversion_plans = conversion_plans.compile_plans(borg, borg.signature_def)
+
+
+def warm_up():
+    """Pushes synthetic inputs through the prediction flow before the worker
+    accepts traffic."""
+    if not as_boolean(os.getenv('WARMUP_ENABLED', settings.DEFAULT_WARMUP_ENABLED)):
+        return
+    iterations = int(os.getenv('WARMUP_ITERATIONS', settings.DEFAULT_WARMUP_ITERATIONS))
+    samples_dir = os.getenv('WARMUP_SAMPLES_DIR', settings.DEFAULT_WARMUP_SAMPLES_DIR)
+    timeout_secs = float(os.getenv('WARMUP_TIMEOUT_SECS', settings.DEFAULT_WARMUP_TIMEOUT_SECS))
+    warmup.warm_up(iterations, samples_dir, timeout_secs)
+
+
 def register_metrics():
-    """Exposes Prometheus metrics as a separate flask application on a different
-    thread. This ensures that worker processes are used only for prediction requests
-    and frequently scraping metrics does not result in a worker process not being available
-    for serving.
+    """Exposes Prometheus metrics on a dedicated lightweight HTTP server on a different
+    thread or sidecar process. This ensures that worker processes are used only for
+    prediction requests and frequently scraping metrics does not result in a worker
+    process not being available for serving.
     """
     metrics_host = os.getenv('METRICS_HOST', settings.DEFAULT_METRICS_HOST)
     metrics_port = int(os.getenv('METRICS_PORT', settings.DEFAULT_METRICS_PORT))
-    # start_http_server allows exposing the endpoint on an independent Flask application
+    # The exporter serves the endpoint independently of the Flask application
     # on a selected HTTP port.
-    metrics.register_endpoint(metrics_port, metrics_host, endpoint='/metrics')
+    routes = {}
+    if as_boolean(os.getenv('MEMORY_PROFILING', settings.DEFAULT_MEMORY_PROFILING)):
+        routes['/memory'] = memory_profiling.memory_route
+    metrics.register_endpoint(metrics_port, metrics_host, endpoint='/metrics', routes=routes)
 
 
-def bootstrap_app(pipeline_spec_path):
-    """Creates the application, bootstraps the spec, and generates resources dependent on the spec."""
+def initialize_worker():
+    """Initializes the state of a serving process that depends on gRPC channels.
+
+    gRPC channels are not fork-safe, so with a preloaded gunicorn master this
+    runs in each worker after forking rather than while bootstrapping the app.
+    """
+    memory_profiling.start_profiling()
+    validate_model_signature()
+    # Runs before the worker starts accepting connections, so the worker
+    # only enters rotation once warmed up.
+    warm_up()
+
+
+def bootstrap_app(pipeline_spec_path, initialize=True):
+    """Creates the application, bootstraps the spec, and generates resources dependent on the spec.
+
+    :param pipeline_spec_path: Path to the pipeline specification.
+    :param initialize: Whether to initialize the worker right away. False when
+    the app is preloaded in a gunicorn master and workers initialize after forking.
+    """
     app = create_app()
     bootstrap_spec(pipeline_spec_path)
     prediction_api = create_prediction_api_from_spec()
     prediction_api.init_app(app)
+    # Serves predictions straight from WSGI while Swagger docs and every
+    # other route stay on the Flask application.
+    if as_boolean(os.getenv('FAST_PREDICT_PATH', settings.DEFAULT_FAST_PREDICT_PATH)):
+        app.wsgi_app = FastPredictionMiddleware(app.wsgi_app)
+    if initialize:
+        initialize_worker()
     return app
 
 
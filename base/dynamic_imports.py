@@ -1,5 +1,6 @@
 import logging
 import re
+from urllib.parse import parse_qsl
 
 logger = logging.getLogger('base')
 
@@ -11,6 +12,12 @@ def import_by_string(full_name):
         unit_name)
 
 
+# Spec strings prefixed with `builtin:` select a post-processor or pre-processor
+# shipped with the application instead of dynamically importing user code.
+# Parameters are passed as a query string, e.g. `builtin:top_k?k=5&labels=/spec/labels.txt`
+BUILTIN_PREFIX = 'builtin:'
+
+
 def identity(args):
     return args
 
@@ -50,6 +57,19 @@ def safe_eval_lambda(lambda_str):
     raise BadLambdaFunctionError(lambda_str)
 
 
+def is_builtin(full_name):
+    return bool(full_name) and full_name.startswith(BUILTIN_PREFIX)
+
+
+def parse_builtin(full_name):
+    """Splits a `builtin:<name>?<key>=<value>&...` spec string into the
+    built-in name and a dict of string parameters.
+    """
+    assert is_builtin(full_name)
+    builtin_name, _, query = full_name[len(BUILTIN_PREFIX):].partition('?')
+    return builtin_name.strip(), dict(parse_qsl(query, keep_blank_values=True))
+
+
 def import_function_or_identity(full_name):
     if full_name:
         try:
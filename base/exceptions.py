@@ -13,3 +13,14 @@ class PostprocessorError(Exception):
 class PredictionRpcError(Exception):
     pass
 
+
+class SignatureMismatchError(Exception):
+    pass
+
+
+class NotAcceptableError(Exception):
+    pass
+
+
+class AdmissionTimeoutError(Exception):
+    pass
@@ -0,0 +1,204 @@
+"""
+Defines logging handlers that keep writing logs off the request path.
+
+`AsyncStreamHandler` only queues records on the logging thread. A background
+writer thread formats them and writes them to the stream in batches. When the
+queue is full, records are dropped and counted rather than blocking the
+request. Repeated records of the same call site are rate limited with a
+token bucket, so an error burst, e.g. while the model server is down, logs a
+few records and a count of the suppressed ones instead of one record per
+request.
+
+Handlers are configured from the logging configuration files, e.g.
+
+    [handler_console]
+    class=tf_serving_flask_app.base.logging_handlers.AsyncStreamHandler
+    formatter=json
+    args=(sys.stdout,)
+
+and read their tuning from environment variables.
+"""
+
+import atexit
+import collections
+import logging
+import os
+import threading
+import time
+
+from tf_serving_flask_app import settings
+
+
+def _original_threading():
+    """Returns the threading and time modules unpatched by eventlet, so the
+    writer is a real OS thread even in a monkey patched worker."""
+    try:
+        from eventlet import patcher
+    except ImportError:
+        return threading, time
+    return patcher.original('threading'), patcher.original('time')
+
+
+class RateLimitFilter(logging.Filter):
+    """Passes at most `burst` records of a call site at once and `rate` per
+    second after that. The next record that passes a call site reports how
+    many of its records were suppressed.
+
+    :param rate: the sustained records per second of a call site, 0 for no limit.
+    :param burst: the records of a call site passed at once.
+    :param level: records below this level are never limited.
+    :param max_keys: the number of call sites tracked before forgetting them all.
+    """
+
+    def __init__(self, rate, burst, level=logging.WARNING, max_keys=10000):
+        super(RateLimitFilter, self).__init__()
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.level = level
+        self.max_keys = max_keys
+        # Maps a call site to [tokens, last refill time, suppressed records].
+        self.buckets = {}
+
+    def filter(self, record):
+        if not self.rate or record.levelno < self.level:
+            return True
+        key = (record.name, record.levelno, record.pathname, record.lineno)
+        now = time.monotonic()
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            if len(self.buckets) >= self.max_keys:
+                self.buckets.clear()
+            bucket = self.buckets[key] = [float(self.burst), now, 0]
+        bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if bucket[0] < 1:
+            bucket[2] += 1
+            return False
+        bucket[0] -= 1
+        if bucket[2]:
+            record.msg = '%s (suppressed %d similar records)' % (record.msg, bucket[2])
+            bucket[2] = 0
+        return True
+
+
+class AsyncStreamHandler(logging.Handler):
+    """Writes formatted records to a stream in batches from a background thread.
+
+    Unset arguments are read from the environment variables LOG_QUEUE_CAPACITY,
+    LOG_BATCH_SIZE, LOG_FLUSH_INTERVAL_SECS, LOG_RATE_LIMIT_PER_SEC and
+    LOG_RATE_LIMIT_BURST.
+
+    :param stream: the stream written to, e.g. `sys.stdout`.
+    :param capacity: the records queued before new ones are dropped.
+    :param batch_size: the most records written at once.
+    :param flush_interval_secs: how long the writer sleeps when the queue is empty.
+    :param rate_limit_per_sec: the sustained warnings and errors per second of
+    a call site, 0 to log every record.
+    :param rate_limit_burst: the warnings and errors of a call site logged at once.
+    """
+
+    def __init__(self, stream, capacity=None, batch_size=None, flush_interval_secs=None,
+                 rate_limit_per_sec=None, rate_limit_burst=None):
+        super(AsyncStreamHandler, self).__init__()
+        self.stream = stream
+        self.capacity = int(capacity if capacity is not None else os.getenv(
+            'LOG_QUEUE_CAPACITY', settings.DEFAULT_LOG_QUEUE_CAPACITY))
+        self.batch_size = int(batch_size if batch_size is not None else os.getenv(
+            'LOG_BATCH_SIZE', settings.DEFAULT_LOG_BATCH_SIZE))
+        self.flush_interval_secs = float(flush_interval_secs if flush_interval_secs is not None else os.getenv(
+            'LOG_FLUSH_INTERVAL_SECS', settings.DEFAULT_LOG_FLUSH_INTERVAL_SECS))
+        rate_limit_per_sec = float(rate_limit_per_sec if rate_limit_per_sec is not None else os.getenv(
+            'LOG_RATE_LIMIT_PER_SEC', settings.DEFAULT_LOG_RATE_LIMIT_PER_SEC))
+        rate_limit_burst = int(rate_limit_burst if rate_limit_burst is not None else os.getenv(
+            'LOG_RATE_LIMIT_BURST', settings.DEFAULT_LOG_RATE_LIMIT_BURST))
+        if rate_limit_per_sec > 0:
+            self.addFilter(RateLimitFilter(rate_limit_per_sec, rate_limit_burst))
+        # Appending to and popping from a deque is atomic, which is safe
+        # between green threads and the writer's OS thread alike.
+        self.records = collections.deque()
+        self.dropped = 0
+        self.writer_pid = None
+        # Serializes starting the writer between threads of a process.
+        self.writer_lock = threading.Lock()
+        atexit.register(self.flush)
+
+    def _start_writer(self):
+        """Starts the writer of the current process. Threads do not survive
+        forking, so a worker forked from a configured master starts its own."""
+        self.writer_pid = os.getpid()
+        original_threading, original_time = _original_threading()
+        writer = original_threading.Thread(target=self._write_forever, args=(original_time.sleep,),
+                                           name='log-writer')
+        writer.daemon = True
+        writer.start()
+
+    def prepare(self, record):
+        """Merges the arguments of a record into its message and formats its
+        exception into `exc_text`, which formatters render like `exc_info`, so
+        the record no longer refers to objects the request may change or
+        keeps their frames alive."""
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        if self.writer_pid != os.getpid():
+            with self.writer_lock:
+                if self.writer_pid != os.getpid():
+                    if self.writer_pid is not None:
+                        # A worker forked from a configured master inherits the
+                        # records the master queued, which the master writes.
+                        self.records.clear()
+                        self.dropped = 0
+                    self._start_writer()
+        if len(self.records) >= self.capacity:
+            self.dropped += 1
+            return
+        try:
+            self.records.append(self.prepare(record))
+        except Exception:
+            self.handleError(record)
+
+    def _format_batch(self):
+        lines = []
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            lines.append(self.format(logging.makeLogRecord({
+                'name': 'base', 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                'msg': 'Dropped %d log records while the log queue was full' % dropped})))
+        while len(lines) < self.batch_size:
+            # Another thread flushing at exit may empty the queue in between.
+            try:
+                record = self.records.popleft()
+            except IndexError:
+                break
+            try:
+                lines.append(self.format(record))
+            except Exception:
+                self.handleError(record)
+        return lines
+
+    def _write(self, lines):
+        try:
+            self.stream.write('\n'.join(lines) + '\n')
+            self.stream.flush()
+        except Exception:
+            # Broken streams must not kill the writer.
+            pass
+
+    def _write_forever(self, sleep):
+        while True:
+            lines = self._format_batch()
+            if lines:
+                self._write(lines)
+            if not self.records:
+                sleep(self.flush_interval_secs)
+
+    def flush(self):
+        """Writes every queued record on the calling thread."""
+        while self.records or self.dropped:
+            self._write(self._format_batch())
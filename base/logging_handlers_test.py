@@ -0,0 +1,104 @@
+import io
+import logging
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from tf_serving_flask_app.base.logging_handlers import AsyncStreamHandler, RateLimitFilter
+
+
+def make_logger(handler):
+    logger = logging.getLogger('logging_handlers_test.%d' % id(handler))
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.addHandler(handler)
+    return logger
+
+
+class TestAsyncStreamHandler(unittest.TestCase):
+    def test_writes_in_the_background(self):
+        stream = io.StringIO()
+        logger = make_logger(AsyncStreamHandler(stream, flush_interval_secs=.01, rate_limit_per_sec=0))
+        values = [1, 2]
+        logger.info('values %s', values)
+        # Records are formatted with the arguments they were logged with.
+        values.append(3)
+        deadline = time.time() + 5
+        while not stream.getvalue() and time.time() < deadline:
+            time.sleep(.01)
+        self.assertEqual(stream.getvalue(), 'values [1, 2]\n')
+
+    def test_drops_records_beyond_capacity(self):
+        stream = io.StringIO()
+        handler = AsyncStreamHandler(stream, capacity=2, rate_limit_per_sec=0)
+        # Records queue without a writer of this process.
+        handler._start_writer = lambda: None
+        logger = make_logger(handler)
+        for i in range(5):
+            logger.info('record %d', i)
+        handler.flush()
+        self.assertEqual(stream.getvalue().splitlines(), [
+            'Dropped 3 log records while the log queue was full', 'record 0', 'record 1'])
+
+    def test_exceptions_are_kept_as_exc_text(self):
+        stream = io.StringIO()
+        handler = AsyncStreamHandler(stream, rate_limit_per_sec=0)
+        handler._start_writer = lambda: None
+        logger = make_logger(handler)
+        try:
+            raise ValueError('boom')
+        except ValueError:
+            logger.exception('failed %s', 'badly')
+        record = handler.records[0]
+        self.assertEqual((record.msg, record.args, record.exc_info), ('failed badly', None, None))
+        self.assertIn('ValueError: boom', record.exc_text)
+        handler.flush()
+        self.assertIn('failed badly\nTraceback', stream.getvalue())
+        self.assertIn('ValueError: boom', stream.getvalue())
+
+    def test_forked_worker_skips_records_of_the_master(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, 'log')
+        with open(path, 'w') as stream:
+            handler = AsyncStreamHandler(stream, rate_limit_per_sec=0)
+            # The master's writer has not written its queued record yet.
+            handler.writer_pid = os.getpid()
+            logger = make_logger(handler)
+            logger.info('master record')
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    logger.info('worker record')
+                    handler.flush()
+                finally:
+                    os._exit(0)
+            os.waitpid(pid, 0)
+            handler.flush()
+        with open(path) as f:
+            self.assertEqual(f.read().splitlines(), ['worker record', 'master record'])
+
+
+class TestRateLimitFilter(unittest.TestCase):
+    def test_suppresses_repeated_errors(self):
+        rate_limit = RateLimitFilter(rate=.001, burst=2)
+        records = [logging.LogRecord('core', logging.ERROR, 'flow.py', 10, 'RPC failed', None, None)
+                   for _ in range(5)]
+        self.assertEqual([rate_limit.filter(record) for record in records],
+                         [True, True, False, False, False])
+        # Other call sites and lower levels are not limited.
+        self.assertTrue(rate_limit.filter(
+            logging.LogRecord('core', logging.ERROR, 'flow.py', 11, 'other', None, None)))
+        self.assertTrue(rate_limit.filter(
+            logging.LogRecord('core', logging.INFO, 'flow.py', 10, 'info', None, None)))
+
+        rate_limit.buckets[('core', logging.ERROR, 'flow.py', 10)][0] = 1.
+        record = logging.LogRecord('core', logging.ERROR, 'flow.py', 10, 'RPC failed', None, None)
+        self.assertTrue(rate_limit.filter(record))
+        self.assertEqual(record.getMessage(), 'RPC failed (suppressed 3 similar records)')
+
+
+if __name__ == '__main__':
+    unittest.main()
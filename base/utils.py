@@ -1,5 +1,7 @@
 from distutils import util
 
+from werkzeug.http import parse_accept_header
+
 
 def as_boolean(val):
     if type(val) == str:
@@ -22,3 +24,8 @@ def humansize(nbytes):
     f = ('%.2f' % nbytes).rstrip('0').rstrip('.')
     return '%s %s' % (f, _SUFFIXES[i])
 
+
+def accepts_gzip(accept_encoding):
+    """Returns whether an Accept-Encoding header gives gzip a non-zero
+    quality, listed explicitly or through `*`, so `gzip;q=0` refuses it."""
+    return parse_accept_header(accept_encoding).quality('gzip') > 0
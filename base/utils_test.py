@@ -1,6 +1,6 @@
 import unittest
 
-from tf_serving_flask_app.base.utils import as_boolean
+from tf_serving_flask_app.base.utils import accepts_gzip, as_boolean
 
 
 class TestUtils(unittest.TestCase):
@@ -31,6 +31,12 @@ class TestUtils(unittest.TestCase):
         with self.assertRaises(ValueError):
             as_boolean('foo')
 
+    def test_accepts_gzip(self):
+        for accept_encoding in ('gzip', 'gzip, deflate', 'GZIP;q=0.5', 'deflate, *'):
+            self.assertTrue(accepts_gzip(accept_encoding))
+        for accept_encoding in (None, '', 'gzip;q=0', 'identity', '*;q=0', 'gzip;q=0, *'):
+            self.assertFalse(accepts_gzip(accept_encoding))
+
 
 if __name__ == '__main__':
     unittest.main()
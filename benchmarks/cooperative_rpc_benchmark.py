@@ -0,0 +1,97 @@
+"""
+Load tests how many prediction RPCs an eventlet worker keeps in flight at once
+when waiting for them by blocking, by polling futures and through eventlet's
+thread pool.
+
+Starts a fake prediction service in a subprocess that answers every Predict
+after a fixed delay, then issues RPCs from many green threads of a single
+monkey patched process like the requests of a gunicorn eventlet worker.
+A blocking call holds the hub, so its peak stays at one RPC in flight and its
+throughput at one call per delay:
+
+    python -m tf_serving_flask_app.benchmarks.cooperative_rpc_benchmark --concurrency 64 --delay-ms 50
+"""
+
+import argparse
+import subprocess
+import sys
+import time
+from concurrent import futures
+
+import eventlet
+
+from tf_serving_flask_app.core.cooperative_rpc import CooperativeRpc
+
+
+def serve(port, delay_secs):
+    import grpc
+    from tensorflow_serving.apis import prediction_service_pb2
+    from tensorflow_serving.apis.predict_pb2 import PredictResponse
+
+    class DelayedPredictionService(prediction_service_pb2.PredictionServiceServicer):
+        def Predict(self, request, context):
+            time.sleep(delay_secs)
+            return PredictResponse(model_spec=request.model_spec)
+
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=256))
+    prediction_service_pb2.add_PredictionServiceServicer_to_server(DelayedPredictionService(), server)
+    server.add_insecure_port('127.0.0.1:%d' % port)
+    server.start()
+    while True:
+        time.sleep(3600)
+
+
+def run(stub, mode, concurrency, calls):
+    from tensorflow_serving.apis.predict_pb2 import PredictRequest
+
+    cooperative_rpc = CooperativeRpc(mode, green=True)
+    request = PredictRequest()
+    request.model_spec.name = 'benchmark'
+
+    def predict(_):
+        cooperative_rpc.call(stub.Predict, request, 30.)
+
+    pool = eventlet.GreenPool(concurrency)
+    start_time = time.time()
+    for _ in pool.imap(predict, range(calls)):
+        pass
+    elapsed_secs = time.time() - start_time
+    return calls / elapsed_secs, cooperative_rpc.peak_inflight
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8599)
+    parser.add_argument('--delay-ms', type=float, default=50.)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--calls', type=int, default=512)
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.port, args.delay_ms / 1000.)
+        return
+
+    # Patched only in the client, like a gunicorn eventlet worker.
+    eventlet.monkey_patch()
+    import grpc
+    from tensorflow_serving.apis.prediction_service_pb2 import PredictionServiceStub
+
+    server = subprocess.Popen([sys.executable, '-m', __spec__.name, '--serve',
+                               '--port', str(args.port), '--delay-ms', str(args.delay_ms)])
+    try:
+        channel = grpc.insecure_channel('127.0.0.1:%d' % args.port)
+        grpc.channel_ready_future(channel).result(timeout=30)
+        stub = PredictionServiceStub(channel)
+        for mode in ('blocking', 'future', 'tpool'):
+            # Blocking calls are slow, fewer of them measure the same rate.
+            calls = args.concurrency if mode == 'blocking' else args.calls
+            throughput, peak_inflight = run(stub, mode, args.concurrency, calls)
+            print('%-8s %8.1f RPCs/s  peak in flight %4d' % (mode, throughput, peak_inflight))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""
+Compares the throughput and tail latency of oversubscribed worker processes
+with default native thread pools, with limited thread pools and pinned to CPUs.
+
+Starts as many processes as gunicorn starts workers by default, 4 per CPU, that
+drain a shared queue of CPU bound requests: decoding and resizing a JPEG with
+PIL, normalizing it with NumPy and a dense matrix product through BLAS, as a
+stand-in for the pre- and post-processing of a prediction. Runs offline
+without a model server:
+
+    python -m tf_serving_flask_app.benchmarks.cpu_layout_benchmark --requests 2000 --workers 32
+"""
+
+import argparse
+import io
+import multiprocessing
+import os
+import time
+from timeit import default_timer
+
+import numpy as np
+from PIL import Image
+
+from tf_serving_flask_app.core import cpu_layout
+
+
+def make_jpeg(size):
+    pixels = np.random.RandomState(0).randint(0, 256, (size, size, 3), dtype=np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(pixels).save(buf, format='JPEG', quality=90)
+    return buf.getvalue()
+
+
+def handle(jpeg, target_size, weights):
+    img = Image.open(io.BytesIO(jpeg)).convert('RGB').resize((target_size, target_size))
+    x = np.asarray(img, dtype=np.float32) / 255.
+    rows = min(x.size // weights.shape[0], weights.shape[0])
+    features = x.ravel()[:rows * weights.shape[0]].reshape(rows, weights.shape[0])
+    return np.dot(features, weights).sum()
+
+
+def run_worker(cpus, jpeg, target_size, matrix_size, requests, results, ready, start):
+    if cpus:
+        os.sched_setaffinity(0, cpus)
+    weights = np.random.RandomState(0).rand(matrix_size, matrix_size).astype(np.float32)
+    handle(jpeg, target_size, weights)
+    ready.release()
+    start.wait()
+    latencies = []
+    while requests.get() is not None:
+        start_time = default_timer()
+        handle(jpeg, target_size, weights)
+        latencies.append(default_timer() - start_time)
+    results.put(latencies)
+
+
+def set_native_threads(threads):
+    """Sets the thread pool sizes inherited by spawned processes, or clears
+    them for the library defaults."""
+    for name in cpu_layout.NATIVE_THREAD_ENV_VARS:
+        if threads > 0:
+            os.environ[name] = str(threads)
+        else:
+            os.environ.pop(name, None)
+
+
+def run(args, jpeg, layout, native_threads):
+    # Spawned processes load NumPy and BLAS afresh with the thread pool sizes
+    # of the environment.
+    set_native_threads(native_threads)
+    context = multiprocessing.get_context('spawn')
+    requests, results = context.Queue(), context.Queue()
+    ready, start = context.Semaphore(0), context.Event()
+    processes = []
+    for index in range(args.workers):
+        cpus = layout.slot(index)[1] if layout.enabled else None
+        process = context.Process(target=run_worker, args=(
+            cpus, jpeg, args.target_size, args.matrix_size, requests, results, ready, start))
+        process.start()
+        processes.append(process)
+    for _ in processes:
+        ready.acquire()
+
+    for _ in range(args.requests):
+        requests.put(True)
+    for _ in processes:
+        requests.put(None)
+    start_time = default_timer()
+    start.set()
+    latencies = []
+    for _ in processes:
+        latencies.extend(results.get())
+    elapsed_secs = default_timer() - start_time
+    for process in processes:
+        process.join()
+    return elapsed_secs, np.array(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count() * 4)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--image-size', type=int, default=640, help='Width and height of the source JPEG')
+    parser.add_argument('--target-size', type=int, default=299)
+    parser.add_argument('--matrix-size', type=int, default=512,
+                        help='Size of the square weights of the dense product')
+    parser.add_argument('--cpus-per-worker', type=int, default=1)
+    args = parser.parse_args()
+
+    jpeg = make_jpeg(args.image_size)
+    nodes = cpu_layout.numa_nodes(cpu_layout.allowed_cpus())
+    print('%d workers on %s' % (args.workers, ', '.join(
+        'node %d: %s' % (node, cpu_layout.format_cpu_list(cpus)) for (node, cpus) in nodes.items())))
+
+    configurations = [
+        ('unpinned, default threads', cpu_layout.CpuLayout(cpu_layout.NONE, nodes), 0),
+        ('unpinned, 1 thread', cpu_layout.CpuLayout(cpu_layout.NONE, nodes), 1),
+        ('pinned to CPUs, 1 thread', cpu_layout.CpuLayout(cpu_layout.CPU, nodes, args.cpus_per_worker), 1),
+    ]
+    if len(nodes) > 1:
+        configurations.append(('pinned to NUMA nodes, 1 thread', cpu_layout.CpuLayout(cpu_layout.NUMA, nodes), 1))
+
+    for (name, layout, native_threads) in configurations:
+        elapsed_secs, latencies = run(args, jpeg, layout, native_threads)
+        print('%-32s %8.1f requests/s  p50 %7.2f ms  p99 %7.2f ms  max %7.2f ms' % (
+            name, len(latencies) / elapsed_secs, np.percentile(latencies, 50) * 1000.,
+            np.percentile(latencies, 99) * 1000., latencies.max() * 1000.))
+        time.sleep(1.)
+
+
+if __name__ == '__main__':
+    main()
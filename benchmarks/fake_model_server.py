@@ -0,0 +1,131 @@
+"""
+Serves a fake TensorFlow serving prediction service for load and replay
+tests without a model.
+
+GetModelMetadata returns a signature built from the command line, so the
+Flask application validates its spec on startup as against a real model
+server. Predict answers after a configurable delay with tensors of the
+declared outputs. Their leading -1 dimension is the batch size of the
+request. Run it next to the Flask application pointed at it through
+TF_SERVER_NAME and TF_SERVER_PORT:
+
+    python -m tf_serving_flask_app.benchmarks.fake_model_server --port 9000 \
+        --input images:float32 --output scores:float32:-1,1001 --delay-ms 20 --jitter-ms 5
+"""
+
+import argparse
+import logging
+import time
+from concurrent import futures
+
+import grpc
+import numpy as np
+import tensorflow as tf
+from tensorflow_serving.apis import prediction_service_pb2
+from tensorflow_serving.apis.get_model_metadata_pb2 import GetModelMetadataResponse, SignatureDefMap
+from tensorflow_serving.apis.predict_pb2 import PredictResponse
+
+from tf_serving_flask_app.core.model_metadata import DEFAULT_SERVING_SIGNATURE_DEF_KEY
+
+logger = logging.getLogger('benchmarks')
+
+
+def parse_tensor(value):
+    """Parses `<name>:<dtype>[:<comma separated dims>]`, e.g. `scores:float32:-1,1001`."""
+    fields = value.split(':')
+    shape = tuple(int(dim) for dim in fields[2].split(',')) if len(fields) > 2 and fields[2] else ()
+    return fields[0], np.dtype(fields[1]), shape
+
+
+class FakePredictionService(prediction_service_pb2.PredictionServiceServicer):
+    """Answers metadata requests with a fixed signature and predictions with
+    random tensors after a normally distributed delay.
+
+    :param inputs: a list of `(name, dtype, shape)` triples of the signature inputs.
+    :param outputs: a list of `(name, dtype, shape)` triples of the outputs.
+    :param signature_name: the name of the served signature.
+    :param delay_secs: the mean delay of a prediction.
+    :param jitter_secs: the standard deviation of the delay.
+    :param seed: the seed of the delays and output values.
+    """
+
+    def __init__(self, inputs, outputs, signature_name=DEFAULT_SERVING_SIGNATURE_DEF_KEY,
+                 delay_secs=0., jitter_secs=0., seed=0):
+        self.outputs = outputs
+        self.signature_name = signature_name
+        self.delay_secs = delay_secs
+        self.jitter_secs = jitter_secs
+        self.random = np.random.RandomState(seed)
+        self.signature_def_map = SignatureDefMap()
+        signature_def = self.signature_def_map.signature_def[signature_name]
+        for (tensors, signature_tensors) in ((inputs, signature_def.inputs), (outputs, signature_def.outputs)):
+            for (name, dtype, shape) in tensors:
+                tensor_info = signature_tensors[name]
+                tensor_info.name = name + ':0'
+                tensor_info.dtype = tf.as_dtype(dtype).as_datatype_enum
+                for dim in shape:
+                    tensor_info.tensor_shape.dim.add(size=dim)
+
+    def GetModelMetadata(self, request, context):
+        response = GetModelMetadataResponse()
+        response.model_spec.CopyFrom(request.model_spec)
+        response.metadata['signature_def'].Pack(self.signature_def_map)
+        return response
+
+    def Predict(self, request, context):
+        delay_secs = self.delay_secs + self.jitter_secs * self.random.standard_normal()
+        if delay_secs > 0:
+            time.sleep(delay_secs)
+
+        batch_size = 1
+        for input_tensor in request.inputs.values():
+            if input_tensor.tensor_shape.dim:
+                batch_size = input_tensor.tensor_shape.dim[0].size
+                break
+
+        response = PredictResponse()
+        response.model_spec.CopyFrom(request.model_spec)
+        response.model_spec.signature_name = self.signature_name
+        output_filter = set(request.output_filter)
+        for (name, dtype, shape) in self.outputs:
+            if output_filter and name not in output_filter:
+                continue
+            shape = tuple(batch_size if dim < 0 else dim for dim in shape)
+            ndarray = self.random.random_sample(shape).astype(dtype)
+            response.outputs[name].CopyFrom(tf.contrib.util.make_tensor_proto(ndarray))
+        return response
+
+
+def serve(service, port, max_workers=64):
+    """Starts a gRPC server for the service and returns it."""
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=max_workers))
+    prediction_service_pb2.add_PredictionServiceServicer_to_server(service, server)
+    server.add_insecure_port('0.0.0.0:%d' % port)
+    server.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--input', action='append', type=parse_tensor, default=[],
+                        help='A signature input as `<name>:<dtype>[:<dims>]`, repeatable')
+    parser.add_argument('--output', action='append', type=parse_tensor, default=[],
+                        help='A signature output as `<name>:<dtype>[:<dims>]`, repeatable')
+    parser.add_argument('--signature-name', default=DEFAULT_SERVING_SIGNATURE_DEF_KEY)
+    parser.add_argument('--delay-ms', type=float, default=0.)
+    parser.add_argument('--jitter-ms', type=float, default=0.)
+    parser.add_argument('--max-workers', type=int, default=64)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    service = FakePredictionService(args.input, args.output, args.signature_name,
+                                    args.delay_ms / 1000., args.jitter_ms / 1000.)
+    serve(service, args.port, args.max_workers)
+    logger.info('Serving a fake model on port %d', args.port)
+    while True:
+        time.sleep(3600)
+
+
+if __name__ == '__main__':
+    main()
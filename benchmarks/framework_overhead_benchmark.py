@@ -0,0 +1,73 @@
+"""
+Measures the per-request framework overhead of the flask-restplus prediction
+resource against the WSGI fast path.
+
+The prediction flow is replaced with one that returns an empty result so that
+only routing, dispatch, request parsing and response serialization are timed.
+Runs offline without a model server:
+
+    python -m tf_serving_flask_app.benchmarks.framework_overhead_benchmark -s /tmp/models/inceptionv3.spec
+"""
+
+import argparse
+import io
+from timeit import default_timer
+
+import numpy as np
+from werkzeug.test import EnvironBuilder
+
+from spec.proto.input_pb2 import Input
+from tf_serving_flask_app import app as flask_app
+from tf_serving_flask_app.rest import api
+from tf_serving_flask_app.rest.fast_path import FastPredictionMiddleware
+from tf_serving_flask_app.core.spec_borg import SpecBorg
+
+
+def build_environ(payload_bytes):
+    data = {}
+    for (input_key, input_spec) in SpecBorg().input_specs.items():
+        if input_spec.type == Input.TEXT:
+            data[input_key] = 'benchmark'
+        else:
+            data[input_key] = (io.BytesIO(b'\0' * payload_bytes), input_key)
+    return EnvironBuilder(path='/predict', method='POST', data=data).get_environ()
+
+
+def run(wsgi_app, payload_bytes, iterations):
+    timings = []
+    for _ in range(iterations):
+        environ = build_environ(payload_bytes)
+        start_time = default_timer()
+        body = b''.join(wsgi_app(environ, lambda status, headers, exc_info=None: None))
+        timings.append(default_timer() - start_time)
+        assert body == b'{}', body
+    return np.array(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--spec', required=True,
+                        help='Fully qualified path to the pipeline specification in JSON')
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--payload-bytes', type=int, default=100 * 1024)
+    args = parser.parse_args()
+
+    app = flask_app.bootstrap_app(args.spec, initialize=False)
+    # Isolates the framework from the prediction flow.
+    api.create_prediction_flow = lambda: (lambda prediction_flow_input, *args, **kwargs: {})
+
+    configurations = [
+        ('flask-restplus', app.wsgi_app),
+        ('fast path', FastPredictionMiddleware(app.wsgi_app)),
+    ]
+    for (name, wsgi_app) in configurations:
+        timings = run(wsgi_app, args.payload_bytes, args.iterations)
+        print('%-15s p50 %7.3f ms  p99 %7.3f ms  mean %7.3f ms' % (
+            name,
+            np.percentile(timings, 50) * 1000.,
+            np.percentile(timings, 99) * 1000.,
+            timings.mean() * 1000.))
+
+
+if __name__ == '__main__':
+    main()
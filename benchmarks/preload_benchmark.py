@@ -0,0 +1,93 @@
+"""
+Compares the memory footprint and worker spawn time of gunicorn with and
+without a preloaded application.
+
+Starts gunicorn with the production configuration for each mode, waits for
+all workers to be spawned and sums the proportional set size (PSS) of the
+master and its workers. Unlike RSS, PSS divides pages shared copy-on-write
+between the processes sharing them.
+
+    python -m tf_serving_flask_app.benchmarks.preload_benchmark --spec /tmp/models/inceptionv3.spec --workers 8
+"""
+
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+from tf_serving_flask_app.base.utils import humansize
+
+DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def children(pid):
+    try:
+        with open('/proc/%d/task/%d/children' % (pid, pid)) as f:
+            return [int(child) for child in f.read().split()]
+    except IOError:
+        return []
+
+
+def memory_kb(pid, field):
+    """Reads a memory field like `Pss` or `Rss` in kB from smaps_rollup."""
+    with open('/proc/%d/smaps_rollup' % pid) as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+    return 0
+
+
+def measure(spec, workers, preload, timeout_secs):
+    env = dict(os.environ)
+    env['GUNICORN_PRELOAD_APP'] = '1' if preload else '0'
+    env['prometheus_multiproc_dir'] = tempfile.mkdtemp()
+    env['PYTHONPATH'] = os.path.dirname(DIR)
+    start_time = time.time()
+    master = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn',
+         '-c', os.path.join(DIR, 'gunicorn_config.py'),
+         '--workers', str(workers),
+         "tf_serving_flask_app.wsgi:app(spec='%s')" % spec],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        # Measures the time until the master has forked every worker, which
+        # includes loading the application in the master when preloading.
+        spawn_secs = None
+        while time.time() - start_time < timeout_secs:
+            if len(children(master.pid)) >= workers:
+                spawn_secs = time.time() - start_time
+                break
+            time.sleep(0.05)
+        # Let the workers finish loading and warming up.
+        time.sleep(5)
+        pids = [master.pid] + children(master.pid)
+        return {
+            'spawn_secs': spawn_secs,
+            'pss_bytes': sum(memory_kb(pid, 'Pss') for pid in pids) * 1024,
+            'rss_bytes': sum(memory_kb(pid, 'Rss') for pid in pids) * 1024,
+        }
+    finally:
+        master.send_signal(signal.SIGTERM)
+        master.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--spec', required=True,
+                        help='Fully qualified path to the pipeline specification in JSON')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--timeout', type=float, default=300.)
+    args = parser.parse_args()
+
+    for preload in (False, True):
+        result = measure(args.spec, args.workers, preload, args.timeout)
+        print('preload=%-5s workers %d  spawn %6.2fs  total PSS %10s  total RSS %10s' % (
+            preload, args.workers, result['spawn_secs'] or float('nan'),
+            humansize(result['pss_bytes']), humansize(result['rss_bytes'])))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+"""
+Replays captured production traffic against a Flask application and reports
+latency distributions end to end and per stage of the prediction flow.
+
+Requests are sent in the order they were captured across workers, at their
+original inter-arrival times divided by `--rate-scale` or at a fixed
+`--rate`. Stage latencies are computed from the difference of the Prometheus
+histograms of the instance before and after the replay. Back the instance
+with `fake_model_server` to test the Flask application in isolation:
+
+    python -m tf_serving_flask_app.benchmarks.replay_traffic --capture-dir /tmp/traffic-capture \
+        --url http://localhost:5001 --metrics-url http://localhost:5002/metrics --rate-scale 2
+"""
+
+import argparse
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from prometheus_client.parser import text_string_to_metric_families
+
+from tf_serving_flask_app.rest import traffic_capture
+
+STAGE_HISTOGRAMS = (
+    ('admission', 'scheduler_queue_wait_seconds'),
+    ('preprocess', 'preprocessor_request_duration_seconds'),
+    ('predict', 'model_prediction_duration_seconds'),
+    ('postprocess', 'postprocessor_request_duration_seconds'),
+    ('request', 'prediction_request_duration_seconds'),
+)
+
+
+def encode_multipart(header, inputs):
+    """Encodes the inputs of a captured request as multipart form data.
+
+    :return: a tuple of the body and its content type.
+    """
+    boundary = uuid.uuid4().hex
+    parts = []
+    for entry in header['inputs']:
+        disposition = 'form-data; name="%s"' % entry['key']
+        lines = []
+        if entry['kind'] == traffic_capture.FILE:
+            disposition += '; filename="%s"' % (entry['filename'] or entry['key'])
+            lines.append('Content-Type: %s' % (entry['content_type'] or 'application/octet-stream'))
+        lines.insert(0, 'Content-Disposition: %s' % disposition)
+        parts.append(b'--%s\r\n%s\r\n\r\n%s\r\n' % (
+            boundary.encode('ascii'), '\r\n'.join(lines).encode('utf-8'), inputs[entry['key']]))
+    parts.append(b'--%s--\r\n' % boundary.encode('ascii'))
+    return b''.join(parts), 'multipart/form-data; boundary=%s' % boundary
+
+
+def schedule(records, rate_scale=1., rate=None):
+    """Yields `(offset seconds, header, inputs)` triples of the records at
+    their captured inter-arrival times divided by `rate_scale`, or at a fixed
+    rate per second."""
+    first_time = None
+    for (i, (header, inputs)) in enumerate(records):
+        if rate:
+            offset_secs = i / float(rate)
+        else:
+            if first_time is None:
+                first_time = header['time']
+            offset_secs = (header['time'] - first_time) / rate_scale
+        yield offset_secs, header, inputs
+
+
+def scrape_histograms(metrics_url, names):
+    """Returns the buckets, sum and count of the named histograms summed over their labels.
+
+    :return: a dict from histogram name to a dict with the `buckets` as a dict
+    from upper bound to cumulative count, the `sum` and the `count`.
+    """
+    if not metrics_url:
+        return {}
+    with urllib.request.urlopen(metrics_url) as response:
+        text = response.read().decode('utf-8')
+    histograms = dict((name, {'buckets': defaultdict(float), 'sum': 0., 'count': 0.}) for name in names)
+    for family in text_string_to_metric_families(text):
+        if family.name not in histograms:
+            continue
+        histogram = histograms[family.name]
+        for sample in family.samples:
+            name, labels, value = sample[0], sample[1], sample[2]
+            if name.endswith('_bucket'):
+                histogram['buckets'][float(labels['le'])] += value
+            elif name.endswith('_sum'):
+                histogram['sum'] += value
+            elif name.endswith('_count'):
+                histogram['count'] += value
+    return histograms
+
+
+def histogram_quantile(q, buckets):
+    """Estimates a quantile from cumulative buckets by linear interpolation
+    within the bucket it falls in, like Prometheus' histogram_quantile."""
+    bounds = sorted(buckets)
+    if not bounds or buckets[bounds[-1]] <= 0:
+        return float('nan')
+    rank = q * buckets[bounds[-1]]
+    lower_bound, lower_count = 0., 0.
+    for bound in bounds:
+        count = buckets[bound]
+        if count >= rank:
+            if bound == float('inf'):
+                return lower_bound
+            if count == lower_count:
+                return bound
+            return lower_bound + (bound - lower_bound) * (rank - lower_count) / (count - lower_count)
+        lower_bound, lower_count = bound, count
+    return bounds[-1]
+
+
+def histogram_delta(before, after):
+    if not before:
+        return after
+    return {
+        'buckets': dict((bound, count - before['buckets'].get(bound, 0.))
+                        for (bound, count) in after['buckets'].items()),
+        'sum': after['sum'] - before['sum'],
+        'count': after['count'] - before['count'],
+    }
+
+
+def send(url, header, inputs, timeout_secs):
+    """Sends a captured request and returns its status and latency."""
+    path = '/predict' + ('/' + urllib.parse.quote(header['priority']) if header.get('priority') else '')
+    if header.get('outputs'):
+        path += '?' + urllib.parse.urlencode({'outputs': ','.join(header['outputs'])})
+    body, content_type = encode_multipart(header, inputs)
+    request = urllib.request.Request(url.rstrip('/') + path, data=body, method='POST')
+    request.add_header('Content-Type', content_type)
+    if header.get('accept'):
+        request.add_header('Accept', header['accept'])
+    start_time = time.time()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout_secs) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except Exception:
+        status = 'error'
+    return status, time.time() - start_time
+
+
+def replay(scheduled, url, concurrency, timeout_secs):
+    """Sends the scheduled requests and returns `(status, latency, lateness)`
+    triples, the lateness being how far behind schedule a request was sent."""
+    results = []
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        start_time = time.time()
+        futures = []
+        for (offset_secs, header, inputs) in scheduled:
+            lateness_secs = time.time() - start_time - offset_secs
+            if lateness_secs < 0:
+                time.sleep(-lateness_secs)
+                lateness_secs = 0.
+            futures.append((executor.submit(send, url, header, inputs, timeout_secs), lateness_secs))
+        for (future, lateness_secs) in futures:
+            status, latency_secs = future.result()
+            results.append((status, latency_secs, lateness_secs))
+    return results
+
+
+def format_distribution(name, count, mean, quantiles):
+    return '%-12s n %7d  mean %8.2f ms  p50 %8.2f ms  p90 %8.2f ms  p99 %8.2f ms' % (
+        (name, count, mean * 1000.) + tuple(quantile * 1000. for quantile in quantiles))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--capture-dir', required=True)
+    parser.add_argument('--url', default='http://localhost:5001')
+    parser.add_argument('--metrics-url', default='http://localhost:5002/metrics',
+                        help='The Prometheus endpoint of the instance, empty to skip stage latencies')
+    parser.add_argument('--rate-scale', type=float, default=1.,
+                        help='Divides the captured inter-arrival times, 2 replays twice as fast')
+    parser.add_argument('--rate', type=float, default=None,
+                        help='Sends at a fixed rate per second instead of the captured times')
+    parser.add_argument('--limit', type=int, default=0, help='Replays at most this many requests')
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--timeout-secs', type=float, default=30.)
+    parser.add_argument('--settle-secs', type=float, default=3.,
+                        help='Waits out the scrape cache of the instance before the final scrape')
+    args = parser.parse_args()
+
+    records = traffic_capture.read_captures(args.capture_dir)
+    if args.limit:
+        records = (record for (_, record) in zip(range(args.limit), records))
+
+    names = [name for (_, name) in STAGE_HISTOGRAMS]
+    before = scrape_histograms(args.metrics_url, names)
+    start_time = time.time()
+    results = replay(schedule(records, args.rate_scale, args.rate), args.url, args.concurrency,
+                     args.timeout_secs)
+    elapsed_secs = time.time() - start_time
+    if args.metrics_url:
+        time.sleep(args.settle_secs)
+    after = scrape_histograms(args.metrics_url, names)
+    if not results:
+        print('No captured requests in %s' % args.capture_dir)
+        return
+
+    print('Replayed %d requests in %.1fs, %.1f requests/s' % (len(results), elapsed_secs,
+                                                              len(results) / elapsed_secs))
+    lateness = np.array([lateness_secs for (_, _, lateness_secs) in results])
+    print('Sent behind schedule by p99 %.2f ms, max %.2f ms' % (
+        np.percentile(lateness, 99) * 1000., lateness.max() * 1000.))
+
+    print('Client latency by status:')
+    latencies_by_status = defaultdict(list)
+    for (status, latency_secs, _) in results:
+        latencies_by_status[status].append(latency_secs)
+    for (status, latencies) in sorted(latencies_by_status.items(), key=lambda item: str(item[0])):
+        latencies = np.array(latencies)
+        print('  ' + format_distribution(str(status), len(latencies), latencies.mean(),
+                                         np.percentile(latencies, (50, 90, 99))))
+
+    if after:
+        print('Server latency by stage:')
+        for (stage, name) in STAGE_HISTOGRAMS:
+            delta = histogram_delta(before.get(name), after[name])
+            if delta['count'] <= 0:
+                continue
+            print('  ' + format_distribution(stage, delta['count'], delta['sum'] / delta['count'], [
+                histogram_quantile(q, delta['buckets']) for q in (.5, .9, .99)]))
+
+
+if __name__ == '__main__':
+    main()
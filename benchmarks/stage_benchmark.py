@@ -0,0 +1,264 @@
+"""
+Micro-benchmarks every stage of the prediction flow across representative
+input sizes and dtypes, and flags regressions against a saved baseline.
+
+Covers decoding and resizing images, converting arrays into tensor protocol
+buffers with `make_tensor_proto` and with compiled conversion plans,
+post-processing prediction responses, serializing results with the
+NumpyEncoder and the other response formats, and the overhead of the metrics
+decorators. Runs offline without a model server:
+
+    python -m tf_serving_flask_app.benchmarks.stage_benchmark --save /tmp/baseline.json
+    python -m tf_serving_flask_app.benchmarks.stage_benchmark --baseline /tmp/baseline.json
+
+Every case is timed in rounds of as many calls as fit in `--min-time-secs`,
+and the median time per call over the rounds is compared against the
+baseline. The process exits with status 1 when any case is slower than the
+baseline by more than `--threshold`. Set `prometheus_multiproc_dir` to time
+the metrics decorators against memory mapped values as in gunicorn.
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import sys
+import time
+from timeit import default_timer
+from types import SimpleNamespace
+
+import numpy as np
+from PIL import Image
+import tensorflow as tf
+from tensorflow_serving.apis.predict_pb2 import PredictRequest, PredictResponse
+
+from spec.proto.dtypes_pb2 import DT_FLOAT32
+from spec.proto.input_pb2 import Image as ImageSpec
+from spec.proto.model_pb2 import Model
+from tf_serving_flask_app.core import builtin_postprocessors
+from tf_serving_flask_app.core import conversion_plans
+from tf_serving_flask_app.core import metrics
+from tf_serving_flask_app.core.image_preprocessor import ImagePreprocessor
+from tf_serving_flask_app.core.postprocessor import PassthroughPostprocessor
+from tf_serving_flask_app.core.prediction_flow import PredictionFlow
+from tf_serving_flask_app.rest import response_formats
+
+IMAGE_SIZES = (224, 299, 512)
+# Source images are larger than the target so that resizing is timed as well.
+SOURCE_IMAGE_SCALE = 1.5
+
+OUTPUT_SHAPES = (
+    ('scores', (1, 1000)),
+    ('embedding', (1, 2048)),
+    ('boxes', (1, 100, 4)),
+    ('segmentation', (1, 128, 128, 21)),
+)
+
+
+def make_image(size, image_format):
+    pixels = np.random.RandomState(0).randint(0, 256, (size, size, 3), dtype=np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(pixels).save(buf, format=image_format)
+    return buf.getvalue()
+
+
+def image_cases(sizes):
+    for size in sizes:
+        image_spec = ImageSpec(colorspace=ImageSpec.RGB, target_width=size, target_height=size)
+        shape = [size, size, 3]
+        source_size = int(size * SOURCE_IMAGE_SCALE)
+        for image_format in ('JPEG', 'PNG'):
+            image = make_image(source_size, image_format)
+            for (dtype_name, transport_dtype) in (('float32', None), ('uint8', np.uint8)):
+                preprocessor = ImagePreprocessor(DT_FLOAT32, shape, image_spec, lambda x: x / 255.,
+                                                 Model.CHANNELS_LAST, transport_dtype=transport_dtype)
+                yield ('preprocess_image/%s/%d/%s' % (image_format.lower(), size, dtype_name),
+                       lambda preprocessor=preprocessor, image=image:
+                       preprocessor.preprocess_image(io.BytesIO(image)))
+
+
+def tensor_cases(sizes):
+    for size in sizes:
+        for dtype in (np.float32, np.uint8):
+            ndarray = np.random.RandomState(0).randint(0, 256, (1, size, size, 3)).astype(dtype)
+            yield ('make_tensor_proto/%d/%s' % (size, np.dtype(dtype).name),
+                   lambda ndarray=ndarray: tf.contrib.util.make_tensor_proto(ndarray))
+
+            plan = conversion_plans.ConversionPlan(
+                'image', dtype, ndarray.shape, False, None,
+                conversion_plans._template(dtype, ndarray.shape, False))
+
+            def convert(plan=plan, ndarray=ndarray):
+                request = PredictRequest()
+                plan.fill(request.inputs['image'], plan.prepare(ndarray))
+            yield 'conversion_plan/%d/%s' % (size, np.dtype(dtype).name), convert
+
+
+def postprocess_cases():
+    flow = PredictionFlow(prediction_rpc_timeout_secs=10)
+    for (output_key, shape) in OUTPUT_SHAPES:
+        response = PredictResponse()
+        ndarray = np.random.RandomState(0).rand(*shape).astype(np.float32)
+        response.outputs[output_key].CopyFrom(tf.contrib.util.make_tensor_proto(ndarray))
+        postprocessors = [('identity', PassthroughPostprocessor(lambda x: x))]
+        if len(shape) == 2:
+            postprocessors.append(('top_k', PassthroughPostprocessor(builtin_postprocessors.TopK(k=5))))
+        for (postprocessor_name, postprocessor) in postprocessors:
+            # Stands in for the spec borg so that no spec is needed.
+            spec_borg = SimpleNamespace(output_postprocessors={output_key: postprocessor})
+
+            def postprocess(spec_borg=spec_borg, response=response):
+                flow.spec_borg = spec_borg
+                return flow._postprocess_response(response)
+            yield '_postprocess_response/%s/%s' % (output_key, postprocessor_name), postprocess
+
+
+def serialize_cases():
+    for (output_key, shape) in OUTPUT_SHAPES:
+        results = {output_key: np.random.RandomState(0).rand(*shape).astype(np.float32)}
+        for (format_name, mimetype) in (('json', response_formats.JSON),
+                                        ('msgpack', response_formats.MSGPACK),
+                                        ('npy', response_formats.NPY)):
+            yield ('serialize/%s/%s' % (format_name, output_key),
+                   lambda results=results, mimetype=mimetype: response_formats.serialize(results, mimetype))
+
+    top_k = builtin_postprocessors.TopK(k=5)(np.random.RandomState(0).rand(1, 1000).astype(np.float32))
+    yield ('serialize/json/top_k',
+           lambda: response_formats.serialize({'scores': top_k}, response_formats.JSON))
+
+
+def metrics_cases():
+    def noop():
+        return None
+
+    yield 'metrics/undecorated', noop
+    yield 'metrics/histogram', metrics.histogram(
+        'stage_benchmark_histogram_seconds', 'Benchmarks the histogram decorator')(noop)
+    yield 'metrics/histogram_labels', metrics.histogram(
+        'stage_benchmark_labeled_histogram_seconds', 'Benchmarks the labeled histogram decorator',
+        labels={'input': 'image'})(noop)
+    yield 'metrics/counter', metrics.counter(
+        'stage_benchmark_calls_total', 'Benchmarks the counter decorator')(noop)
+    yield 'metrics/gauge', metrics.gauge(
+        'stage_benchmark_inprogress', 'Benchmarks the gauge decorator')(noop)
+
+
+def build_cases(sizes):
+    """Returns `(name, callable)` pairs of every benchmarked case in a stable order."""
+    cases = []
+    for group in (image_cases(sizes), tensor_cases(sizes), postprocess_cases(), serialize_cases(),
+                  metrics_cases()):
+        cases.extend(group)
+    return cases
+
+
+def measure(fn, min_time_secs, rounds):
+    """Times `fn` in rounds of as many calls as fit in `min_time_secs`.
+
+    :return: a dict with the number of calls per round and the median, min and
+    max time per call over the rounds in seconds.
+    """
+    fn()
+    number = 1
+    while True:
+        start_time = default_timer()
+        for _ in range(number):
+            fn()
+        elapsed_secs = default_timer() - start_time
+        if elapsed_secs >= min_time_secs:
+            break
+        number *= 2 if elapsed_secs <= 0 else max(2, min(10, int(min_time_secs / elapsed_secs) + 1))
+
+    timings = [elapsed_secs / number]
+    for _ in range(rounds - 1):
+        start_time = default_timer()
+        for _ in range(number):
+            fn()
+        timings.append((default_timer() - start_time) / number)
+    return {
+        'number': number,
+        'median_secs': float(np.median(timings)),
+        'min_secs': min(timings),
+        'max_secs': max(timings),
+    }
+
+
+def compare(results, baseline, threshold, noise_floor_secs):
+    """Compares the median time per call of every case against the baseline.
+
+    :return: a list of `(name, baseline secs, secs, ratio)` tuples of the cases
+    slower than the baseline by more than the threshold and the noise floor.
+    """
+    regressions = []
+    for (name, result) in results.items():
+        if name not in baseline:
+            continue
+        baseline_secs = baseline[name]['median_secs']
+        secs = result['median_secs']
+        if secs - baseline_secs > noise_floor_secs and secs > baseline_secs * (1. + threshold):
+            regressions.append((name, baseline_secs, secs, secs / baseline_secs))
+    return regressions
+
+
+def environment():
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'tensorflow': tf.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default=','.join(str(size) for size in IMAGE_SIZES),
+                        help='Comma separated widths and heights of square images and tensors')
+    parser.add_argument('--filter', default='', help='Runs only the cases whose name contains this')
+    parser.add_argument('--min-time-secs', type=float, default=.2, help='Minimum duration of a round')
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--save', help='Writes the results as JSON to this path')
+    parser.add_argument('--baseline', help='Compares the results against the JSON results at this path')
+    parser.add_argument('--threshold', type=float, default=.1,
+                        help='Flags cases slower than the baseline by more than this fraction')
+    parser.add_argument('--noise-floor-us', type=float, default=1.,
+                        help='Ignores differences from the baseline below this many microseconds')
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    results = {}
+    for (name, fn) in build_cases(sizes):
+        if args.filter not in name:
+            continue
+        result = measure(fn, args.min_time_secs, args.rounds)
+        results[name] = result
+        line = '%-48s %10.1f us  (min %10.1f us, %d calls x %d rounds)' % (
+            name, result['median_secs'] * 1e6, result['min_secs'] * 1e6, result['number'], args.rounds)
+        if name in baseline:
+            line += '  %+6.1f%%' % ((result['median_secs'] / baseline[name]['median_secs'] - 1.) * 100.)
+        print(line)
+        sys.stdout.flush()
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'environment': environment(), 'results': results}, f, indent=2, sort_keys=True)
+        print('Saved %d results to %s' % (len(results), args.save))
+
+    if baseline:
+        regressions = compare(results, baseline, args.threshold, args.noise_floor_us / 1e6)
+        for (name, baseline_secs, secs, ratio) in regressions:
+            print('REGRESSION %s: %.1f us -> %.1f us (%.2fx)' % (name, baseline_secs * 1e6, secs * 1e6, ratio))
+        if regressions:
+            sys.exit(1)
+        print('No regressions against %s beyond %.0f%%' % (args.baseline, args.threshold * 100.))
+
+
+if __name__ == '__main__':
+    main()
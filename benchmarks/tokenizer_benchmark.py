@@ -0,0 +1,114 @@
+"""
+Compares the built-in tokenizer looking tokens up in a memory-mapped hash
+index against a pure Python tokenizer looking them up in a dict.
+
+Reports the latency of converting a text to a fixed-shape array of token ids
+and the per worker memory of the vocabulary, which for the built-in tokenizer
+lives in the page cache shared by all workers. Runs offline with a synthetic
+vocabulary:
+
+    python -m tf_serving_flask_app.benchmarks.tokenizer_benchmark --vocab-size 100000 --words 200
+"""
+
+import argparse
+import os
+import re
+import shutil
+import tempfile
+import tracemalloc
+from timeit import default_timer
+
+import numpy as np
+
+from tf_serving_flask_app.base.utils import humansize
+from tf_serving_flask_app.core import builtin_preprocessors
+
+
+class DictTokenizer(object):
+    """The typical user supplied tokenizer the built-in replaces."""
+
+    def __init__(self, vocab_path, max_length):
+        with open(vocab_path, encoding='utf-8') as f:
+            self.vocab = {line.rstrip('\n'): i for (i, line) in enumerate(f)}
+        self.max_length = max_length
+
+    def __call__(self, text):
+        ids = [self.vocab.get(token, 1) for token in re.findall(r"\w+|[^\w\s]", text.lower())]
+        ids = ids[:self.max_length] + [0] * (self.max_length - len(ids))
+        return np.array(ids, dtype=np.int32)
+
+
+def make_vocabulary(path, vocab_size, random_state):
+    letters = np.array(list('abcdefghijklmnopqrstuvwxyz'))
+    tokens = set()
+    while len(tokens) < vocab_size:
+        length = random_state.randint(2, 12)
+        tokens.add(''.join(random_state.choice(letters, length)))
+    tokens = ['[PAD]', '[UNK]'] + sorted(tokens)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(tokens) + '\n')
+    return tokens
+
+
+def allocated_bytes(factory):
+    tracemalloc.start()
+    instance = factory()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return instance, size
+
+
+def run(tokenizer, texts):
+    timings = []
+    for text in texts:
+        start_time = default_timer()
+        tokenizer(text)
+        timings.append(default_timer() - start_time)
+    return np.array(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--vocab-size', type=int, default=100000)
+    parser.add_argument('--words', type=int, default=200, help='Words per text')
+    parser.add_argument('--max-length', type=int, default=256)
+    parser.add_argument('--iterations', type=int, default=2000)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        random_state = np.random.RandomState(0)
+        vocab_path = os.path.join(tmpdir, 'vocab.txt')
+        tokens = make_vocabulary(vocab_path, args.vocab_size, random_state)
+        texts = [' '.join(random_state.choice(tokens[2:], args.words)) + '.'
+                 for _ in range(args.iterations)]
+
+        start_time = default_timer()
+        builtin_preprocessors.build_vocabulary_index(vocab_path)
+        print('Built the index of %d tokens in %.3fs' % (len(tokens), default_timer() - start_time))
+
+        dict_tokenizer, dict_bytes = allocated_bytes(
+            lambda: DictTokenizer(vocab_path, args.max_length))
+        builtin_tokenizer, builtin_bytes = allocated_bytes(
+            lambda: builtin_preprocessors.Tokenize(vocab_path, max_length=args.max_length))
+        for text in texts[:10]:
+            np.testing.assert_array_equal(dict_tokenizer(text), builtin_tokenizer(text))
+
+        configurations = [
+            ('dict', dict_tokenizer, dict_bytes),
+            ('builtin', builtin_tokenizer, builtin_bytes),
+        ]
+        for (name, tokenizer, heap_bytes) in configurations:
+            timings = run(tokenizer, texts)
+            print('%-8s p50 %7.3f ms  p99 %7.3f ms  mean %7.3f ms  private heap per worker %10s' % (
+                name,
+                np.percentile(timings, 50) * 1000.,
+                np.percentile(timings, 99) * 1000.,
+                timings.mean() * 1000.,
+                humansize(heap_bytes)))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Compares shipping an image as a normalized float32 tensor against shipping
+it as a uint8 tensor that the served model normalizes.
+
+Reports the serialized tensor size and the client side latency of
+pre-processing and marshaling a tensor protocol buffer. Runs offline without
+a model server:
+
+    python -m tf_serving_flask_app.benchmarks.transport_dtype_benchmark --size 299
+"""
+
+import argparse
+import io
+from timeit import default_timer
+
+import numpy as np
+from PIL import Image
+import tensorflow as tf
+
+from spec.proto.dtypes_pb2 import DT_FLOAT32
+from spec.proto.input_pb2 import Image as ImageSpec
+from spec.proto.model_pb2 import Model
+from tf_serving_flask_app.base.utils import humansize
+from tf_serving_flask_app.core.image_preprocessor import ImagePreprocessor
+
+
+def make_jpeg(size):
+    pixels = np.random.RandomState(0).randint(0, 256, (size, size, 3), dtype=np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(pixels).save(buf, format='JPEG', quality=90)
+    return buf.getvalue()
+
+
+def run(preprocessor, jpeg, iterations):
+    timings = []
+    payload_bytes = 0
+    for _ in range(iterations):
+        start_time = default_timer()
+        ndarray = preprocessor.preprocess(io.BytesIO(jpeg))
+        payload_bytes = len(tf.contrib.util.make_tensor_proto(ndarray).SerializeToString())
+        timings.append(default_timer() - start_time)
+    return payload_bytes, np.array(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=299, help='Width and height of the image')
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    image_spec = ImageSpec(colorspace=ImageSpec.RGB,
+                           target_width=args.size,
+                           target_height=args.size)
+    shape = [1, args.size, args.size, 3]
+    jpeg = make_jpeg(args.size)
+
+    configurations = [
+        ('float32', ImagePreprocessor(DT_FLOAT32, shape, image_spec, lambda x: x / 255.,
+                                      Model.CHANNELS_LAST)),
+        ('uint8', ImagePreprocessor(DT_FLOAT32, shape, image_spec, lambda x: x / 255.,
+                                    Model.CHANNELS_LAST, transport_dtype=np.uint8)),
+    ]
+    for (name, preprocessor) in configurations:
+        payload_bytes, timings = run(preprocessor, jpeg, args.iterations)
+        print('%-8s payload %10s  p50 %7.3f ms  p99 %7.3f ms' % (
+            name, humansize(payload_bytes),
+            np.percentile(timings, 50) * 1000., np.percentile(timings, 99) * 1000.))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,433 @@
+"""
+Scores a dataset offline through the prediction pipeline of a spec without
+going through the REST API.
+
+Records are streamed from a directory of files or a JSONL manifest through a
+generator pipeline: inputs are pre-processed concurrently, converted by the
+conversion plans compiled against the served signature on startup, joined
+into batches along the batch axis of the signature and sent in batched
+Predict RPCs, and the post-processed results are written incrementally to a
+JSONL file or `.npy` shards. Records already present in the output are skipped, so an interrupted
+run resumes where it stopped when started again with the same output.
+
+    python -m tf_serving_flask_app.bulk_score -s /tmp/models/inceptionv3.spec \\
+        --input /data/images --output /data/scores --batch-size 32
+
+A manifest holds one JSON object per line with an `id` and a value per input
+key: a path relative to the manifest for IMAGE and FILE inputs, or the text of
+TEXT inputs. A directory can only be scored by specs with a single IMAGE or
+FILE input.
+"""
+
+import argparse
+import collections
+import itertools
+import json
+import logging.config
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from timeit import default_timer
+
+import numpy as np
+
+from spec.proto.input_pb2 import Input
+from tf_serving_flask_app import settings
+from tf_serving_flask_app.app import bootstrap_spec, validate_model_signature
+from tf_serving_flask_app.base.encoders import NumpyEncoder
+from tf_serving_flask_app.base.exceptions import NotAcceptableError, PreprocessorError
+from tf_serving_flask_app.core.prediction_flow import create_prediction_flow
+from tf_serving_flask_app.core.spec_borg import SpecBorg
+from tf_serving_flask_app.rest.api import parse_output_filter
+from tf_serving_flask_app.rest.response_formats import flatten_results
+
+logger = logging.getLogger('core')
+
+ERRORS_FILENAME = 'errors.jsonl'
+
+
+def iter_directory(input_dir, input_key):
+    """Yields `(record id, record)` for every file under a directory in a
+    stable order, with the path relative to the directory as the record id."""
+    for (root, dirs, filenames) in os.walk(input_dir):
+        dirs.sort()
+        for filename in sorted(filenames):
+            path = os.path.join(root, filename)
+            yield os.path.relpath(path, input_dir), {input_key: path}
+
+
+def iter_manifest(manifest_path, id_field='id'):
+    """Yields `(record id, record)` for every line of a JSONL manifest, with
+    the line number as the record id of lines without an id."""
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_path))
+    spec_borg = SpecBorg()
+    with open(manifest_path, encoding='utf-8') as f:
+        for (line_number, line) in enumerate(f):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            record_id = str(record.pop(id_field, line_number))
+            for (input_key, input_spec) in spec_borg.input_specs.items():
+                if input_spec.type != Input.TEXT and input_key in record:
+                    record[input_key] = os.path.join(manifest_dir, record[input_key])
+            yield record_id, record
+
+
+def preprocess_record(record):
+    """Pre-processes every input of a record into a numpy array.
+
+    :return: a dict from input key to numpy array.
+    :raises KeyError for a missing input and PreprocessorError or
+    BadInputError for a failure pre-processing an input.
+    """
+    spec_borg = SpecBorg()
+    input_ndarrays = {}
+    for (input_key, input_spec) in spec_borg.input_specs.items():
+        preprocessor = spec_borg.input_preprocessors[input_key]
+        if input_spec.type == Input.TEXT:
+            input_ndarrays[input_key] = preprocessor.preprocess(record[input_key])
+        else:
+            with open(record[input_key], 'rb') as f:
+                input_ndarrays[input_key] = preprocessor.preprocess(f)
+    return input_ndarrays
+
+
+def preprocess_records(records, executor, lookahead):
+    """Pre-processes records concurrently, keeping at most `lookahead` records
+    in flight, and yields `(record id, input arrays or exception)` in order."""
+    pending = collections.deque()
+
+    def submit(record_id, record):
+        pending.append((record_id, executor.submit(preprocess_record, record)))
+
+    for (record_id, record) in itertools.islice(records, lookahead):
+        submit(record_id, record)
+    while pending:
+        record_id, future = pending.popleft()
+        next_record = next(records, None)
+        if next_record is not None:
+            submit(*next_record)
+        exception = future.exception()
+        yield record_id, exception if exception is not None else future.result()
+
+
+def batches(preprocessed, batch_size):
+    """Groups successfully pre-processed records into lists of at most
+    `batch_size` and passes failures through as single element lists."""
+    batch = []
+    for (record_id, input_ndarrays) in preprocessed:
+        if isinstance(input_ndarrays, Exception):
+            yield [(record_id, input_ndarrays)]
+            continue
+        batch.append((record_id, input_ndarrays))
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def stack_batch(batch):
+    """Converts the inputs of a batch like a single prediction would, in the
+    served dtype and layout, and joins them along the batch axis of the served
+    tensors, which is added when the spec shape lacks it.
+
+    :return: a dict from input key to the batched array or None if the inputs
+    differ in shape or have no batch axis of their own and cannot be batched.
+    :raises PreprocessorError if an input does not fit the served signature.
+    """
+    conversion_plans = SpecBorg().input_conversion_plans
+    stacked = {}
+    for input_key in batch[0][1]:
+        batched = conversion_plans[input_key].prepare_batch(
+            [input_ndarrays[input_key] for (_, input_ndarrays) in batch])
+        if batched is None:
+            return None
+        stacked[input_key] = batched
+    return stacked
+
+
+def split_outputs(output_ndarrays, batch_length):
+    """Splits batched outputs into per record outputs keeping a leading axis of
+    1, the shape post-processors see for a single prediction."""
+    per_record = [{} for _ in range(batch_length)]
+    for (output_key, ndarray) in output_ndarrays.items():
+        batched = ndarray.ndim and ndarray.shape[0] == batch_length
+        for (i, record_outputs) in enumerate(per_record):
+            record_outputs[output_key] = ndarray[i:i + 1] if batched else ndarray
+    return per_record
+
+
+def score_batch(prediction_flow, batch, output_keys=None):
+    """Predicts a batch in a single RPC, or record by record if it cannot be
+    batched, and post-processes the outputs of every record.
+
+    :return: a list of `(record id, results or exception)`.
+    """
+    if isinstance(batch[0][1], Exception):
+        return batch
+
+    try:
+        stacked = stack_batch(batch)
+    except PreprocessorError as e:
+        if len(batch) == 1:
+            return [(batch[0][0], e)]
+        # Only the records that do not fit the signature fail.
+        stacked = None
+    if stacked is None:
+        return [scored for record in batch for scored in score_batch(prediction_flow, [record], output_keys)]
+
+    try:
+        output_ndarrays = prediction_flow.predict_ndarrays(stacked, output_keys)
+    except Exception as e:
+        return [(record_id, e) for (record_id, _) in batch]
+
+    scored = []
+    for ((record_id, _), record_outputs) in zip(batch, split_outputs(output_ndarrays, len(batch))):
+        try:
+            scored.append((record_id, prediction_flow.postprocess_ndarrays(record_outputs)))
+        except Exception as e:
+            scored.append((record_id, e))
+    return scored
+
+
+def score_batches(prediction_flow, batched, executor, max_inflight_batches, output_keys=None):
+    """Keeps up to `max_inflight_batches` Predict RPCs in flight and yields
+    `(record id, results or exception)` in order."""
+    pending = collections.deque()
+    for batch in batched:
+        pending.append(executor.submit(score_batch, prediction_flow, batch, output_keys))
+        if len(pending) >= max_inflight_batches:
+            yield from pending.popleft().result()
+    while pending:
+        yield from pending.popleft().result()
+
+
+class JsonlWriter(object):
+    """Appends one `{"id": ..., "results": ...}` line per record to `results.jsonl`."""
+
+    def __init__(self, output_dir):
+        self.path = os.path.join(output_dir, 'results.jsonl')
+        # A partially written last line of an interrupted run is dropped.
+        if os.path.exists(self.path):
+            with open(self.path, 'rb+') as f:
+                content = f.read()
+                f.truncate(content.rfind(b'\n') + 1)
+        self.f = open(self.path, 'a', encoding='utf-8')
+
+    def done_ids(self):
+        with open(self.path, encoding='utf-8') as f:
+            return set(json.loads(line)['id'] for line in f if line.strip())
+
+    def write(self, record_id, results):
+        self.f.write(json.dumps({'id': record_id, 'results': results}, cls=NumpyEncoder) + '\n')
+
+    def flush(self):
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+class NpyShardWriter(object):
+    """Writes every `shard_size` records into a `shard-<n>` directory holding
+    the record ids and one `.npy` file per flattened output key, with the
+    record axis first.
+
+    Shards are written to a temporary directory and renamed once complete, so
+    an interrupted run never leaves a partial shard behind. Every record must
+    have the output keys and shapes of the first record of the run, e.g. not
+    a variable number of detections, since outputs are stacked.
+    """
+
+    def __init__(self, output_dir, shard_size):
+        self.output_dir = output_dir
+        self.shard_size = shard_size
+        for name in os.listdir(output_dir):
+            if name.startswith('shard-') and name.endswith('.tmp'):
+                shutil.rmtree(os.path.join(output_dir, name))
+        self.shard_dirs = sorted(name for name in os.listdir(output_dir) if name.startswith('shard-'))
+        self.buffer = []
+        # A dict from output key to the shape of the outputs of every record.
+        self.shapes = None
+
+    def done_ids(self):
+        ids = set()
+        for shard_dir in self.shard_dirs:
+            with open(os.path.join(self.output_dir, shard_dir, 'ids.json'), encoding='utf-8') as f:
+                ids.update(json.load(f))
+        return ids
+
+    def write(self, record_id, results):
+        """Buffers the results of a record.
+
+        :raises NotAcceptableError if the outputs of the record differ in keys
+        or shapes from the records before.
+        """
+        arrays = flatten_results(results)
+        shapes = dict((key, np.shape(value)) for (key, value) in arrays.items())
+        if self.shapes is None:
+            self.shapes = shapes
+        elif shapes != self.shapes:
+            raise NotAcceptableError('Outputs %s cannot be stacked with the outputs %s of the records before, '
+                                     'use the jsonl format for outputs that vary in shape' % (
+                                         sorted(shapes.items()), sorted(self.shapes.items())))
+        self.buffer.append((record_id, arrays))
+        if len(self.buffer) >= self.shard_size:
+            self.flush_shard()
+
+    def flush_shard(self):
+        if not self.buffer:
+            return
+        shard_dir = os.path.join(self.output_dir, 'shard-%05d' % len(self.shard_dirs))
+        tmp_dir = shard_dir + '.tmp'
+        # Left behind by a failed attempt at writing this shard.
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        with open(os.path.join(tmp_dir, 'ids.json'), 'w', encoding='utf-8') as f:
+            json.dump([record_id for (record_id, _) in self.buffer], f)
+        for key in self.buffer[0][1]:
+            ndarray = np.stack([arrays[key] for (_, arrays) in self.buffer])
+            np.save(os.path.join(tmp_dir, '%s.npy' % key.replace('/', '.')), ndarray, allow_pickle=False)
+        os.rename(tmp_dir, shard_dir)
+        self.shard_dirs.append(os.path.basename(shard_dir))
+        self.buffer = []
+
+    def flush(self):
+        # Shards are only written once full, see `flush_shard`.
+        pass
+
+    def close(self):
+        self.flush_shard()
+
+
+class ThroughputReporter(object):
+    """Logs the progress and throughput of a run at most every `interval_secs`."""
+
+    def __init__(self, interval_secs, total=None):
+        self.interval_secs = interval_secs
+        self.total = total
+        self.start_time = self.last_report_time = default_timer()
+        self.scored = 0
+        self.failed = 0
+
+    def update(self, failed=False):
+        self.scored += 1
+        self.failed += failed
+        now = default_timer()
+        if now - self.last_report_time >= self.interval_secs:
+            self.last_report_time = now
+            self.report()
+
+    def report(self):
+        elapsed = max(default_timer() - self.start_time, 1e-9)
+        rate = self.scored / elapsed
+        progress = ''
+        if self.total:
+            remaining = max(self.total - self.scored, 0)
+            progress = ' of %d, ETA %.0fs' % (self.total, remaining / rate if rate else float('inf'))
+        logger.info('Scored %d records%s (%d failed) in %.1fs at %.1f records/s',
+                    self.scored, progress, self.failed, elapsed, rate)
+
+
+def open_records(args):
+    spec_borg = SpecBorg()
+    if os.path.isdir(args.input):
+        file_inputs = [input_key for (input_key, input_spec) in spec_borg.input_specs.items()
+                       if input_spec.type != Input.TEXT]
+        if len(spec_borg.input_specs) != 1 or len(file_inputs) != 1:
+            raise ValueError('Scoring a directory requires a spec with a single IMAGE or FILE '
+                             'input, use a JSONL manifest instead')
+        return iter_directory(args.input, file_inputs[0])
+    return iter_manifest(args.input, args.id_field)
+
+
+def score(args):
+    os.makedirs(args.output, exist_ok=True)
+    if args.format == 'jsonl':
+        writer = JsonlWriter(args.output)
+    else:
+        writer = NpyShardWriter(args.output, args.shard_size)
+    done_ids = writer.done_ids()
+    if done_ids:
+        logger.info('Resuming, skipping %d records already in "%s"', len(done_ids), args.output)
+
+    total = None
+    if args.count:
+        total = sum(1 for (record_id, _) in open_records(args) if record_id not in done_ids)
+    records = ((record_id, record) for (record_id, record) in open_records(args)
+               if record_id not in done_ids)
+
+    output_keys = parse_output_filter(args.outputs, SpecBorg())
+    prediction_flow = create_prediction_flow()
+    reporter = ThroughputReporter(args.report_interval, total)
+    errors = open(os.path.join(args.output, ERRORS_FILENAME), 'a', encoding='utf-8')
+    with ThreadPoolExecutor(args.preprocessor_threads) as preprocessor_executor, \
+            ThreadPoolExecutor(args.max_inflight_batches) as prediction_executor:
+        preprocessed = preprocess_records(records, preprocessor_executor,
+                                          lookahead=args.batch_size * (args.max_inflight_batches + 1))
+        scored = score_batches(prediction_flow, batches(preprocessed, args.batch_size),
+                               prediction_executor, args.max_inflight_batches, output_keys)
+        try:
+            for (record_id, results) in scored:
+                if not isinstance(results, Exception):
+                    try:
+                        writer.write(record_id, results)
+                    except NotAcceptableError as e:
+                        results = e
+                failed = isinstance(results, Exception)
+                if failed:
+                    # Failed records are not marked done and are retried on resume.
+                    errors.write(json.dumps({'id': record_id, 'error': '%s: %s' % (
+                        type(results).__name__, results)}) + '\n')
+                reporter.update(failed)
+                if reporter.scored % args.batch_size == 0:
+                    writer.flush()
+                    errors.flush()
+        finally:
+            writer.close()
+            errors.close()
+            reporter.report()
+    return reporter
+
+
+def main():
+    dirname = os.path.split(__file__)[0]
+    env = os.getenv('FLASK_ENV', settings.DEFAULT_FLASK_ENV)
+    assert env in ('production', 'development')
+    logging.config.fileConfig(os.path.join(dirname, '%s_logging.conf' % env))
+
+    parser = argparse.ArgumentParser(description='Scores a dataset offline through the prediction pipeline')
+    parser.add_argument('-s', '--spec', required=True,
+                        help='Fully qualified path to the pipeline specification in JSON')
+    parser.add_argument('--input', required=True,
+                        help='A directory of input files or a JSONL manifest of records')
+    parser.add_argument('--output', required=True,
+                        help='The output directory, existing results in it are skipped')
+    parser.add_argument('--format', choices=('jsonl', 'npy'), default='jsonl')
+    parser.add_argument('--outputs', default='',
+                        help='Comma separated subset of the outputs to compute and write')
+    parser.add_argument('--id-field', default='id', help='The record id field of manifest lines')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--max-inflight-batches', type=int, default=2,
+                        help='Batched Predict RPCs in flight at once')
+    parser.add_argument('--preprocessor-threads', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--shard-size', type=int, default=10000, help='Records per .npy shard')
+    parser.add_argument('--report-interval', type=float, default=10.,
+                        help='Seconds between throughput reports')
+    parser.add_argument('--count', action='store_true',
+                        help='Counts the records upfront to report progress and an ETA')
+    args = parser.parse_args()
+
+    bootstrap_spec(args.spec)
+    # Compiles the conversion plans against the served signature and fails
+    # fast on a mismatch instead of on every batch.
+    validate_model_signature()
+    reporter = score(args)
+    if reporter.failed:
+        logger.warning('%d records failed, see "%s" and rerun to retry them',
+                       reporter.failed, os.path.join(args.output, ERRORS_FILENAME))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+import unittest
+
+import numpy as np
+
+from tf_serving_flask_app import bulk_score
+from tf_serving_flask_app.base.exceptions import PreprocessorError
+from tf_serving_flask_app.core.conversion_plans import ConversionPlan, UNKNOWN_DIM
+from tf_serving_flask_app.core.spec_borg import SpecBorg
+
+
+class FakePredictionFlow(object):
+    """Records the batches it predicts and scores every record by the sum of its image."""
+
+    def __init__(self):
+        self.batches = []
+
+    def predict_ndarrays(self, input_ndarrays, output_keys=None):
+        self.batches.append(input_ndarrays)
+        image = input_ndarrays['image']
+        return {'scores': image.reshape(len(image), -1).sum(axis=1, keepdims=True)}
+
+    def postprocess_ndarrays(self, output_ndarrays):
+        return output_ndarrays
+
+
+def record(record_id, shape, value=1):
+    return record_id, {'image': np.full(shape, value, dtype=np.uint8)}
+
+
+class TestScoreBatch(unittest.TestCase):
+    def setUp(self):
+        self.spec_borg = SpecBorg()
+        self.conversion_plans = getattr(self.spec_borg, 'input_conversion_plans', None)
+        self.prediction_flow = FakePredictionFlow()
+
+    def tearDown(self):
+        self.spec_borg.input_conversion_plans = self.conversion_plans
+
+    def set_plan(self, shape, add_batch_axis, transpose_axes=None):
+        self.spec_borg.input_conversion_plans = {
+            'image': ConversionPlan('image', np.float32, shape, add_batch_axis, transpose_axes, None)}
+
+    def test_spec_without_batch_axis(self):
+        # A spec shape of [2, 2, 3] served as [-1, 3, 2, 2].
+        self.set_plan((3, 2, 2), True, (2, 0, 1))
+        scored = bulk_score.score_batch(self.prediction_flow, [record('a', (2, 2, 3)), record('b', (2, 2, 3), 2)])
+        self.assertEqual(len(self.prediction_flow.batches), 1)
+        image = self.prediction_flow.batches[0]['image']
+        self.assertEqual((image.dtype, image.shape), (np.float32, (2, 3, 2, 2)))
+        self.assertEqual([record_id for (record_id, _) in scored], ['a', 'b'])
+        np.testing.assert_array_equal(scored[0][1]['scores'], [[12.]])
+        np.testing.assert_array_equal(scored[1][1]['scores'], [[24.]])
+
+    def test_spec_with_batch_axis(self):
+        self.set_plan((1, 2, 2, 3), False)
+        bulk_score.score_batch(self.prediction_flow, [record('a', (1, 2, 2, 3)), record('b', (1, 2, 2, 3))])
+        self.assertEqual(self.prediction_flow.batches[0]['image'].shape, (2, 2, 2, 3))
+
+    def test_records_of_different_shapes_are_predicted_one_by_one(self):
+        self.set_plan((1, UNKNOWN_DIM, UNKNOWN_DIM, 3), False)
+        scored = bulk_score.score_batch(self.prediction_flow, [record('a', (1, 2, 2, 3)), record('b', (1, 3, 3, 3))])
+        self.assertEqual([batch['image'].shape for batch in self.prediction_flow.batches],
+                         [(1, 2, 2, 3), (1, 3, 3, 3)])
+        np.testing.assert_array_equal(scored[1][1]['scores'], [[27.]])
+
+    def test_records_not_fitting_the_signature_fail_alone(self):
+        self.set_plan((3, 2, 2), True, (2, 0, 1))
+        scored = bulk_score.score_batch(self.prediction_flow, [record('a', (2, 2, 3)), record('b', (3, 3, 3))])
+        self.assertEqual(self.prediction_flow.batches[0]['image'].shape, (1, 3, 2, 2))
+        self.assertEqual(scored[0][0], 'a')
+        self.assertIsInstance(scored[1][1], PreprocessorError)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,269 @@
+"""
+Scales the gunicorn workers between bounds at runtime from the aggregate load
+of the workers.
+
+A supervisor thread in the gunicorn master periodically reads the admitted
+and queued predictions of all workers and the prediction latency from the
+multiprocess metrics, and the accept backlog of the listening sockets from
+`/proc/net/tcp`. It adds a worker with SIGTTIN or retires the oldest one with
+SIGTTOU, the signals gunicorn itself handles. Scaling up needs the load to
+stay high for a few consecutive intervals and scaling down for many, and no
+decision is taken within a cooldown of the last one, so short bursts do not
+make the worker count flap.
+"""
+
+import logging
+import math
+import os
+import signal
+import threading
+import time
+
+from tf_serving_flask_app import settings
+from tf_serving_flask_app.base.utils import as_boolean
+from tf_serving_flask_app.core import metrics
+
+logger = logging.getLogger('core')
+
+autoscaler_workers = metrics.create_gauge(
+    'autoscaler_workers',
+    'Number of gunicorn workers targeted by the autoscaler',
+    multiprocess_mode='max')
+autoscaler_load_per_worker = metrics.create_gauge(
+    'autoscaler_load_per_worker',
+    'In flight and queued predictions per worker seen by the autoscaler',
+    multiprocess_mode='max')
+autoscaler_decisions_total = metrics.create_counter(
+    'autoscaler_decisions_total',
+    'Number of scaling decisions of the autoscaler',
+    labelnames=('direction', 'reason'))
+
+_TCP_LISTEN_STATE = '0A'
+
+
+def listen_backlog(ports, proc_net_paths=('/proc/net/tcp', '/proc/net/tcp6')):
+    """Returns the connections waiting to be accepted on listening sockets
+    bound to `ports`, the receive queue of a socket in the LISTEN state."""
+    backlog = 0
+    for path in proc_net_paths:
+        try:
+            with open(path) as f:
+                next(f)
+                for line in f:
+                    fields = line.split()
+                    local_address, state, queues = fields[1], fields[3], fields[4]
+                    if state != _TCP_LISTEN_STATE or int(local_address.rsplit(':', 1)[1], 16) not in ports:
+                        continue
+                    backlog += int(queues.split(':')[1], 16)
+        except (IOError, StopIteration):
+            continue
+    return backlog
+
+
+class AutoscalePolicy(object):
+    """Decides on scaling from the load of the workers with hysteresis.
+
+    :param min_workers: the lower bound of workers.
+    :param max_workers: the upper bound of workers.
+    :param target_load_per_worker: the in flight and queued predictions a
+    worker is sized for.
+    :param backlog_threshold: accept backlog above which workers are added.
+    :param latency_threshold_secs: mean prediction latency above which
+    workers are added, 0 to ignore latency.
+    :param scale_up_intervals: consecutive overloaded intervals before scaling up.
+    :param scale_down_intervals: consecutive underloaded intervals before scaling down.
+    :param cooldown_secs: the minimum time between two scaling decisions.
+    :param scale_down_load_ratio: the fraction of the target load below which
+    the workers are underloaded.
+    """
+
+    def __init__(self,
+                 min_workers,
+                 max_workers,
+                 target_load_per_worker,
+                 backlog_threshold,
+                 latency_threshold_secs=0.,
+                 scale_up_intervals=2,
+                 scale_down_intervals=12,
+                 cooldown_secs=30.,
+                 scale_down_load_ratio=.3):
+        assert 0 < min_workers <= max_workers
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.target_load_per_worker = target_load_per_worker
+        self.backlog_threshold = backlog_threshold
+        self.latency_threshold_secs = latency_threshold_secs
+        self.scale_up_intervals = scale_up_intervals
+        self.scale_down_intervals = scale_down_intervals
+        self.cooldown_secs = cooldown_secs
+        self.scale_down_load_ratio = scale_down_load_ratio
+        self.overloaded_intervals = 0
+        self.underloaded_intervals = 0
+        self.last_decision_time = None
+
+    def _overload_reason(self, workers, load, backlog, latency_secs):
+        if load > self.target_load_per_worker * workers:
+            return 'load'
+        if backlog > self.backlog_threshold:
+            return 'backlog'
+        if self.latency_threshold_secs and latency_secs is not None \
+                and latency_secs > self.latency_threshold_secs:
+            return 'latency'
+        return None
+
+    def _is_underloaded(self, workers, load, backlog, latency_secs):
+        return load < self.target_load_per_worker * self.scale_down_load_ratio * workers \
+            and backlog == 0 \
+            and not (self.latency_threshold_secs and latency_secs is not None
+                     and latency_secs > self.latency_threshold_secs / 2.)
+
+    def decide(self, workers, load, backlog, latency_secs, now):
+        """Returns the change in workers and the reason for it.
+
+        :param workers: the current number of workers.
+        :param load: the in flight and queued predictions of all workers.
+        :param backlog: the connections waiting to be accepted.
+        :param latency_secs: the mean prediction latency over the last
+        interval or None without predictions.
+        :param now: the monotonic time of the decision.
+        :return: a tuple of the worker delta and the reason, `(0, None)` to hold.
+        """
+        if workers < self.min_workers:
+            return self.min_workers - workers, 'min_workers'
+        if workers > self.max_workers:
+            return self.max_workers - workers, 'max_workers'
+
+        reason = self._overload_reason(workers, load, backlog, latency_secs)
+        if reason:
+            self.overloaded_intervals += 1
+            self.underloaded_intervals = 0
+        elif self._is_underloaded(workers, load, backlog, latency_secs):
+            self.underloaded_intervals += 1
+            self.overloaded_intervals = 0
+        else:
+            self.overloaded_intervals = self.underloaded_intervals = 0
+
+        if self.last_decision_time is not None and now - self.last_decision_time < self.cooldown_secs:
+            return 0, None
+
+        delta = 0
+        if self.overloaded_intervals >= self.scale_up_intervals and workers < self.max_workers:
+            # Sizes up for the load at once, by at least one worker for backlog or latency.
+            needed = int(math.ceil(load / float(self.target_load_per_worker))) - workers
+            delta = min(max(needed, 1), self.max_workers - workers)
+        elif self.underloaded_intervals >= self.scale_down_intervals and workers > self.min_workers:
+            # Retires workers one at a time since spawning them again is slow.
+            delta, reason = -1, 'idle'
+
+        if delta:
+            self.last_decision_time = now
+            self.overloaded_intervals = self.underloaded_intervals = 0
+            return delta, reason
+        return 0, None
+
+
+class Autoscaler(object):
+    """Supervises the workers of a gunicorn arbiter on a daemon thread.
+
+    :param server: the gunicorn arbiter.
+    :param policy: the AutoscalePolicy deciding on scaling.
+    :param interval_secs: how often the load is sampled.
+    """
+
+    def __init__(self, server, policy, interval_secs):
+        self.server = server
+        self.policy = policy
+        self.interval_secs = interval_secs
+        self.ports = set()
+        for listener in server.LISTENERS:
+            address = listener.sock.getsockname()
+            if isinstance(address, tuple):
+                self.ports.add(address[1])
+        self.last_latency_totals = None
+
+    def start(self):
+        thread = threading.Thread(target=self._run, name='autoscaler')
+        thread.daemon = True
+        thread.start()
+        logger.info('Started autoscaling between %d and %d workers',
+                    self.policy.min_workers, self.policy.max_workers)
+
+    def _mean_latency(self, totals):
+        """Returns the mean prediction latency since the last sample."""
+        current = (totals['prediction_request_duration_seconds_sum'],
+                   totals['prediction_request_duration_seconds_count'])
+        last, self.last_latency_totals = self.last_latency_totals, current
+        if last is None or current[1] <= last[1]:
+            return None
+        return (current[0] - last[0]) / (current[1] - last[1])
+
+    def sample(self):
+        totals = metrics.collect_multiprocess_totals((
+            'scheduler_inflight',
+            'scheduler_queued',
+            'prediction_request_duration_seconds_sum',
+            'prediction_request_duration_seconds_count'))
+        load = totals['scheduler_inflight'] + totals['scheduler_queued']
+        return load, listen_backlog(self.ports), self._mean_latency(totals)
+
+    def scale(self, delta):
+        sig = signal.SIGTTIN if delta > 0 else signal.SIGTTOU
+        for _ in range(abs(delta)):
+            os.kill(os.getpid(), sig)
+            # Pending signals of the same kind coalesce, give the arbiter
+            # time to handle each one.
+            time.sleep(.1)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval_secs)
+            try:
+                workers = self.server.num_workers
+                load, backlog, latency_secs = self.sample()
+                autoscaler_workers.set(workers)
+                autoscaler_load_per_worker.set(load / float(max(workers, 1)))
+                delta, reason = self.policy.decide(workers, load, backlog, latency_secs, time.monotonic())
+                if delta:
+                    direction = 'up' if delta > 0 else 'down'
+                    autoscaler_decisions_total.labels(direction=direction, reason=reason).inc()
+                    logger.info('Scaling %s from %d to %d workers for %s, load %.1f, backlog %d, '
+                                'latency %s', direction, workers, workers + delta, reason, load, backlog,
+                                '%.3fs' % latency_secs if latency_secs is not None else 'n/a')
+                    self.scale(delta)
+            except Exception as e:
+                logger.exception(e)
+
+
+def start_autoscaler(server, configured_workers):
+    """Starts the autoscaler in the gunicorn master when AUTOSCALE_ENABLED is set.
+
+    :param server: the gunicorn arbiter.
+    :param configured_workers: the `workers` setting, the default upper bound.
+    :return: the started Autoscaler or None.
+    """
+    if not as_boolean(os.getenv('AUTOSCALE_ENABLED', settings.DEFAULT_AUTOSCALE_ENABLED)):
+        return None
+
+    min_workers = int(os.getenv('AUTOSCALE_MIN_WORKERS', settings.DEFAULT_AUTOSCALE_MIN_WORKERS)) \
+        or os.cpu_count() or 1
+    max_workers = int(os.getenv('AUTOSCALE_MAX_WORKERS', settings.DEFAULT_AUTOSCALE_MAX_WORKERS)) \
+        or configured_workers
+    policy = AutoscalePolicy(
+        min_workers=min(min_workers, max_workers),
+        max_workers=max_workers,
+        target_load_per_worker=float(os.getenv(
+            'AUTOSCALE_TARGET_LOAD_PER_WORKER', settings.DEFAULT_AUTOSCALE_TARGET_LOAD_PER_WORKER)),
+        backlog_threshold=int(os.getenv(
+            'AUTOSCALE_BACKLOG_THRESHOLD', settings.DEFAULT_AUTOSCALE_BACKLOG_THRESHOLD)),
+        latency_threshold_secs=float(os.getenv(
+            'AUTOSCALE_LATENCY_THRESHOLD_SECS', settings.DEFAULT_AUTOSCALE_LATENCY_THRESHOLD_SECS)),
+        scale_up_intervals=int(os.getenv(
+            'AUTOSCALE_SCALE_UP_INTERVALS', settings.DEFAULT_AUTOSCALE_SCALE_UP_INTERVALS)),
+        scale_down_intervals=int(os.getenv(
+            'AUTOSCALE_SCALE_DOWN_INTERVALS', settings.DEFAULT_AUTOSCALE_SCALE_DOWN_INTERVALS)),
+        cooldown_secs=float(os.getenv(
+            'AUTOSCALE_COOLDOWN_SECS', settings.DEFAULT_AUTOSCALE_COOLDOWN_SECS)))
+    autoscaler = Autoscaler(server, policy, float(os.getenv(
+        'AUTOSCALE_INTERVAL_SECS', settings.DEFAULT_AUTOSCALE_INTERVAL_SECS)))
+    autoscaler.start()
+    return autoscaler
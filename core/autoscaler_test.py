@@ -0,0 +1,57 @@
+import os
+import tempfile
+import unittest
+
+from tf_serving_flask_app.core import autoscaler
+
+PROC_NET_TCP = '''  sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt   uid  timeout inode
+   0: 00000000:1389 00000000:0000 0A 00000000:00000007 00:00000000 00000000     0        0 1 1 0 100 0 0 10 0
+   1: 00000000:138A 00000000:0000 0A 00000000:00000003 00:00000000 00000000     0        0 2 1 0 100 0 0 10 0
+   2: 0100007F:1389 0100007F:D2F0 01 00000000:00000010 00:00000000 00000000     0        0 3 1 0 20 4 30 10 -1
+'''
+
+
+class TestAutoscaler(unittest.TestCase):
+    def test_listen_backlog(self):
+        fd, path = tempfile.mkstemp()
+        with os.fdopen(fd, 'w') as f:
+            f.write(PROC_NET_TCP)
+        try:
+            # Port 5001 is 0x1389, established connections do not count.
+            self.assertEqual(autoscaler.listen_backlog({5001}, (path, '/nonexistent')), 7)
+        finally:
+            os.remove(path)
+
+    def test_scale_up_after_consecutive_overloaded_intervals(self):
+        policy = autoscaler.AutoscalePolicy(2, 10, target_load_per_worker=4, backlog_threshold=16,
+                                            scale_up_intervals=2, cooldown_secs=30)
+        self.assertEqual(policy.decide(2, 20, 0, None, now=0), (0, None))
+        self.assertEqual(policy.decide(2, 20, 0, None, now=5), (3, 'load'))
+        # Cooldown.
+        self.assertEqual(policy.decide(5, 40, 0, None, now=10), (0, None))
+        self.assertEqual(policy.decide(5, 40, 0, None, now=40), (5, 'load'))
+
+    def test_scale_up_for_backlog_and_latency(self):
+        policy = autoscaler.AutoscalePolicy(2, 3, target_load_per_worker=4, backlog_threshold=16,
+                                            latency_threshold_secs=1., scale_up_intervals=1, cooldown_secs=0)
+        self.assertEqual(policy.decide(2, 0, 17, None, now=0), (1, 'backlog'))
+        self.assertEqual(policy.decide(3, 0, 0, 2., now=1), (0, None))
+        policy.max_workers = 4
+        self.assertEqual(policy.decide(3, 0, 0, 2., now=2), (1, 'latency'))
+
+    def test_scale_down_with_hysteresis(self):
+        policy = autoscaler.AutoscalePolicy(2, 10, target_load_per_worker=4, backlog_threshold=16,
+                                            scale_down_intervals=3, cooldown_secs=0)
+        self.assertEqual(policy.decide(4, 0, 0, None, now=0), (0, None))
+        self.assertEqual(policy.decide(4, 0, 0, None, now=1), (0, None))
+        # A busy interval resets the count.
+        self.assertEqual(policy.decide(4, 8, 0, None, now=2), (0, None))
+        for now in (3, 4):
+            self.assertEqual(policy.decide(4, 0, 0, None, now=now), (0, None))
+        self.assertEqual(policy.decide(4, 0, 0, None, now=5), (-1, 'idle'))
+        policy.underloaded_intervals = 10
+        self.assertEqual(policy.decide(2, 0, 0, None, now=6), (0, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
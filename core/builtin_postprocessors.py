@@ -0,0 +1,304 @@
+"""
+Defines a library of vectorized post-processors that ship with the application
+and are selected from the spec with a `builtin:` prefix instead of an import path.
+
+Output level post-processors run over the numpy array of a single output tensor:
+
+- `builtin:softmax` and `builtin:sigmoid` apply the activation.
+- `builtin:top_k?k=5&activation=softmax&labels=/spec/labels.txt` returns the k
+  highest scores, their indices and optionally their labels.
+- `builtin:labels?labels=/spec/labels.txt` maps integer class ids to labels.
+
+Model level post-processors run over the dict of output numpy arrays:
+
+- `builtin:nms?boxes=detection_boxes&scores=detection_scores&iou_threshold=0.5`
+  optionally decodes box deltas against anchors and runs non-max suppression.
+"""
+
+import logging
+import mmap
+import threading
+
+import numpy as np
+
+logger = logging.getLogger('core')
+
+
+def softmax(x: np.ndarray, axis=-1):
+    """Numerically stable softmax along `axis`."""
+    x = np.asarray(x, dtype=np.float32)
+    e = np.exp(x - np.max(x, axis=axis, keepdims=True))
+    return e / np.sum(e, axis=axis, keepdims=True)
+
+
+def sigmoid(x: np.ndarray):
+    """Numerically stable logistic sigmoid."""
+    x = np.asarray(x, dtype=np.float32)
+    # exp(-|x|) never overflows and lets us branch on the sign without
+    # evaluating both sides of the piecewise definition.
+    z = np.exp(-np.abs(x))
+    return np.where(x >= 0, 1. / (1. + z), z / (1. + z))
+
+
+_ACTIVATIONS = {
+    'none': lambda x: x,
+    'softmax': softmax,
+    'sigmoid': sigmoid,
+}
+
+
+def _take_along_last_axis(x: np.ndarray, indices: np.ndarray):
+    """Gathers `x[..., indices]` row by row, the equivalent of
+    `np.take_along_axis(x, indices, axis=-1)` for numpy releases without it.
+    """
+    rows = x.reshape(-1, x.shape[-1])
+    row_indices = indices.reshape(-1, indices.shape[-1])
+    return rows[np.arange(len(rows))[:, np.newaxis], row_indices].reshape(indices.shape)
+
+
+def top_k(x: np.ndarray, k: int):
+    """Returns the `k` largest values along the last axis in descending order
+    along with their indices.
+
+    `np.argpartition` selects the top k in linear time and only the k selected
+    values are sorted, which is much cheaper than sorting 1000 class scores.
+    """
+    x = np.asarray(x)
+    k = min(k, x.shape[-1])
+    if k < x.shape[-1]:
+        indices = np.argpartition(x, -k, axis=-1)[..., -k:]
+    else:
+        indices = np.broadcast_to(np.arange(k), x.shape).copy()
+    values = _take_along_last_axis(x, indices)
+    order = np.argsort(-values, axis=-1)
+    return _take_along_last_axis(values, order), _take_along_last_axis(indices, order)
+
+
+class LabelMap(object):
+    """A memory-mapped label file with one label per line.
+
+    Only the line offsets are materialized, labels are decoded lazily from the
+    mapping so large vocabularies are shared across worker processes through
+    the page cache. Use `load_label_map` to load a file once per process.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        content = np.frombuffer(self._mmap, dtype=np.uint8)
+        newlines = np.flatnonzero(content == ord('\n'))
+        # A trailing newline does not start another label.
+        if len(content) and content[-1] != ord('\n'):
+            newlines = np.append(newlines, len(content))
+        self._ends = newlines
+        self._starts = np.concatenate(([0], newlines[:-1] + 1)) if len(newlines) else newlines
+
+    def __len__(self):
+        return len(self._ends)
+
+    def label(self, index: int):
+        return self._mmap[self._starts[index]:self._ends[index]].decode('utf-8').rstrip('\r')
+
+    def lookup(self, indices: np.ndarray):
+        """Maps an integer array of class ids to a nested list of labels with
+        the same shape. Out of range ids map to None.
+        """
+        indices = np.asarray(indices)
+        size = len(self)
+        flat = [self.label(i) if 0 <= i < size else None for i in indices.ravel().tolist()]
+        return np.array(flat, dtype=object).reshape(indices.shape).tolist()
+
+
+_label_maps = {}
+_label_maps_lock = threading.Lock()
+
+
+def load_label_map(path: str):
+    """Returns the process wide `LabelMap` for `path`, loading it on first use."""
+    with _label_maps_lock:
+        if path not in _label_maps:
+            _label_maps[path] = LabelMap(path)
+            logger.info('Loaded %d labels from "%s"', len(_label_maps[path]), path)
+        return _label_maps[path]
+
+
+def decode_boxes(deltas: np.ndarray, anchors: np.ndarray, scales=(10., 10., 5., 5.)):
+    """Decodes center-size box regression deltas `(ty, tx, th, tw)` against
+    anchors `(ymin, xmin, ymax, xmax)` into boxes `(ymin, xmin, ymax, xmax)`.
+    """
+    deltas = np.asarray(deltas, dtype=np.float32)
+    anchors = np.asarray(anchors, dtype=np.float32)
+    ha = anchors[..., 2] - anchors[..., 0]
+    wa = anchors[..., 3] - anchors[..., 1]
+    yca = anchors[..., 0] + ha / 2.
+    xca = anchors[..., 1] + wa / 2.
+
+    ty, tx, th, tw = [deltas[..., i] / scales[i] for i in range(4)]
+    h = np.exp(th) * ha
+    w = np.exp(tw) * wa
+    yc = ty * ha + yca
+    xc = tx * wa + xca
+    return np.stack([yc - h / 2., xc - w / 2., yc + h / 2., xc + w / 2.], axis=-1)
+
+
+def non_max_suppression(boxes: np.ndarray,
+                        scores: np.ndarray,
+                        iou_threshold=0.5,
+                        score_threshold=0.,
+                        max_detections=100):
+    """Greedy non-max suppression over boxes `(ymin, xmin, ymax, xmax)`.
+
+    Each iteration keeps the highest scoring remaining box and drops every
+    remaining box overlapping it by more than `iou_threshold` with a single
+    vectorized IoU computation.
+
+    :return: the indices of the kept boxes in descending score order.
+    """
+    boxes = np.asarray(boxes, dtype=np.float32)
+    scores = np.asarray(scores, dtype=np.float32)
+
+    candidates = np.flatnonzero(scores > score_threshold)
+    candidates = candidates[np.argsort(-scores[candidates], kind='mergesort')]
+
+    areas = np.maximum(boxes[:, 2] - boxes[:, 0], 0) * np.maximum(boxes[:, 3] - boxes[:, 1], 0)
+    keep = []
+    while len(candidates) and len(keep) < max_detections:
+        best = candidates[0]
+        keep.append(best)
+        rest = candidates[1:]
+        ymin = np.maximum(boxes[best, 0], boxes[rest, 0])
+        xmin = np.maximum(boxes[best, 1], boxes[rest, 1])
+        ymax = np.minimum(boxes[best, 2], boxes[rest, 2])
+        xmax = np.minimum(boxes[best, 3], boxes[rest, 3])
+        intersection = np.maximum(ymax - ymin, 0) * np.maximum(xmax - xmin, 0)
+        union = areas[best] + areas[rest] - intersection
+        iou = np.where(union > 0, intersection / np.maximum(union, 1e-12), 0.)
+        candidates = rest[iou <= iou_threshold]
+    return np.asarray(keep, dtype=np.int64)
+
+
+class Activation(object):
+    """Output post-processor applying an activation function."""
+
+    def __init__(self, activation='softmax'):
+        self.activation = _ACTIVATIONS[activation]
+
+    def __call__(self, x):
+        return self.activation(x)
+
+
+class TopK(object):
+    """Output post-processor returning the top k scores, class ids and labels."""
+
+    def __init__(self, k=5, activation='none', labels=None):
+        self.k = int(k)
+        self.activation = _ACTIVATIONS[activation]
+        self.label_map = load_label_map(labels) if labels else None
+
+    def __call__(self, x):
+        scores, indices = top_k(self.activation(x), self.k)
+        result = {'scores': scores, 'indices': indices}
+        if self.label_map is not None:
+            result['labels'] = self.label_map.lookup(indices)
+        return result
+
+
+class Labels(object):
+    """Output post-processor mapping class ids to labels."""
+
+    def __init__(self, labels):
+        self.label_map = load_label_map(labels)
+
+    def __call__(self, x):
+        return self.label_map.lookup(np.asarray(x).astype(np.int64))
+
+
+class NonMaxSuppression(object):
+    """Model post-processor that decodes and filters detection outputs.
+
+    Expects the output dict to contain boxes of shape `([1,] num_boxes, 4)` and
+    scores of shape `([1,] num_boxes)` or `([1,] num_boxes, num_classes)`. Class
+    ids are taken from the optional classes output or from the argmax of
+    per-class scores.
+
+    The outputs read are listed in `required_outputs`, which are fetched even
+    when a caller selects other outputs.
+    """
+
+    def __init__(self,
+                 boxes='detection_boxes',
+                 scores='detection_scores',
+                 classes=None,
+                 anchors=None,
+                 iou_threshold=0.5,
+                 score_threshold=0.,
+                 max_detections=100,
+                 labels=None):
+        self.boxes_key = boxes
+        self.scores_key = scores
+        self.classes_key = classes
+        self.required_outputs = tuple(key for key in (boxes, scores, classes) if key)
+        # Anchors are stored as a .npy file and memory-mapped so that all
+        # workers share the same pages.
+        self.anchors = np.load(anchors, mmap_mode='r') if anchors else None
+        self.iou_threshold = float(iou_threshold)
+        self.score_threshold = float(score_threshold)
+        self.max_detections = int(max_detections)
+        self.label_map = load_label_map(labels) if labels else None
+
+    def __call__(self, outputs):
+        boxes = np.asarray(outputs[self.boxes_key], dtype=np.float32)
+        scores = np.asarray(outputs[self.scores_key], dtype=np.float32)
+        # Squeeze the batch dimension of a single prediction.
+        if boxes.ndim == 3:
+            boxes = boxes[0]
+            scores = scores[0]
+        if self.anchors is not None:
+            boxes = decode_boxes(boxes, self.anchors)
+
+        if self.classes_key:
+            classes = np.asarray(outputs[self.classes_key]).reshape(-1).astype(np.int64)
+        elif scores.ndim == 2:
+            classes = np.argmax(scores, axis=-1)
+        else:
+            classes = np.zeros(len(scores), dtype=np.int64)
+        if scores.ndim == 2:
+            scores = np.max(scores, axis=-1)
+
+        keep = non_max_suppression(boxes, scores,
+                                   iou_threshold=self.iou_threshold,
+                                   score_threshold=self.score_threshold,
+                                   max_detections=self.max_detections)
+        result = {
+            'boxes': boxes[keep],
+            'scores': scores[keep],
+            'classes': classes[keep],
+        }
+        if self.label_map is not None:
+            result['labels'] = self.label_map.lookup(classes[keep])
+        return result
+
+
+# Maps the names usable after the `builtin:` prefix to callable classes
+# instantiated with the parameters from the spec string.
+output_postprocessors = {
+    'softmax': lambda **params: Activation('softmax'),
+    'sigmoid': lambda **params: Activation('sigmoid'),
+    'top_k': TopK,
+    'labels': Labels,
+}
+
+model_postprocessors = {
+    'nms': NonMaxSuppression,
+}
+
+
+def create(builtin_name, params, registry):
+    """Instantiates the built-in post-processor `builtin_name` from `registry`
+    with the string parameters parsed from the spec.
+    """
+    if builtin_name not in registry:
+        raise KeyError('Unknown built-in post-processor "%s", expected one of %s' %
+                       (builtin_name, sorted(registry)))
+    return registry[builtin_name](**params)
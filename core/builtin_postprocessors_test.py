@@ -0,0 +1,78 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from tf_serving_flask_app.base.dynamic_imports import parse_builtin
+from tf_serving_flask_app.core import builtin_postprocessors
+from tf_serving_flask_app.core.postprocessor import PassthroughPostprocessor
+
+
+class TestBuiltinPostprocessors(unittest.TestCase):
+    def setUp(self):
+        fd, self.labels_path = tempfile.mkstemp()
+        with os.fdopen(fd, 'w') as f:
+            f.write('cat\ndog\nbird\nfish')
+
+    def tearDown(self):
+        os.remove(self.labels_path)
+
+    def test_parse_builtin(self):
+        self.assertEqual(parse_builtin('builtin:top_k?k=3&labels=/a/b.txt'),
+                         ('top_k', {'k': '3', 'labels': '/a/b.txt'}))
+        self.assertEqual(parse_builtin('builtin:softmax'), ('softmax', {}))
+
+    def test_softmax_and_sigmoid(self):
+        x = np.array([[1000., 1000.], [0., np.log(3.)]], dtype=np.float32)
+        np.testing.assert_allclose(builtin_postprocessors.softmax(x),
+                                   [[.5, .5], [.25, .75]], rtol=1e-6)
+        np.testing.assert_allclose(builtin_postprocessors.sigmoid(np.array([-1000., 0., 1000.])),
+                                   [0., .5, 1.])
+
+    def test_top_k(self):
+        x = np.array([[.1, .4, .2, .3], [.9, .0, .06, .04]])
+        scores, indices = builtin_postprocessors.top_k(x, 2)
+        np.testing.assert_array_equal(indices, [[1, 3], [0, 2]])
+        np.testing.assert_allclose(scores, [[.4, .3], [.9, .06]])
+
+        scores, indices = builtin_postprocessors.top_k(x[0], 10)
+        np.testing.assert_array_equal(indices, [1, 3, 2, 0])
+
+    def test_top_k_with_labels(self):
+        postprocessor = builtin_postprocessors.create(
+            'top_k', {'k': '2', 'labels': self.labels_path},
+            builtin_postprocessors.output_postprocessors)
+        result = postprocessor(np.array([[.1, .2, .6, .1]]))
+        self.assertEqual(result['labels'], [['bird', 'dog']])
+
+    def test_label_map(self):
+        label_map = builtin_postprocessors.load_label_map(self.labels_path)
+        self.assertIs(label_map, builtin_postprocessors.load_label_map(self.labels_path))
+        self.assertEqual(len(label_map), 4)
+        self.assertEqual(label_map.lookup(np.array([3, 0, 7])), ['fish', 'cat', None])
+
+    def test_non_max_suppression(self):
+        boxes = np.array([[0, 0, 10, 10], [1, 1, 10, 10], [20, 20, 30, 30], [0, 0, 10, 9]])
+        scores = np.array([.9, .8, .7, .1])
+        keep = builtin_postprocessors.non_max_suppression(
+            boxes, scores, iou_threshold=.5, score_threshold=.2)
+        np.testing.assert_array_equal(keep, [0, 2])
+
+    def test_non_max_suppression_required_outputs(self):
+        nms = PassthroughPostprocessor(builtin_postprocessors.NonMaxSuppression(classes='detection_classes'))
+        self.assertEqual(nms.required_outputs, ('detection_boxes', 'detection_scores', 'detection_classes'))
+        self.assertEqual(PassthroughPostprocessor(lambda outputs: outputs).required_outputs, ())
+
+    def test_decode_boxes_identity_deltas(self):
+        anchors = np.array([[0., 0., 2., 4.]])
+        np.testing.assert_allclose(
+            builtin_postprocessors.decode_boxes(np.zeros((1, 4)), anchors), anchors)
+
+    def test_unknown_builtin(self):
+        with self.assertRaises(KeyError):
+            builtin_postprocessors.create('nope', {}, builtin_postprocessors.output_postprocessors)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,264 @@
+"""
+Defines a library of vectorized pre-processors that ship with the application
+and are selected from the spec with a `builtin:` prefix instead of an import path.
+
+Text pre-processors run over the string of a TEXT input:
+
+- `builtin:tokenize?vocab=/spec/vocab.txt&max_length=128` splits the text into
+  tokens, looks them up in a vocabulary and returns a fixed-shape int array of
+  token ids, padded or truncated to `max_length`.
+
+Vocabulary files contain one token per line and the line number is the token
+id. Tokens are looked up by a 64-bit FNV-1a hash in a sorted hash index that is
+built once next to the vocabulary as `.npy` files and memory-mapped, so all
+worker processes share the index through the page cache instead of each
+holding a dict of Python strings.
+"""
+
+import logging
+import os
+import re
+import tempfile
+import threading
+
+import numpy as np
+
+from tf_serving_flask_app.base.utils import as_boolean
+
+logger = logging.getLogger('core')
+
+FNV_OFFSET_BASIS = np.uint64(0xcbf29ce484222325)
+FNV_PRIME = np.uint64(0x100000001b3)
+
+# Words and individual punctuation characters.
+DEFAULT_TOKEN_PATTERN = r"\w+|[^\w\s]"
+
+# Tokens longer than this are out of vocabulary without being hashed, since
+# the hashed matrix is padded to the longest token.
+DEFAULT_MAX_TOKEN_CHARS = 100
+
+# Tokens hashed per vectorized pass while building a vocabulary index, which
+# bounds the padded byte matrix for large vocabularies.
+_HASH_CHUNK_SIZE = 65536
+
+
+def hash_tokens(tokens):
+    """Computes 64-bit FNV-1a hashes of tokens over their Unicode code points,
+    which equals FNV-1a over the bytes of ASCII tokens.
+
+    The tokens are packed into a zero padded matrix of UTF-32 code points and
+    hashed one column at a time, so the Python loop runs over the length of
+    the longest token rather than over every character of every token.
+
+    :return: a uint64 array with one hash per token.
+    """
+    if not len(tokens):
+        return np.empty(0, dtype=np.uint64)
+    chars = np.array(tokens, dtype=np.str_)
+    width = max(chars.dtype.itemsize // 4, 1)
+    columns = chars.view(np.uint32).reshape(len(tokens), width).T.astype(np.uint64)
+    active = columns != 0
+
+    hashes = np.full(len(tokens), FNV_OFFSET_BASIS, dtype=np.uint64)
+    mixed = np.empty_like(hashes)
+    for column in range(width):
+        np.bitwise_xor(hashes, columns[column], out=mixed)
+        np.multiply(mixed, FNV_PRIME, out=mixed)
+        np.copyto(hashes, mixed, where=active[column])
+    return hashes
+
+
+def _index_paths(vocab_path):
+    return vocab_path + '.hashes.npy', vocab_path + '.ids.npy'
+
+
+def _save_atomically(path, array):
+    """Saves an array so that concurrently starting workers never load a
+    partially written file."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, array)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def build_vocabulary_index(vocab_path):
+    """Hashes the tokens of a vocabulary file into a sorted hash index.
+
+    Tokens hashing to the same value keep the lowest id; such collisions are
+    logged since the shadowed tokens become out of vocabulary.
+
+    :return: a tuple of the sorted uint64 hashes and the int64 token ids.
+    """
+    with open(vocab_path, encoding='utf-8') as f:
+        tokens = [line.rstrip('\r\n') for line in f]
+
+    hashes = np.concatenate(
+        [hash_tokens(tokens[i:i + _HASH_CHUNK_SIZE]) for i in range(0, len(tokens), _HASH_CHUNK_SIZE)]
+        or [np.empty(0, dtype=np.uint64)])
+    ids = np.arange(len(tokens), dtype=np.int64)
+
+    # A stable sort keeps the lowest id first among equal hashes.
+    order = np.argsort(hashes, kind='mergesort')
+    hashes, ids = hashes[order], ids[order]
+    unique = np.concatenate(([True], hashes[1:] != hashes[:-1])) if len(hashes) else np.empty(0, bool)
+    if not unique.all():
+        logger.warning('%d tokens of "%s" collide with another token and are out of vocabulary',
+                       np.count_nonzero(~unique), vocab_path)
+    return hashes[unique], ids[unique]
+
+
+class Vocabulary(object):
+    """A vocabulary file looked up through a memory-mapped hash index.
+
+    The index is rebuilt when missing or older than the vocabulary file. When
+    it cannot be written next to the vocabulary, it is kept in memory instead.
+    Use `load_vocabulary` to load a file once per process.
+    """
+
+    def __init__(self, vocab_path):
+        self.path = vocab_path
+        hashes_path, ids_path = _index_paths(vocab_path)
+        vocab_mtime = os.path.getmtime(vocab_path)
+        if not all(os.path.exists(path) and os.path.getmtime(path) >= vocab_mtime
+                   for path in (hashes_path, ids_path)):
+            hashes, ids = build_vocabulary_index(vocab_path)
+            try:
+                _save_atomically(ids_path, ids)
+                _save_atomically(hashes_path, hashes)
+            except OSError as e:
+                logger.warning('Failed writing the index of vocabulary "%s" with `%s`, '
+                               'keeping it in process memory', vocab_path, e)
+                self.hashes, self.ids = hashes, ids
+                return
+
+        # Plain ndarray views of the mappings skip the memmap subclass overhead
+        # on every lookup.
+        self.hashes = np.asarray(np.load(hashes_path, mmap_mode='r'))
+        self.ids = np.asarray(np.load(ids_path, mmap_mode='r'))
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def lookup(self, tokens, oov_id=1, max_token_chars=0):
+        """Maps a list of tokens to an int64 array of token ids, with `oov_id`
+        for tokens that are not in the vocabulary.
+
+        :param max_token_chars: Tokens longer than this are mapped to `oov_id`
+        without being hashed, 0 to hash every token.
+        """
+        oversized = [i for (i, token) in enumerate(tokens) if len(token) > max_token_chars] \
+            if max_token_chars > 0 else []
+        if oversized:
+            tokens = list(tokens)
+            for i in oversized:
+                tokens[i] = ''
+        token_hashes = hash_tokens(tokens)
+        if not len(self.hashes):
+            return np.full(len(token_hashes), oov_id, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.hashes, token_hashes), len(self.hashes) - 1)
+        found = self.hashes[positions] == token_hashes
+        found[oversized] = False
+        return np.where(found, self.ids[positions], oov_id)
+
+
+_vocabularies = {}
+_vocabularies_lock = threading.Lock()
+
+
+def load_vocabulary(path):
+    """Returns the process wide `Vocabulary` for `path`, loading it on first use."""
+    with _vocabularies_lock:
+        if path not in _vocabularies:
+            _vocabularies[path] = Vocabulary(path)
+            logger.info('Loaded %d tokens from "%s"', len(_vocabularies[path]), path)
+        return _vocabularies[path]
+
+
+class Tokenize(object):
+    """Text pre-processor converting a string into a fixed-shape array of token ids.
+
+    :param vocab: The path to the vocabulary file.
+    :param max_length: The number of token ids returned, defaults to the last
+    dimension of the input shape in the spec.
+    :param pattern: The regular expression matching a single token.
+    :param lowercase: Whether the text is lowercased before tokenization.
+    :param padding: `post` or `pre`, the side padded with `pad_id`.
+    :param truncation: `post` or `pre`, the side tokens are dropped from.
+    :param pad_id: The id of padding.
+    :param oov_id: The id of tokens that are not in the vocabulary.
+    :param max_token_chars: Tokens longer than this are out of vocabulary,
+    which bounds the work of hashing a text with a very long word.
+    :param shape: The input shape from the spec; a 2D shape yields a batch of one.
+    :param dtype: The integer numpy dtype of the returned array.
+    """
+
+    def __init__(self,
+                 vocab,
+                 max_length=None,
+                 pattern=DEFAULT_TOKEN_PATTERN,
+                 lowercase=True,
+                 padding='post',
+                 truncation='post',
+                 pad_id=0,
+                 oov_id=1,
+                 max_token_chars=DEFAULT_MAX_TOKEN_CHARS,
+                 shape=(),
+                 dtype=np.int32):
+        if padding not in ('post', 'pre') or truncation not in ('post', 'pre'):
+            raise ValueError('Padding and truncation must be `post` or `pre`')
+        shape = list(shape)
+        if max_length is None:
+            if not shape or shape[-1] <= 0:
+                raise ValueError('max_length is required without a fixed length input shape')
+            max_length = shape[-1]
+        self.max_length = int(max_length)
+        self.token_pattern = re.compile(pattern)
+        self.lowercase = as_boolean(lowercase)
+        self.padding = padding
+        self.truncation = truncation
+        self.pad_id = int(pad_id)
+        self.oov_id = int(oov_id)
+        self.max_token_chars = int(max_token_chars)
+        self.batched = len(shape) == 2
+        self.dtype = dtype
+        self.vocabulary = load_vocabulary(vocab)
+
+    def tokenize(self, text):
+        if self.lowercase:
+            text = text.lower()
+        return self.token_pattern.findall(text)
+
+    def __call__(self, text):
+        tokens = self.tokenize(text)
+        if len(tokens) > self.max_length:
+            tokens = tokens[:self.max_length] if self.truncation == 'post' else tokens[-self.max_length:]
+        token_ids = self.vocabulary.lookup(tokens, self.oov_id, self.max_token_chars)
+
+        x = np.full(self.max_length, self.pad_id, dtype=self.dtype)
+        if self.padding == 'post':
+            x[:len(token_ids)] = token_ids
+        elif len(token_ids):
+            x[-len(token_ids):] = token_ids
+        return x[np.newaxis] if self.batched else x
+
+
+# Maps the names usable after the `builtin:` prefix to callable classes
+# instantiated with the parameters from the spec string.
+text_preprocessors = {
+    'tokenize': Tokenize,
+}
+
+
+def create(builtin_name, params, registry, **spec_params):
+    """Instantiates the built-in pre-processor `builtin_name` from `registry`
+    with the string parameters parsed from the spec and the parameters taken
+    from the input spec itself.
+    """
+    if builtin_name not in registry:
+        raise KeyError('Unknown built-in pre-processor "%s", expected one of %s' %
+                       (builtin_name, sorted(registry)))
+    return registry[builtin_name](**dict(spec_params, **params))
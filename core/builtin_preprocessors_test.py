@@ -0,0 +1,67 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from tf_serving_flask_app.core import builtin_preprocessors
+
+
+class TestBuiltinPreprocessors(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.vocab_path = os.path.join(self.tmpdir, 'vocab.txt')
+        with open(self.vocab_path, 'w', encoding='utf-8') as f:
+            f.write('[PAD]\n[UNK]\nthe\ncat\nsat\n.\ncafé\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_hash_tokens(self):
+        # Reference values of 64-bit FNV-1a.
+        hashes = builtin_preprocessors.hash_tokens(['', 'a', 'foobar'])
+        self.assertEqual(hashes.tolist(), [0xcbf29ce484222325, 0xaf63dc4c8601ec8c, 0x85944171f73967e8])
+        self.assertEqual(builtin_preprocessors.hash_tokens(['a', 'foobar', 'a'])[2], hashes[1])
+
+    def test_vocabulary_lookup(self):
+        vocabulary = builtin_preprocessors.Vocabulary(self.vocab_path)
+        self.assertEqual(len(vocabulary), 7)
+        self.assertTrue(os.path.exists(self.vocab_path + '.hashes.npy'))
+        np.testing.assert_array_equal(vocabulary.lookup(['cat', 'dog', 'café', 'the']), [3, 1, 6, 2])
+
+        # Loads the existing index memory-mapped.
+        vocabulary = builtin_preprocessors.Vocabulary(self.vocab_path)
+        self.assertIsInstance(vocabulary.hashes.base, np.memmap)
+        np.testing.assert_array_equal(vocabulary.lookup([]), [])
+
+    def test_tokenize(self):
+        tokenize = builtin_preprocessors.Tokenize(self.vocab_path, max_length='6')
+        x = tokenize('The cat sat on the mat.')
+        self.assertEqual(x.dtype, np.int32)
+        np.testing.assert_array_equal(x, [2, 3, 4, 1, 2, 1])
+
+        np.testing.assert_array_equal(tokenize('The Cat'), [2, 3, 0, 0, 0, 0])
+
+    def test_tokenize_oversized_token(self):
+        tokenize = builtin_preprocessors.Tokenize(self.vocab_path, max_length=4, max_token_chars='8')
+        np.testing.assert_array_equal(tokenize('the ' + 'a' * 200000 + ' cat'), [2, 1, 3, 0])
+        vocabulary = builtin_preprocessors.load_vocabulary(self.vocab_path)
+        np.testing.assert_array_equal(vocabulary.lookup(['', 'cat'], max_token_chars=2), [1, 1])
+
+    def test_tokenize_padding_and_truncation_from_spec_shape(self):
+        tokenize = builtin_preprocessors.Tokenize(
+            self.vocab_path, padding='pre', truncation='pre', shape=(1, 4), dtype=np.int64)
+        np.testing.assert_array_equal(tokenize('cat sat'), [[0, 0, 3, 4]])
+        np.testing.assert_array_equal(tokenize('the cat sat on the mat .'), [[1, 2, 1, 5]])
+
+    def test_create(self):
+        tokenize = builtin_preprocessors.create(
+            'tokenize', {'vocab': self.vocab_path}, builtin_preprocessors.text_preprocessors, shape=(3,))
+        self.assertEqual(tokenize.max_length, 3)
+        with self.assertRaises(KeyError):
+            builtin_preprocessors.create('wordpiece', {}, builtin_preprocessors.text_preprocessors)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,323 @@
+"""
+Compiles per-input plans that convert pre-processed numpy arrays into the
+tensors of prediction requests.
+
+Plans are compiled on startup from the spec and, when it could be fetched,
+the signature of the served model. Compiling cross-checks the spec against
+the signature and raises a SignatureMismatchError for inputs or outputs the
+signature lacks, dtypes that cannot be cast without losing values, and shapes
+that do not fit. It settles everything a request would otherwise branch on:
+
+- the dtype the served signature accepts, safely cast to when the spec differs,
+- a transpose when the spec and the signature disagree on the channel axis,
+- a leading batch axis when the signature has one more dimension than the spec,
+- a TensorProto template with the dtype and, for fully defined shapes, the
+  dimensions filled in.
+
+Per request, a plan casts only when needed, compares the array shape, copies
+its template and sets the raw tensor content. Offline scoring joins the
+prepared arrays of several records into one tensor along its batch axis. Without a signature, e.g. when
+the model server was unreachable on startup, inputs are converted with
+`make_tensor_proto` as before.
+"""
+
+import logging
+
+import numpy as np
+
+from tf_serving_flask_app.base.exceptions import PreprocessorError, SignatureMismatchError
+from tf_serving_flask_app.core import dtypes
+
+logger = logging.getLogger('core')
+
+# Dimensions of unknown size in spec and signature shapes.
+UNKNOWN_DIM = -1
+
+
+def _normalize(shape):
+    return tuple(dim if dim > 0 else UNKNOWN_DIM for dim in shape)
+
+
+def _merge_dims(spec_dims, served_dims):
+    """Merges dimensions known on either side, or returns None if a dimension
+    known on both sides differs."""
+    merged = []
+    for (spec_dim, served_dim) in zip(spec_dims, served_dims):
+        if spec_dim > 0 and served_dim > 0 and spec_dim != served_dim:
+            return None
+        merged.append(served_dim if served_dim > 0 else spec_dim if spec_dim > 0 else UNKNOWN_DIM)
+    return tuple(merged)
+
+
+def _join_batch(ndarrays, add_batch_axis):
+    """Joins the arrays of records along the leading axis of the tensor, which
+    is added when the arrays lack it and otherwise must have a size of 1.
+
+    :return: the batched array, a single array as it is, or None if the
+    arrays cannot be batched.
+    """
+    if add_batch_axis:
+        if len(set(ndarray.shape for ndarray in ndarrays)) > 1:
+            return None
+        return np.stack(ndarrays)
+    if len(ndarrays) == 1:
+        return ndarrays[0]
+    if len(set(ndarray.shape for ndarray in ndarrays)) > 1 or not ndarrays[0].ndim or \
+            ndarrays[0].shape[0] != 1:
+        return None
+    return np.concatenate(ndarrays)
+
+
+def plan_layout(input_key, spec_shape, served_shape):
+    """Reconciles the shape of the pre-processed array with the served shape.
+
+    :param spec_shape: the shape in the spec, None or empty when unknown.
+    :param served_shape: the shape of the signature input, None for unknown rank.
+    :return: a tuple of the array shape with UNKNOWN_DIM for dimensions of
+    unknown size or None for unknown rank, whether a leading batch axis is
+    added and the axes to transpose the array by or None.
+    :raises SignatureMismatchError if the shapes cannot be reconciled.
+    """
+    spec_shape = _normalize(spec_shape) if spec_shape else None
+    served_shape = _normalize(served_shape) if served_shape is not None else None
+    if served_shape is None:
+        return spec_shape, False, None
+    if spec_shape is None:
+        return served_shape, False, None
+
+    add_batch_axis = len(served_shape) == len(spec_shape) + 1
+    if add_batch_axis:
+        served_shape = served_shape[1:]
+    elif len(served_shape) != len(spec_shape):
+        raise SignatureMismatchError(
+            'Input `%s` has %d dimensions %s in the spec but the served signature expects %d %s' %
+            (input_key, len(spec_shape), list(spec_shape), len(served_shape), list(served_shape)))
+
+    merged = _merge_dims(spec_shape, served_shape)
+    if merged is not None:
+        return merged, add_batch_axis, None
+
+    # The spec may describe the other data format than the served graph
+    # expects, which moving the channel axis reconciles.
+    if len(spec_shape) >= 3:
+        rank = len(spec_shape)
+        batch_axes = [0] if rank == 4 else []
+        spatial_axes = list(range(len(batch_axes), rank))
+        for axes in (batch_axes + spatial_axes[-1:] + spatial_axes[:-1],
+                     batch_axes + spatial_axes[1:] + spatial_axes[:1]):
+            merged = _merge_dims(tuple(spec_shape[axis] for axis in axes), served_shape)
+            if merged is not None:
+                logger.warning('Input `%s` of shape %s in the spec is transposed by %s into the served '
+                               'shape %s', input_key, list(spec_shape), axes, list(served_shape))
+                return merged, add_batch_axis, tuple(axes)
+
+    raise SignatureMismatchError(
+        'Input `%s` has the shape %s in the spec but the served signature expects %s' %
+        (input_key, list(spec_shape), list(served_shape)))
+
+
+def plan_dtype(input_key, spec_dtype, served_dtype):
+    """Returns the numpy dtype an input is converted to.
+
+    :param spec_dtype: the numpy dtype the pre-processor produces.
+    :param served_dtype: the numpy dtype of the signature input, None if unknown.
+    :raises SignatureMismatchError if arrays of the spec dtype cannot be cast
+    to the served dtype without losing values, e.g. floats in [0, 1] to uint8.
+    """
+    spec_dtype = np.dtype(spec_dtype)
+    if served_dtype is None:
+        return spec_dtype
+    served_dtype = np.dtype(served_dtype)
+    if served_dtype == spec_dtype:
+        return served_dtype
+    if not np.can_cast(spec_dtype, served_dtype, casting='safe'):
+        raise SignatureMismatchError(
+            'Input `%s` is pre-processed into `%s` but the served signature expects `%s`, which '
+            'cannot hold every value of `%s`' % (input_key, spec_dtype.name, served_dtype.name, spec_dtype.name))
+    logger.warning('Input `%s` is pre-processed into `%s` and cast to `%s` for the served signature',
+                   input_key, spec_dtype.name, served_dtype.name)
+    return served_dtype
+
+
+class ConversionPlan(object):
+    """Converts the pre-processed arrays of an input into tensor protocol
+    buffers with everything but the array data precomputed.
+
+    :param input_key: the signature key of the input.
+    :param dtype: the numpy dtype of the served tensor.
+    :param shape: the array shape with UNKNOWN_DIM for unknown sizes, None for unknown rank.
+    :param add_batch_axis: whether the tensor has a leading batch axis of 1
+    that the array lacks.
+    :param transpose_axes: optional axes the array is transposed by.
+    :param template: a TensorProto with the dtype and, when the shape is fully
+    defined, the dimensions set.
+    """
+
+    def __init__(self, input_key, dtype, shape, add_batch_axis, transpose_axes, template):
+        self.input_key = input_key
+        self.dtype = np.dtype(dtype)
+        self.shape = shape
+        self.add_batch_axis = add_batch_axis
+        self.transpose_axes = transpose_axes
+        self.template = template
+        self.fixed_shape = shape is not None and UNKNOWN_DIM not in shape
+        self.known_dims = tuple((axis, dim) for (axis, dim) in enumerate(shape or ()) if dim != UNKNOWN_DIM)
+        if self.fixed_shape:
+            self.check_shape = self._check_fixed_shape
+        elif shape is not None:
+            self.check_shape = self._check_known_dims
+        else:
+            self.check_shape = lambda ndarray: None
+
+    def _mismatch(self, ndarray):
+        return PreprocessorError('Input `%s` was pre-processed into the shape %s but the served signature '
+                                 'expects %s' % (self.input_key, list(ndarray.shape), list(self.shape)))
+
+    def _check_fixed_shape(self, ndarray):
+        if ndarray.shape != self.shape:
+            raise self._mismatch(ndarray)
+
+    def _check_known_dims(self, ndarray):
+        if ndarray.ndim != len(self.shape) or \
+                any(ndarray.shape[axis] != dim for (axis, dim) in self.known_dims):
+            raise self._mismatch(ndarray)
+
+    def prepare(self, ndarray):
+        """Returns the array in the served dtype and layout, C-contiguous.
+        Runs on pre-processor threads since it may copy the array.
+
+        :raises PreprocessorError if the array does not fit the served shape.
+        """
+        ndarray = np.asarray(ndarray)
+        if self.transpose_axes is not None:
+            ndarray = np.transpose(ndarray, self.transpose_axes)
+        ndarray = np.ascontiguousarray(ndarray, dtype=self.dtype)
+        self.check_shape(ndarray)
+        return ndarray
+
+    def fill(self, tensor_proto, ndarray):
+        """Fills a tensor of a prediction request with a prepared array."""
+        tensor_proto.CopyFrom(self.template)
+        if not self.fixed_shape:
+            if self.add_batch_axis:
+                tensor_proto.tensor_shape.dim.add(size=1)
+            for size in ndarray.shape:
+                tensor_proto.tensor_shape.dim.add(size=size)
+        tensor_proto.tensor_content = ndarray.tobytes()
+
+    def prepare_batch(self, ndarrays):
+        """Prepares the pre-processed arrays of several records and joins them
+        along the batch axis of the served tensor.
+
+        :return: the batched array or None if the records cannot be batched.
+        :raises PreprocessorError if an array does not fit the served shape.
+        """
+        return _join_batch([self.prepare(ndarray) for ndarray in ndarrays], self.add_batch_axis)
+
+    def fill_batch(self, tensor_proto, batched):
+        """Fills a tensor of a prediction request with a prepared batch."""
+        tensor_proto.dtype = self.template.dtype
+        for size in batched.shape:
+            tensor_proto.tensor_shape.dim.add(size=size)
+        tensor_proto.tensor_content = batched.tobytes()
+
+
+# TensorFlow is imported where tensors are built so that planning layouts and
+# dtypes stays importable without it.
+class MakeTensorProtoPlan(object):
+    """Converts arrays with `make_tensor_proto`, for string tensors and inputs
+    of a signature that could not be fetched."""
+
+    def __init__(self, input_key):
+        self.input_key = input_key
+
+    def prepare(self, ndarray):
+        import tensorflow as tf
+        try:
+            return tf.contrib.util.make_tensor_proto(ndarray)
+        except (TypeError, ValueError) as e:
+            raise PreprocessorError(e)
+
+    def fill(self, tensor_proto, prepared):
+        tensor_proto.CopyFrom(prepared)
+
+    def prepare_batch(self, ndarrays):
+        return _join_batch([np.asarray(ndarray) for ndarray in ndarrays], False)
+
+    def fill_batch(self, tensor_proto, batched):
+        self.fill(tensor_proto, self.prepare(batched))
+
+
+def _served_tensor(tensor_info):
+    """Returns the numpy dtype and the shape, None for an unknown rank, of a TensorInfo."""
+    import tensorflow as tf
+    dtype = tf.as_dtype(tensor_info.dtype).as_numpy_dtype
+    if tensor_info.tensor_shape.unknown_rank:
+        return dtype, None
+    return dtype, tuple(dim.size for dim in tensor_info.tensor_shape.dim)
+
+
+def _template(dtype, shape, add_batch_axis):
+    import tensorflow as tf
+    from tensorflow.core.framework.tensor_pb2 import TensorProto
+    template = TensorProto(dtype=tf.as_dtype(dtype).as_datatype_enum)
+    if shape is not None and UNKNOWN_DIM not in shape:
+        for size in ((1,) if add_batch_axis else ()) + tuple(shape):
+            template.tensor_shape.dim.add(size=size)
+    return template
+
+
+def compile_input_plan(input_key, input_spec, transport_dtype, tensor_info):
+    """Compiles the conversion plan of an input against its served TensorInfo.
+
+    :raises SignatureMismatchError if the spec does not fit the signature.
+    """
+    served_dtype, served_shape = _served_tensor(tensor_info)
+    spec_dtype = transport_dtype or dtypes.to_numpy(input_spec.dtype)
+    if np.dtype(served_dtype).kind in 'OSU' or np.dtype(spec_dtype).kind in 'OSU':
+        return MakeTensorProtoPlan(input_key)
+
+    dtype = plan_dtype(input_key, spec_dtype, served_dtype)
+    shape, add_batch_axis, transpose_axes = plan_layout(input_key, tuple(input_spec.shape), served_shape)
+    return ConversionPlan(input_key, dtype, shape, add_batch_axis, transpose_axes,
+                          _template(dtype, shape, add_batch_axis))
+
+
+def compile_plans(spec_borg, signature_def=None):
+    """Compiles the conversion plans of every input in the spec.
+
+    :param spec_borg: the initialized SpecBorg.
+    :param signature_def: the served SignatureDef or None to convert every
+    input with `make_tensor_proto`.
+    :return: a dict from input key to its plan.
+    :raises SignatureMismatchError for inputs or outputs of the spec the
+    signature lacks and inputs that do not fit the signature.
+    """
+    if signature_def is None:
+        return dict((input_key, MakeTensorProtoPlan(input_key)) for input_key in spec_borg.input_specs)
+
+    missing_inputs = sorted(set(spec_borg.input_specs) - set(signature_def.inputs))
+    missing_outputs = sorted(set(spec_borg.output_specs) - set(signature_def.outputs))
+    if missing_inputs or missing_outputs:
+        raise SignatureMismatchError(
+            'The served signature lacks the inputs %s and outputs %s of the spec, it serves the inputs %s '
+            'and outputs %s' % (missing_inputs, missing_outputs, sorted(signature_def.inputs),
+                                sorted(signature_def.outputs)))
+
+    plans = {}
+    for (input_key, input_spec) in spec_borg.input_specs.items():
+        plans[input_key] = compile_input_plan(
+            input_key, input_spec, spec_borg.input_transport_dtypes.get(input_key),
+            signature_def.inputs[input_key])
+        logger.info('Compiled the conversion plan of input `%s`: %s', input_key, describe(plans[input_key]))
+    return plans
+
+
+def describe(plan):
+    if isinstance(plan, MakeTensorProtoPlan):
+        return 'make_tensor_proto'
+    return 'dtype %s, shape %s%s%s' % (
+        plan.dtype.name,
+        list(plan.shape) if plan.shape is not None else 'of unknown rank',
+        ', batch axis added' if plan.add_batch_axis else '',
+        ', transposed by %s' % (plan.transpose_axes,) if plan.transpose_axes is not None else '')
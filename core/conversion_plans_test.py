@@ -0,0 +1,82 @@
+import unittest
+
+import numpy as np
+
+from tf_serving_flask_app.base.exceptions import PreprocessorError, SignatureMismatchError
+from tf_serving_flask_app.core import conversion_plans
+from tf_serving_flask_app.core.conversion_plans import UNKNOWN_DIM
+
+
+class TestPlanLayout(unittest.TestCase):
+    def test_batch_axis(self):
+        self.assertEqual(conversion_plans.plan_layout('image', (1, 224, 224, 3), (-1, 224, 224, 3)),
+                         ((1, 224, 224, 3), False, None))
+        self.assertEqual(conversion_plans.plan_layout('image', (224, 224, 3), (-1, 224, 224, 3)),
+                         ((224, 224, 3), True, None))
+
+    def test_unknown_shapes(self):
+        self.assertEqual(conversion_plans.plan_layout('text', (), (-1, 16)),
+                         ((UNKNOWN_DIM, 16), False, None))
+        self.assertEqual(conversion_plans.plan_layout('text', (0, 16), None),
+                         ((UNKNOWN_DIM, 16), False, None))
+
+    def test_channel_axis(self):
+        self.assertEqual(conversion_plans.plan_layout('image', (1, 224, 224, 3), (-1, 3, 224, 224)),
+                         ((1, 3, 224, 224), False, (0, 3, 1, 2)))
+
+    def test_mismatch(self):
+        with self.assertRaises(SignatureMismatchError):
+            conversion_plans.plan_layout('image', (1, 100, 100, 3), (-1, 224, 224, 3))
+        with self.assertRaises(SignatureMismatchError):
+            conversion_plans.plan_layout('image', (224, 3), (-1, 224, 224, 3))
+
+
+class TestPlanDtype(unittest.TestCase):
+    def test_cast(self):
+        self.assertEqual(conversion_plans.plan_dtype('image', np.uint8, np.float32), np.float32)
+        self.assertEqual(conversion_plans.plan_dtype('image', np.float32, None), np.float32)
+        with self.assertRaises(SignatureMismatchError):
+            conversion_plans.plan_dtype('text', np.str_, np.float32)
+
+    def test_narrowing_cast(self):
+        with self.assertRaises(SignatureMismatchError):
+            conversion_plans.plan_dtype('image', np.float32, np.uint8)
+        with self.assertRaises(SignatureMismatchError):
+            conversion_plans.plan_dtype('image', np.float64, np.float32)
+        with self.assertRaises(SignatureMismatchError):
+            conversion_plans.plan_dtype('ids', np.int64, np.int32)
+
+
+class TestConversionPlan(unittest.TestCase):
+    def test_prepare(self):
+        plan = conversion_plans.ConversionPlan('image', np.float32, (1, 3, 2, 2), False, (0, 3, 1, 2), None)
+        ndarray = plan.prepare(np.arange(12, dtype=np.uint8).reshape(1, 2, 2, 3))
+        self.assertEqual((ndarray.dtype, ndarray.shape), (np.float32, (1, 3, 2, 2)))
+        self.assertTrue(ndarray.flags['C_CONTIGUOUS'])
+        with self.assertRaises(PreprocessorError):
+            plan.prepare(np.zeros((1, 2, 3, 3)))
+
+    def test_known_dims(self):
+        plan = conversion_plans.ConversionPlan('text', np.int32, (UNKNOWN_DIM, 4), False, None, None)
+        self.assertEqual(plan.prepare(np.zeros((7, 4))).shape, (7, 4))
+        with self.assertRaises(PreprocessorError):
+            plan.prepare(np.zeros((7, 5)))
+
+    def test_prepare_batch(self):
+        plan = conversion_plans.ConversionPlan('image', np.float32, (3, 2, 2), True, (2, 0, 1), None)
+        batched = plan.prepare_batch([np.zeros((2, 2, 3), dtype=np.uint8)] * 4)
+        self.assertEqual((batched.dtype, batched.shape), (np.float32, (4, 3, 2, 2)))
+        with self.assertRaises(PreprocessorError):
+            plan.prepare_batch([np.zeros((2, 2, 3)), np.zeros((3, 2, 3))])
+
+        plan = conversion_plans.ConversionPlan('text', np.int32, (1, UNKNOWN_DIM), False, None, None)
+        self.assertEqual(plan.prepare_batch([np.zeros((1, 4))] * 3).shape, (3, 4))
+        self.assertIsNone(plan.prepare_batch([np.zeros((1, 4)), np.zeros((1, 5))]))
+
+        plan = conversion_plans.ConversionPlan('text', np.int32, (UNKNOWN_DIM,), False, None, None)
+        self.assertEqual(plan.prepare_batch([np.zeros(4)]).shape, (4,))
+        self.assertIsNone(plan.prepare_batch([np.zeros(4)] * 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
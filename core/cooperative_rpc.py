@@ -0,0 +1,208 @@
+"""
+Makes prediction RPCs without blocking the eventlet hub of a worker.
+
+A unary gRPC call blocks its OS thread in gRPC's C core, which eventlet cannot
+green. In an eventlet worker a blocking `stub.Predict(...)` therefore stalls
+every green thread of the process and serializes its RPCs, however many
+connections the worker accepts. Under a monkey patched eventlet, RPCs are
+instead either
+
+- `future`: issued with `Predict.future(...)` and awaited by polling the
+  future from a green thread that sleeps between polls, so the hub serves
+  other requests while gRPC's own threads complete the call, or
+- `tpool`: handed off to eventlet's pool of real OS threads, whose size is
+  set with EVENTLET_THREADPOOL_SIZE.
+
+Outside of eventlet, e.g. in threaded or offline scoring processes, RPCs
+block their calling thread as before. The RPCs a worker has in flight are
+bounded by GRPC_MAX_INFLIGHT_RPCS so that a burst of admitted requests does
+not queue an unbounded number of calls on the channel.
+
+CPU bound jobs like pre-processing several inputs are run concurrently with
+`map_in_threads` on real OS threads, through eventlet's thread pool in a
+monkey patched process, where a regular thread pool would only run green
+threads on the single OS thread of the hub.
+"""
+
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+from tf_serving_flask_app import settings
+from tf_serving_flask_app.base.exceptions import AdmissionTimeoutError
+from tf_serving_flask_app.core import metrics
+
+logger = logging.getLogger('core')
+
+prediction_rpcs_inflight = metrics.create_gauge(
+    'prediction_rpcs_inflight',
+    'Number of prediction RPCs in flight',
+    multiprocess_mode='livesum')
+prediction_rpcs_inflight_max = metrics.create_gauge(
+    'prediction_rpcs_inflight_max',
+    'Highest number of prediction RPCs a live process had in flight at once',
+    multiprocess_mode='max')
+
+MODES = ('future', 'tpool', 'blocking')
+
+
+def is_green():
+    """Returns whether threads of the current process are monkey patched by eventlet."""
+    try:
+        from eventlet import patcher
+    except ImportError:
+        return False
+    return patcher.is_monkey_patched('thread')
+
+
+class CooperativeRpc(object):
+    """Bounds and issues the prediction RPCs of a process.
+
+    :param mode: one of `future`, `tpool` or `blocking`, how RPCs wait when
+    `green` is set.
+    :param max_inflight: the maximum RPCs in flight, 0 for no limit.
+    :param green: whether the process runs green threads. RPCs always block
+    their calling thread in a process without them.
+    :param poll_interval_secs: the first interval between polls of a future,
+    doubled after every poll up to `max_poll_interval_secs`.
+    :param max_poll_interval_secs: the longest interval between polls.
+    """
+
+    def __init__(self, mode='future', max_inflight=0, green=False,
+                 poll_interval_secs=.0005, max_poll_interval_secs=.005):
+        if mode not in MODES:
+            raise ValueError('GRPC_COOPERATIVE_MODE should be one of %s, got `%s`' % (MODES, mode))
+        self.mode = mode if green else 'blocking'
+        self.max_inflight = max_inflight
+        self.poll_interval_secs = poll_interval_secs
+        self.max_poll_interval_secs = max_poll_interval_secs
+        self.inflight = 0
+        self.peak_inflight = 0
+        # Green threads wait on the semaphore cooperatively once patched.
+        self._slots = threading.BoundedSemaphore(max_inflight) if max_inflight else None
+        if self.mode == 'future':
+            import eventlet
+            self._sleep = eventlet.sleep
+        elif self.mode == 'tpool':
+            from eventlet import tpool
+            self._tpool = tpool
+
+    @contextmanager
+    def slot(self, timeout=None):
+        """Holds one of the in flight RPC slots.
+
+        :raises AdmissionTimeoutError if no slot frees up within `timeout` seconds.
+        """
+        if self._slots is not None and not self._slots.acquire(timeout=timeout):
+            raise AdmissionTimeoutError('Timed out after %.1fs waiting for one of %d prediction RPC slots' %
+                                        (timeout, self.max_inflight))
+        self.inflight += 1
+        if self.inflight > self.peak_inflight:
+            self.peak_inflight = self.inflight
+            prediction_rpcs_inflight_max.set(self.peak_inflight)
+        prediction_rpcs_inflight.inc()
+        try:
+            yield
+        finally:
+            prediction_rpcs_inflight.dec()
+            self.inflight -= 1
+            if self._slots is not None:
+                self._slots.release()
+
+    def wait(self, future):
+        """Returns the result of an RPC future, raising its RpcError. A green
+        thread sleeps between polls instead of blocking the hub."""
+        if self.mode == 'future':
+            interval = self.poll_interval_secs
+            while not future.done():
+                self._sleep(interval)
+                interval = min(interval * 2, self.max_poll_interval_secs)
+        return future.result()
+
+    def call(self, method, request, timeout):
+        """Makes a unary RPC within an in flight slot.
+
+        :param method: a unary-unary multi-callable of a stub, e.g. `stub.Predict`.
+        :param request: the request protocol buffer.
+        :param timeout: the deadline of the RPC in seconds, which also bounds
+        the wait for a slot.
+        :return: the response protocol buffer.
+        """
+        with self.slot(timeout):
+            if self.mode == 'future':
+                return self.wait(method.future(request, timeout=timeout))
+            if self.mode == 'tpool':
+                return self._tpool.execute(method, request, timeout=timeout)
+            return method(request, timeout=timeout)
+
+
+# Keyed by the pid of the process that created them since a preloaded master
+# is not monkey patched like the eventlet workers forked from it.
+_process_cooperative_rpcs = {}
+
+
+def get_cooperative_rpc():
+    """Returns the CooperativeRpc of the current process configured from the environment."""
+    pid = os.getpid()
+    cooperative_rpc = _process_cooperative_rpcs.get(pid)
+    if cooperative_rpc is None:
+        green = is_green()
+        cooperative_rpc = _process_cooperative_rpcs.setdefault(pid, CooperativeRpc(
+            os.getenv('GRPC_COOPERATIVE_MODE', settings.DEFAULT_GRPC_COOPERATIVE_MODE).lower(),
+            int(os.getenv('GRPC_MAX_INFLIGHT_RPCS', settings.DEFAULT_GRPC_MAX_INFLIGHT_RPCS)),
+            green))
+        logger.info('Process %d makes %s prediction RPCs with at most %s in flight', pid,
+                    cooperative_rpc.mode, cooperative_rpc.max_inflight or 'unbounded')
+    return cooperative_rpc
+
+
+# Thread pools keyed by the pid of the process that created them, since
+# threads do not survive forking.
+_process_executors = {}
+
+
+def _get_executor(max_workers):
+    pid = os.getpid()
+    executor = _process_executors.get(pid)
+    if executor is None:
+        executor = _process_executors.setdefault(pid, ThreadPoolExecutor(max_workers=max_workers))
+    return executor
+
+
+def map_in_threads(fn, jobs, max_workers, green=None):
+    """Calls `fn` with the arguments of every job concurrently on real OS
+    threads, at most `max_workers` at a time.
+
+    Green threads of a monkey patched process hand the calls off to eventlet's
+    pool of OS threads, sized with EVENTLET_THREADPOOL_SIZE, and yield to the
+    hub while waiting. Other processes use a per process thread pool.
+
+    Waits for every job before raising the first failure so that no job
+    outlives the call.
+
+    :param jobs: a list of argument tuples.
+    :param green: whether the process runs green threads, detected when None.
+    :return: a list of the results in the order of `jobs`.
+    """
+    if green is None:
+        green = is_green()
+    if green:
+        import eventlet
+        from eventlet import tpool
+        pool = eventlet.GreenPool(max_workers)
+        threads = [pool.spawn(tpool.execute, fn, *args) for args in jobs]
+        results, error = [], None
+        for thread in threads:
+            try:
+                results.append(thread.wait())
+            except Exception as e:
+                error = error or e
+        if error is not None:
+            raise error
+        return results
+
+    futures = [_get_executor(max_workers).submit(fn, *args) for args in jobs]
+    wait(futures)
+    return [future.result() for future in futures]
@@ -0,0 +1,115 @@
+import os
+import subprocess
+import sys
+import textwrap
+import threading
+import time
+import unittest
+
+import eventlet
+
+from tf_serving_flask_app.base.exceptions import AdmissionTimeoutError
+from tf_serving_flask_app.core import cooperative_rpc
+
+
+class FakeFuture(object):
+    """Completes on a real thread after a delay like a gRPC future."""
+
+    def __init__(self, response, delay_secs):
+        self.response = response
+        self.completed = threading.Event()
+        threading.Timer(delay_secs, self.completed.set).start()
+
+    def done(self):
+        return self.completed.is_set()
+
+    def result(self):
+        self.completed.wait()
+        return self.response
+
+
+class FakePredict(object):
+    def __init__(self, delay_secs):
+        self.delay_secs = delay_secs
+
+    def __call__(self, request, timeout=None):
+        time.sleep(self.delay_secs)
+        return request
+
+    def future(self, request, timeout=None):
+        return FakeFuture(request, self.delay_secs)
+
+
+class TestCooperativeRpc(unittest.TestCase):
+    def test_blocking_without_green_threads(self):
+        rpc = cooperative_rpc.CooperativeRpc('future', green=False)
+        self.assertEqual(rpc.mode, 'blocking')
+        self.assertEqual(rpc.call(FakePredict(0), 'request', 1.), 'request')
+
+    def test_green_threads_overlap_rpcs(self):
+        rpc = cooperative_rpc.CooperativeRpc('future', green=True)
+        pool = eventlet.GreenPool()
+        start_time = time.time()
+        results = list(pool.imap(lambda i: rpc.call(FakePredict(.2), i, 1.), range(5)))
+        self.assertEqual(results, list(range(5)))
+        self.assertEqual(rpc.peak_inflight, 5)
+        # Five sequential calls would take a second.
+        self.assertLess(time.time() - start_time, .6)
+
+    def test_inflight_limit(self):
+        rpc = cooperative_rpc.CooperativeRpc('future', max_inflight=1, green=True)
+        with rpc.slot(1.):
+            with self.assertRaises(AdmissionTimeoutError):
+                with rpc.slot(.01):
+                    pass
+        self.assertEqual(rpc.inflight, 0)
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            cooperative_rpc.CooperativeRpc('greenlet')
+
+
+class TestMapInThreads(unittest.TestCase):
+    def test_results_in_order_and_first_failure(self):
+        self.assertEqual(cooperative_rpc.map_in_threads(lambda x, y: x * y, [(1, 2), (3, 4)], 2), [2, 12])
+
+        def fail_on_odd(x):
+            if x % 2:
+                raise ValueError(x)
+            return x
+        for green in (False, True):
+            with self.assertRaises(ValueError):
+                cooperative_rpc.map_in_threads(fail_on_odd, [(0,), (1,), (2,)], 2, green=green)
+
+    def test_os_threads_under_monkey_patching(self):
+        # Monkey patching is process wide, so it runs in a child process.
+        script = textwrap.dedent("""
+            import eventlet
+            eventlet.monkey_patch()
+            from eventlet import patcher
+            from tf_serving_flask_app.core import cooperative_rpc
+
+            original_sleep = patcher.original('time').sleep
+            get_ident = patcher.original('_thread').get_ident
+
+            def job(secs):
+                # Blocks its OS thread like decoding an image would.
+                original_sleep(secs)
+                return get_ident()
+
+            assert cooperative_rpc.is_green()
+            start_time = patcher.original('time').time()
+            idents = cooperative_rpc.map_in_threads(job, [(.2,)] * 4, 4)
+            elapsed_secs = patcher.original('time').time() - start_time
+            assert get_ident() not in idents, idents
+            # Four jobs on the hub's single OS thread would take .8s.
+            assert elapsed_secs < .6, elapsed_secs
+        """)
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        process = subprocess.run([sys.executable, '-c', script], env=env, stdout=subprocess.PIPE,
+                                 stderr=subprocess.STDOUT, universal_newlines=True)
+        self.assertEqual(process.returncode, 0, process.stdout)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,225 @@
+"""
+Lays gunicorn workers out on the CPUs and NUMA nodes of the host and limits
+the native thread pools of each worker.
+
+Each of the many eventlet workers otherwise lets OpenMP and BLAS start a
+thread per core for NumPy calls, oversubscribing the cores and making tail
+latency unpredictable. The thread pool environment variables are set in the
+gunicorn master before NumPy is first imported, since the libraries read them
+when they are loaded, and are additionally applied at runtime through
+`threadpoolctl` when it is installed.
+
+With `WORKER_CPU_AFFINITY=cpu` the allowed CPUs are split, NUMA node by NUMA
+node, into slots of `WORKER_CPUS_PER_WORKER` CPUs, and with `numa` every NUMA
+node is a slot. The master assigns each forked worker the lowest slot index
+no live worker holds, so replaced and autoscaled workers take over the slots
+of exited ones, and more workers than slots share slots round robin. The
+worker pins itself to the CPUs of its slot after forking.
+"""
+
+import collections
+import glob
+import logging
+import os
+import re
+
+from tf_serving_flask_app import settings
+from tf_serving_flask_app.core import metrics
+
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
+
+logger = logging.getLogger('core')
+
+NONE = 'none'
+CPU = 'cpu'
+NUMA = 'numa'
+
+# Environment variables sizing the thread pools of native libraries NumPy
+# may be linked against.
+NATIVE_THREAD_ENV_VARS = (
+    'OMP_NUM_THREADS',
+    'OPENBLAS_NUM_THREADS',
+    'MKL_NUM_THREADS',
+    'BLIS_NUM_THREADS',
+    'VECLIB_MAXIMUM_THREADS',
+    'NUMEXPR_NUM_THREADS',
+)
+
+# Labeled, so that values are created in the workers after forking.
+worker_cpus = metrics.create_gauge(
+    'worker_cpus',
+    'Number of CPUs a worker may run on by NUMA node, `all` when not pinned',
+    labelnames=('node',),
+    multiprocess_mode='liveall')
+worker_native_threads = metrics.create_gauge(
+    'worker_native_threads',
+    'Limit of the native thread pools of a worker, 0 when not limited',
+    labelnames=('source',),
+    multiprocess_mode='liveall')
+cpu_set_workers = metrics.create_gauge(
+    'cpu_set_workers',
+    'Number of workers pinned to a set of CPUs',
+    labelnames=('cpus',),
+    multiprocess_mode='livesum')
+
+
+def native_threads_from_env():
+    return int(os.getenv('NATIVE_THREADS_PER_WORKER', settings.DEFAULT_NATIVE_THREADS_PER_WORKER))
+
+
+def limit_native_threads(threads, environ=os.environ):
+    """Sets the thread pool sizes of native libraries unless already set.
+    Only takes effect for libraries loaded afterwards.
+
+    :param threads: the thread pool size, 0 to leave the defaults.
+    :return: a dict of the environment variables that were set.
+    """
+    if threads <= 0:
+        return {}
+    applied = {}
+    for name in NATIVE_THREAD_ENV_VARS:
+        if name not in environ:
+            environ[name] = applied[name] = str(threads)
+    return applied
+
+
+def parse_cpu_list(text):
+    """Parses a Linux CPU list like `0-3,8,10-11` into a sorted list."""
+    cpus = set()
+    for part in text.strip().split(','):
+        if not part:
+            continue
+        if '-' in part:
+            first, last = part.split('-')
+            cpus.update(range(int(first), int(last) + 1))
+        else:
+            cpus.add(int(part))
+    return sorted(cpus)
+
+
+def format_cpu_list(cpus):
+    """Formats CPUs as a Linux CPU list, the inverse of `parse_cpu_list`."""
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and ranges[-1][1] == cpu - 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ','.join(str(first) if first == last else '%d-%d' % (first, last) for (first, last) in ranges)
+
+
+def allowed_cpus():
+    """Returns the CPUs the process may run on, e.g. as limited by a cgroup cpuset."""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def numa_nodes(cpus, node_path='/sys/devices/system/node'):
+    """Groups CPUs by NUMA node from sysfs.
+
+    :return: an ordered dict from node to its CPUs among `cpus`, a single
+    node 0 with every CPU when the topology is unavailable.
+    """
+    cpus = set(cpus)
+    nodes = collections.OrderedDict()
+    node_dirs = glob.glob(os.path.join(node_path, 'node[0-9]*'))
+    for node_dir in sorted(node_dirs, key=lambda path: int(re.search(r'(\d+)$', path).group(1))):
+        try:
+            with open(os.path.join(node_dir, 'cpulist')) as f:
+                node_cpus = [cpu for cpu in parse_cpu_list(f.read()) if cpu in cpus]
+        except (IOError, ValueError):
+            continue
+        if node_cpus:
+            nodes[int(re.search(r'(\d+)$', node_dir).group(1))] = node_cpus
+    if not nodes:
+        nodes[0] = sorted(cpus)
+    return nodes
+
+
+class CpuLayout(object):
+    """Splits CPUs into the slots workers are pinned to.
+
+    :param mode: `none`, `cpu` for slots of `cpus_per_worker` CPUs or `numa`
+    for a slot per NUMA node.
+    :param nodes: an ordered dict from NUMA node to its CPUs.
+    :param cpus_per_worker: the size of the slots in `cpu` mode. Slots never
+    span NUMA nodes, the last slot of a node may be smaller.
+    """
+
+    def __init__(self, mode, nodes, cpus_per_worker=1):
+        if mode not in (NONE, CPU, NUMA):
+            raise ValueError('Unknown worker CPU affinity `%s`, expected one of %s' % (mode, [NONE, CPU, NUMA]))
+        self.mode = mode
+        self.nodes = nodes
+        self.cpus_per_worker = max(1, cpus_per_worker)
+        # A list of `(node, cpus)` pairs.
+        self.slots = []
+        if mode == NUMA:
+            self.slots = list(nodes.items())
+        elif mode == CPU:
+            for (node, cpus) in nodes.items():
+                for start in range(0, len(cpus), self.cpus_per_worker):
+                    self.slots.append((node, cpus[start:start + self.cpus_per_worker]))
+
+    @classmethod
+    def from_env(cls):
+        mode = os.getenv('WORKER_CPU_AFFINITY', settings.DEFAULT_WORKER_CPU_AFFINITY).lower()
+        cpus_per_worker = int(os.getenv('WORKER_CPUS_PER_WORKER', settings.DEFAULT_WORKER_CPUS_PER_WORKER))
+        return cls(mode, numa_nodes(allowed_cpus()), cpus_per_worker)
+
+    @property
+    def enabled(self):
+        return bool(self.slots)
+
+    def slot(self, index):
+        """Returns the `(node, cpus)` pair of a slot index, wrapping around."""
+        return self.slots[index % len(self.slots)]
+
+    def describe(self):
+        return ', '.join('node %d: %s' % (node, format_cpu_list(cpus)) for (node, cpus) in self.slots)
+
+
+def next_slot_index(used_indexes):
+    """Returns the lowest slot index not in use."""
+    used_indexes = set(used_indexes)
+    index = 0
+    while index in used_indexes:
+        index += 1
+    return index
+
+
+def assign_slot(layout, server, worker):
+    """Assigns a slot to a worker about to be forked. Runs in the master."""
+    if not layout.enabled:
+        return
+    worker.cpu_slot = next_slot_index(getattr(other, 'cpu_slot', None) for other in server.WORKERS.values())
+
+
+def pin_worker(layout, worker, native_threads):
+    """Pins a forked worker to the CPUs of its slot, limits its native thread
+    pools and exposes the layout as metrics. Runs in the worker."""
+    if native_threads > 0 and threadpool_limits is not None:
+        threadpool_limits(limits=native_threads)
+        worker_native_threads.labels(source='threadpoolctl').set(native_threads)
+    else:
+        worker_native_threads.labels(source='environment').set(max(native_threads, 0))
+
+    cpu_slot = getattr(worker, 'cpu_slot', None)
+    if not layout.enabled or cpu_slot is None or not hasattr(os, 'sched_setaffinity'):
+        worker_cpus.labels(node='all').set(len(allowed_cpus()))
+        return
+
+    node, cpus = layout.slot(cpu_slot)
+    try:
+        os.sched_setaffinity(0, cpus)
+    except OSError as e:
+        logger.warning('Failed pinning worker %d to CPUs %s with `%s`', os.getpid(), format_cpu_list(cpus), e)
+        worker_cpus.labels(node='all').set(len(allowed_cpus()))
+        return
+    worker_cpus.labels(node=str(node)).set(len(cpus))
+    cpu_set_workers.labels(cpus=format_cpu_list(cpus)).inc()
+    logger.info('Pinned worker %d to CPUs %s of NUMA node %d', os.getpid(), format_cpu_list(cpus), node)
@@ -0,0 +1,64 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from tf_serving_flask_app.core import cpu_layout
+
+
+class TestCpuLists(unittest.TestCase):
+    def test_round_trip(self):
+        self.assertEqual(cpu_layout.parse_cpu_list('0-3,8,10-11\n'), [0, 1, 2, 3, 8, 10, 11])
+        self.assertEqual(cpu_layout.format_cpu_list([11, 0, 1, 2, 3, 8, 10]), '0-3,8,10-11')
+        self.assertEqual(cpu_layout.parse_cpu_list(''), [])
+
+
+class TestNumaNodes(unittest.TestCase):
+    def setUp(self):
+        self.node_path = tempfile.mkdtemp()
+        for (node, cpulist) in ((0, '0-3'), (1, '4-7'), (10, '8-9')):
+            os.mkdir(os.path.join(self.node_path, 'node%d' % node))
+            with open(os.path.join(self.node_path, 'node%d' % node, 'cpulist'), 'w') as f:
+                f.write(cpulist + '\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.node_path)
+
+    def test_allowed_cpus_by_node(self):
+        nodes = cpu_layout.numa_nodes([1, 2, 5, 8, 9], self.node_path)
+        self.assertEqual(list(nodes.items()), [(0, [1, 2]), (1, [5]), (10, [8, 9])])
+
+    def test_unknown_topology(self):
+        self.assertEqual(dict(cpu_layout.numa_nodes([0, 1], os.path.join(self.node_path, 'missing'))),
+                         {0: [0, 1]})
+
+
+class TestCpuLayout(unittest.TestCase):
+    nodes = {0: [0, 1, 2], 1: [3, 4, 5]}
+
+    def test_slots(self):
+        layout = cpu_layout.CpuLayout(cpu_layout.CPU, self.nodes, cpus_per_worker=2)
+        self.assertEqual(layout.slots, [(0, [0, 1]), (0, [2]), (1, [3, 4]), (1, [5])])
+        self.assertEqual(layout.slot(5), (0, [2]))
+        self.assertEqual(cpu_layout.CpuLayout(cpu_layout.NUMA, self.nodes).slots, list(self.nodes.items()))
+        self.assertFalse(cpu_layout.CpuLayout(cpu_layout.NONE, self.nodes).enabled)
+        with self.assertRaises(ValueError):
+            cpu_layout.CpuLayout('socket', self.nodes)
+
+    def test_next_slot_index(self):
+        self.assertEqual(cpu_layout.next_slot_index([]), 0)
+        self.assertEqual(cpu_layout.next_slot_index([0, 2, None, 1, 4]), 3)
+
+
+class TestNativeThreads(unittest.TestCase):
+    def test_limit_keeps_explicit_settings(self):
+        environ = {'OMP_NUM_THREADS': '4'}
+        applied = cpu_layout.limit_native_threads(1, environ)
+        self.assertEqual(environ['OMP_NUM_THREADS'], '4')
+        self.assertEqual(environ['OPENBLAS_NUM_THREADS'], '1')
+        self.assertNotIn('OMP_NUM_THREADS', applied)
+        self.assertEqual(cpu_layout.limit_native_threads(0, {}), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -24,3 +24,14 @@ numpy_dtypes = {
 
 def to_numpy(dt):
     return numpy_dtypes[dt]
+
+
+def parse_transport_dtypes(value):
+    """Parses a comma separated list of `<input key>:<numpy dtype name>` pairs,
+    e.g. `image:uint8`, into a dict from input key to numpy dtype.
+    """
+    transport_dtypes = {}
+    for pair in filter(None, (p.strip() for p in value.split(','))):
+        input_key, _, dtype_name = pair.partition(':')
+        transport_dtypes[input_key.strip()] = np.dtype(dtype_name.strip()).type
+    return transport_dtypes
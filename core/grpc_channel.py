@@ -11,6 +11,7 @@ from grpc import insecure_channel
 from tensorflow_serving.apis.prediction_service_pb2 import PredictionServiceStub
 
 from tf_serving_flask_app import settings
+from tf_serving_flask_app.base.utils import as_boolean
 
 
 logger = logging.getLogger('core')
@@ -20,12 +21,53 @@ logger = logging.getLogger('core')
 # garbage collected.
 _managed_channel_refs = WeakList()
 
+# Values of `grpc_compression_algorithm` from grpc/compression_types.h accepted
+# by the `grpc.default_compression_algorithm` channel argument. grpcio does not
+# support per-call compression so we keep a separate compressed channel.
+COMPRESSION_ALGORITHMS = {
+    'none': 0,
+    'deflate': 1,
+    'gzip': 2,
+}
+
+
+def channel_options():
+    """Returns the gRPC channel arguments configured through environment variables.
+
+    - GRPC_MAX_SEND_MESSAGE_LENGTH and GRPC_MAX_RECEIVE_MESSAGE_LENGTH bound the
+      size of batched tensors in either direction.
+    - GRPC_HTTP2_WINDOW_SIZE sets the initial HTTP/2 stream window in bytes and
+      GRPC_HTTP2_BDP_PROBE toggles dynamic window sizing through bandwidth
+      delay product probing.
+    """
+    options = [
+        ('grpc.max_send_message_length', int(os.getenv(
+            'GRPC_MAX_SEND_MESSAGE_LENGTH',
+            settings.DEFAULT_GRPC_MAX_SEND_MESSAGE_LENGTH))),
+        ('grpc.max_receive_message_length', int(os.getenv(
+            'GRPC_MAX_RECEIVE_MESSAGE_LENGTH',
+            settings.DEFAULT_GRPC_MAX_RECEIVE_MESSAGE_LENGTH))),
+        ('grpc.http2.bdp_probe', int(as_boolean(os.getenv(
+            'GRPC_HTTP2_BDP_PROBE',
+            settings.DEFAULT_GRPC_HTTP2_BDP_PROBE)))),
+    ]
+    window_size = int(os.getenv(
+        'GRPC_HTTP2_WINDOW_SIZE',
+        settings.DEFAULT_GRPC_HTTP2_WINDOW_SIZE))
+    if window_size > 0:
+        options.append(('grpc.http2.lookahead_bytes', window_size))
+    return options
+
 
 class ManagedChannel:
     """Wraps and provides proper disposal of a (gRPC channel, prediction service stub) pair."""
     def __init__(self):
         self.channel = None
         self.stub = None
+        self.compressed_channel = None
+        self.compressed_stub = None
+        self.compression = 'none'
+        self.compression_min_bytes = 0
         self.connect()
 
     def connect(self):
@@ -35,6 +77,9 @@ class ManagedChannel:
         The hostname and port of the remote gRPC server are provided as environment
         variables.
 
+        If GRPC_COMPRESSION names a compression algorithm, a second channel with
+        compression enabled is bound for requests of at least GRPC_COMPRESSION_MIN_BYTES.
+
         We add a weak reference to the managed pair to a global pool for proper cleanup.
         """
         server_name = os.getenv(
@@ -44,15 +89,62 @@ class ManagedChannel:
             'TF_SERVER_PORT',
             settings.DEFAULT_TF_SERVER_PORT)
 
+        self.compression = os.getenv(
+            'GRPC_COMPRESSION',
+            settings.DEFAULT_GRPC_COMPRESSION).lower()
+        if self.compression not in COMPRESSION_ALGORITHMS:
+            raise ValueError('GRPC_COMPRESSION should be one of %s, got `%s`' %
+                             (sorted(COMPRESSION_ALGORITHMS), self.compression))
+        self.compression_min_bytes = int(os.getenv(
+            'GRPC_COMPRESSION_MIN_BYTES',
+            settings.DEFAULT_GRPC_COMPRESSION_MIN_BYTES))
+
         if server_name and server_port:
-            self.channel = insecure_channel('%s:%s' % (server_name, server_port))
+            target = '%s:%s' % (server_name, server_port)
+            options = channel_options()
+            self.channel = insecure_channel(target, options=options)
             self.stub = PredictionServiceStub(self.channel)
+            if self.compression != 'none':
+                compressed_options = options + [
+                    ('grpc.default_compression_algorithm', COMPRESSION_ALGORITHMS[self.compression])]
+                self.compressed_channel = insecure_channel(target, options=compressed_options)
+                self.compressed_stub = PredictionServiceStub(self.compressed_channel)
             _managed_channel_refs.append(self)
 
+    def select_stub(self, request):
+        """Returns a (stub, compression) pair for the request. Only requests whose
+        serialized size reaches the compression threshold are compressed since
+        compressing small payloads costs more CPU than the bandwidth it saves.
+        """
+        if self.compressed_stub and request.ByteSize() >= self.compression_min_bytes:
+            return self.compressed_stub, self.compression
+        return self.stub, 'none'
+
     def shutdown(self):
-        """Deletes the (gRPC channel, prediction service stub) pair."""
+        """Deletes the (gRPC channel, prediction service stub) pairs."""
         del self.channel
         del self.stub
+        del self.compressed_channel
+        del self.compressed_stub
+
+
+# Managed channels keyed by the pid of the process that created them.
+_process_managed_channels = {}
+
+
+def get_managed_channel():
+    """Returns the managed channel of the current process, creating it on first use.
+
+    gRPC channels are not fork-safe, so the channel is keyed by pid and a worker
+    forked from a preloaded master lazily creates its own channel instead of
+    inheriting one. Reusing a channel across requests avoids connection setup
+    on every prediction.
+    """
+    pid = os.getpid()
+    managed_channel = _process_managed_channels.get(pid)
+    if managed_channel is None:
+        managed_channel = _process_managed_channels.setdefault(pid, ManagedChannel())
+    return managed_channel
 
 
 def exit_handler():
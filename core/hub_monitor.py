@@ -0,0 +1,111 @@
+"""
+Measures how long blocking calls stall the eventlet hub of a worker process.
+
+A green thread sleeps for a fixed interval and records how late it wakes up,
+which is the time the hub spent blocked in code that did not yield, e.g. PIL
+decoding, NumPy work or a blocking gRPC call. A watchdog on a real OS thread
+notices when the green thread has not woken up for longer than a threshold
+and captures the stack of the blocked hub thread.
+"""
+
+import collections
+import logging
+import os
+import sys
+import traceback
+from timeit import default_timer
+
+from tf_serving_flask_app import settings
+from tf_serving_flask_app.base.utils import as_boolean
+from tf_serving_flask_app.core import metrics
+
+logger = logging.getLogger('core')
+
+eventlet_hub_lag_seconds = metrics.create_histogram(
+    'eventlet_hub_lag_seconds',
+    'Delay between the scheduled and actual wake-up of a green thread in seconds',
+    buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5., 10.))
+eventlet_hub_blocks_total = metrics.create_counter(
+    'eventlet_hub_blocks_total',
+    'Number of times the eventlet hub was blocked longer than the threshold',
+    labelnames=('location',))
+
+
+class HubMonitor(object):
+    """Measures eventlet hub lag and captures stacks of long blocks.
+
+    :param interval_secs: how often the lag is sampled.
+    :param block_threshold_secs: a hub blocked for longer than this has the
+        stack of the blocking code captured and logged.
+    :param stack_limit: the number of innermost frames that are logged.
+    """
+
+    def __init__(self, interval_secs, block_threshold_secs, stack_limit=20):
+        self.interval_secs = interval_secs
+        self.block_threshold_secs = block_threshold_secs
+        self.stack_limit = stack_limit
+        self.heartbeat = default_timer()
+        self.hub_thread_ident = None
+        # Blocks are captured on the watchdog thread and reported from the
+        # hub since locks in logging and metrics are green after patching.
+        self.blocks = collections.deque(maxlen=100)
+
+    def start(self):
+        """Starts monitoring the hub. Must be called from the hub's OS thread."""
+        import eventlet
+        from eventlet import patcher
+
+        self.hub_thread_ident = patcher.original('_thread').get_ident()
+        eventlet.spawn(self._measure_lag, eventlet.sleep)
+        watchdog = patcher.original('threading').Thread(
+            target=self._watch, args=(patcher.original('time').sleep,))
+        watchdog.daemon = True
+        watchdog.start()
+        logger.info('Monitoring the eventlet hub of process %d every %.3fs with a block threshold of %.3fs',
+                    os.getpid(), self.interval_secs, self.block_threshold_secs)
+
+    def _measure_lag(self, green_sleep):
+        while True:
+            scheduled = default_timer() + self.interval_secs
+            green_sleep(self.interval_secs)
+            self.heartbeat = default_timer()
+            eventlet_hub_lag_seconds.observe(max(self.heartbeat - scheduled, 0))
+            while self.blocks:
+                self._report(*self.blocks.popleft())
+
+    def _watch(self, real_sleep):
+        reported_heartbeat = None
+        while True:
+            real_sleep(self.interval_secs)
+            heartbeat = self.heartbeat
+            blocked_secs = default_timer() - heartbeat - self.interval_secs
+            if blocked_secs < self.block_threshold_secs or heartbeat == reported_heartbeat:
+                continue
+            frame = sys._current_frames().get(self.hub_thread_ident)
+            if frame is None:
+                continue
+            self.blocks.append((blocked_secs, traceback.extract_stack(frame, limit=self.stack_limit)))
+            reported_heartbeat = heartbeat
+
+    def _report(self, blocked_secs, stack):
+        innermost = stack[-1] if stack else None
+        location = '%s:%s' % (os.path.basename(innermost.filename), innermost.name) if innermost else 'unknown'
+        eventlet_hub_blocks_total.labels(location=location).inc()
+        logger.warning('The eventlet hub was blocked for at least %.3fs in `%s`:\n%s',
+                       blocked_secs, location, ''.join(traceback.format_list(stack)))
+
+
+def start_hub_monitor():
+    """Starts a hub monitor configured through environment variables when
+    EVENTLET_HUB_MONITOR is truthy. Called in eventlet workers after they
+    are initialized.
+    """
+    if not as_boolean(os.getenv('EVENTLET_HUB_MONITOR', settings.DEFAULT_EVENTLET_HUB_MONITOR)):
+        return None
+    monitor = HubMonitor(
+        float(os.getenv('EVENTLET_HUB_MONITOR_INTERVAL_SECS',
+                        settings.DEFAULT_EVENTLET_HUB_MONITOR_INTERVAL_SECS)),
+        float(os.getenv('EVENTLET_HUB_BLOCK_THRESHOLD_SECS',
+                        settings.DEFAULT_EVENTLET_HUB_BLOCK_THRESHOLD_SECS)))
+    monitor.start()
+    return monitor
@@ -2,6 +2,9 @@
 Defines a pre-processor for optimally converting an image file to a numpy array.
 """
 
+import io
+import math
+import os
 from typing import BinaryIO, Callable, List
 
 import numpy as np
@@ -10,9 +13,57 @@ from PIL import Image
 from spec.proto.dtypes_pb2 import DataType
 from spec.proto.input_pb2 import Image as ImageSpec
 from spec.proto.model_pb2 import Model
+from tf_serving_flask_app import settings
+from tf_serving_flask_app.base.exceptions import BadInputError
+from tf_serving_flask_app.base.utils import as_boolean
 from tf_serving_flask_app.core import dtypes
+from tf_serving_flask_app.core import metrics
 from tf_serving_flask_app.core.preprocessor import AbstractPreprocessor
 
+image_input_pixels = metrics.create_histogram(
+    'image_input_pixels',
+    'Number of pixels of input images read from their headers',
+    labelnames=('format',),
+    buckets=(64 * 64, 128 * 128, 256 * 256, 512 * 512, 1024 * 1024,
+             2048 * 2048, 4096 * 4096, 8192 * 8192, 16384 * 16384))
+image_input_bytes = metrics.create_histogram(
+    'image_input_bytes',
+    'Size of encoded input images in bytes',
+    labelnames=('format',),
+    buckets=(16 * 1024, 64 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024,
+             16 * 1024 * 1024, 64 * 1024 * 1024))
+image_input_rejected_total = metrics.create_counter(
+    'image_input_rejected_total',
+    'Number of input images rejected for exceeding a budget',
+    labelnames=('reason',))
+image_input_downsampled_total = metrics.create_counter(
+    'image_input_downsampled_total',
+    'Number of oversized input images decoded at a reduced scale',
+    labelnames=('format',))
+
+
+class ImageBudget(object):
+    """Limits on input images enforced from their headers before decoding.
+
+    :param max_pixels: the maximum width times height of an image, 0 for no limit.
+    :param max_bytes: the maximum size of an encoded image, 0 for no limit.
+    :param downsample: whether images over the pixel budget are decoded at a
+    reduced scale where the format supports it (JPEG) instead of rejected.
+    """
+
+    def __init__(self, max_pixels=0, max_bytes=0, downsample=False):
+        self.max_pixels = max_pixels
+        self.max_bytes = max_bytes
+        self.downsample = downsample
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_pixels=int(os.getenv('IMAGE_MAX_PIXELS', settings.DEFAULT_IMAGE_MAX_PIXELS)),
+            max_bytes=int(os.getenv('IMAGE_MAX_BYTES', settings.DEFAULT_IMAGE_MAX_BYTES)),
+            downsample=as_boolean(os.getenv('IMAGE_DOWNSAMPLE_OVERSIZED',
+                                            settings.DEFAULT_IMAGE_DOWNSAMPLE_OVERSIZED)))
+
 
 class ImagePreprocessor(AbstractPreprocessor):
     """The image pre-processor converts an image to a numpy array."""
@@ -22,7 +73,9 @@ class ImagePreprocessor(AbstractPreprocessor):
                  shape: List[int],
                  image_spec: ImageSpec,
                  preprocessor_function: Callable,
-                 image_data_format: int):
+                 image_data_format: int,
+                 transport_dtype: type = None,
+                 image_budget: ImageBudget = None):
         """
         :param dtype: The data type for the numpy array derived from the image.
 
@@ -38,17 +91,80 @@ class ImagePreprocessor(AbstractPreprocessor):
         :param image_data_format: Image data format convention to follow.
         The enum value CHANNELS_LAST assumes (height, width, channels)
         while the enum value CHANNELS_FIRST assumes  (channels, height, width).
+
+        :param transport_dtype: An optional compact numpy dtype like uint8 that
+        the image is shipped in instead of `dtype`. The served signature then
+        accepts that dtype and normalizes on the model server, so neither the
+        dtype conversion nor the pre-processor function run client side.
+
+        :param image_budget: Optional limits on the encoded size and pixel count
+        of input images checked before decoding.
         """
         self.image_spec = image_spec
 
         self.preprocessor_function = preprocessor_function
 
-        self.numpy_dtype = dtypes.to_numpy(dtype)
+        self.transport_dtype = transport_dtype
+
+        self.numpy_dtype = transport_dtype or dtypes.to_numpy(dtype)
 
         self.shape = shape
 
         self.image_data_format = image_data_format
 
+        self.image_budget = image_budget or ImageBudget()
+
+    def open_image(self, imagefp: BinaryIO):
+        """Opens an image and enforces the budgets from its header alone, so an
+        oversized image or a decompression bomb is never fully decoded.
+
+        Where the format supports it (JPEG), the image is set up to be decoded
+        directly at a reduced scale close to the target size, or within the
+        pixel budget for oversized images when downsampling is enabled.
+
+        :raises BadInputError for an image exceeding a budget.
+        """
+        imagefp.seek(0, io.SEEK_END)
+        nbytes = imagefp.tell()
+        imagefp.seek(0)
+        if self.image_budget.max_bytes and nbytes > self.image_budget.max_bytes:
+            image_input_rejected_total.labels(reason='bytes').inc()
+            raise BadInputError('Image of %d bytes exceeds the budget of %d bytes' %
+                                (nbytes, self.image_budget.max_bytes))
+
+        try:
+            img = Image.open(imagefp)
+        except Image.DecompressionBombError as e:
+            image_input_rejected_total.labels(reason='decompression_bomb').inc()
+            raise BadInputError(e)
+
+        width, height = img.size
+        image_format = img.format or 'unknown'
+        if metrics.recording():
+            image_input_pixels.labels(format=image_format).observe(width * height)
+            image_input_bytes.labels(format=image_format).observe(nbytes)
+
+        draft_mode = 'L' if self.image_spec.colorspace == ImageSpec.GRAYSCALE else None
+        max_pixels = self.image_budget.max_pixels
+        if max_pixels and width * height > max_pixels:
+            # The smallest JPEG DCT scale reduction bringing the image within budget.
+            min_reduction = math.sqrt(width * height / float(max_pixels))
+            reduction = next((r for r in (2, 4, 8) if r >= min_reduction), None)
+            if self.image_budget.downsample and reduction:
+                img.draft(draft_mode, (max(width // reduction, 1), max(height // reduction, 1)))
+            if img.size[0] * img.size[1] > max_pixels:
+                image_input_rejected_total.labels(reason='pixels').inc()
+                raise BadInputError('Image of %dx%d pixels exceeds the budget of %d pixels' %
+                                    (width, height, max_pixels))
+            if metrics.recording():
+                image_input_downsampled_total.labels(format=image_format).inc()
+        elif self.image_spec.target_width > 0 and self.image_spec.target_height > 0:
+            # Decoding JPEGs at a scale of 1/2, 1/4 or 1/8 that is still at least
+            # the target size is much cheaper than decoding at full size.
+            img.draft(draft_mode, (self.image_spec.target_width, self.image_spec.target_height))
+
+        return img
+
     def preprocess_image(self, imagefp: BinaryIO):
         """Converts an image file to a 3D numpy array.
 
@@ -69,8 +185,9 @@ class ImagePreprocessor(AbstractPreprocessor):
         CHANNELS_FIRST, we return a numpy array with shape
         (channels, height, width).
         """
-        # Opens an image in channels last format.
-        img = Image.open(imagefp)
+        # Opens an image in channels last format. Opening only reads the header,
+        # pixels are decoded on first access.
+        img = self.open_image(imagefp)
 
         if self.image_spec.colorspace == ImageSpec.GRAYSCALE and img.mode != 'L':
             img = img.convert('L')
@@ -137,5 +254,9 @@ class ImagePreprocessor(AbstractPreprocessor):
         if len(self.shape) > imgarray.ndim:
             imgarray = imgarray[np.newaxis, :]
 
+        # Normalization happens in the served graph for compact transport dtypes.
+        if self.transport_dtype:
+            return imgarray
+
         return self.preprocessor_function(imgarray)
 
@@ -0,0 +1,372 @@
+"""
+Instruments the memory of serving processes, opt-in through MEMORY_PROFILING.
+
+- Garbage collections and their pauses are counted per generation through
+  `gc.callbacks`.
+- Stages of a prediction report the memory blocks they leave allocated, and
+  the bytes traced by tracemalloc while it runs. Both are process wide, so
+  with concurrent predictions they are approximate.
+- Every prediction reports the bytes of the input and output arrays it
+  materializes at once.
+- The `/memory` route of the metrics exporter collects a tracemalloc top-N
+  report from every serving process. The exporter signals each process
+  registered in MEMORY_PROFILE_DIR with SIGUSR2, and each process writes its
+  report into that directory. Registrations record the start time of the
+  process, so a stale registration whose pid was reused by an unrelated
+  process is dropped instead of signalled. Tracing starts with the first request when
+  MEMORY_TRACEMALLOC_FRAMES is 0, so it costs nothing until someone asks.
+"""
+
+import gc
+import glob
+import linecache
+import logging
+import os
+import signal
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from timeit import default_timer
+from urllib.parse import parse_qs
+
+from tf_serving_flask_app import settings
+from tf_serving_flask_app.base.utils import as_boolean, humansize
+from tf_serving_flask_app.core import cooperative_rpc
+from tf_serving_flask_app.core import metrics
+
+logger = logging.getLogger('core')
+
+_BYTES_BUCKETS = (64 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024, 16 * 1024 * 1024,
+                  64 * 1024 * 1024, 256 * 1024 * 1024, 1024 * 1024 * 1024)
+_BLOCKS_BUCKETS = (0, 10, 100, 1000, 10000, 100000, 1000000)
+
+gc_collections_total = metrics.create_counter(
+    'gc_collections_total',
+    'Number of garbage collections',
+    labelnames=('generation',))
+gc_collected_objects_total = metrics.create_counter(
+    'gc_collected_objects_total',
+    'Number of unreachable objects freed by garbage collections',
+    labelnames=('generation',))
+gc_pause_seconds = metrics.create_histogram(
+    'gc_pause_seconds',
+    'Duration of garbage collections in seconds',
+    labelnames=('generation',),
+    buckets=(.0001, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.))
+stage_allocated_blocks = metrics.create_histogram(
+    'stage_allocated_blocks',
+    'Memory blocks left allocated by a stage of a prediction',
+    labelnames=('stage',),
+    buckets=_BLOCKS_BUCKETS)
+stage_traced_bytes = metrics.create_histogram(
+    'stage_traced_bytes',
+    'Growth of the memory traced by tracemalloc during a stage of a prediction in bytes',
+    labelnames=('stage',),
+    buckets=_BYTES_BUCKETS)
+prediction_peak_array_bytes = metrics.create_histogram(
+    'prediction_peak_array_bytes',
+    'Largest total size of the arrays a prediction materializes at once in bytes',
+    buckets=_BYTES_BUCKETS)
+
+SNAPSHOT_SIGNAL = signal.SIGUSR2
+
+# Whether the instrumentation of the current process is on.
+_enabled = False
+# A dict from pid to the thread local holding the pre-processed inputs and
+# decoded outputs of the prediction of the current green or OS thread, which
+# are each alive together. Created on first use, after eventlet patched the
+# worker, so that every green thread has its own.
+_process_request_arrays = {}
+# Serializes recording arrays pre-processed on several threads.
+_record_lock = threading.Lock()
+# A dict from generation to the start of the running garbage collection.
+_gc_start_times = {}
+
+
+def is_enabled():
+    return _enabled
+
+
+def profile_dir():
+    """Returns MEMORY_PROFILE_DIR, or by default a directory scoped to the
+    multiprocess metrics of the current gunicorn master."""
+    directory = os.getenv('MEMORY_PROFILE_DIR', settings.DEFAULT_MEMORY_PROFILE_DIR)
+    if directory:
+        return directory
+    if os.environ.get('prometheus_multiproc_dir'):
+        return os.path.join(os.environ['prometheus_multiproc_dir'], 'memory')
+    return os.path.join(tempfile.gettempdir(), 'tf_serving_flask_app_memory')
+
+
+def _request_arrays():
+    pid = os.getpid()
+    if pid not in _process_request_arrays:
+        if cooperative_rpc.is_green():
+            from eventlet.corolocal import local
+        else:
+            local = threading.local
+        _process_request_arrays[pid] = local()
+    return _process_request_arrays[pid]
+
+
+def _on_gc(phase, info):
+    generation = info['generation']
+    if phase == 'start':
+        _gc_start_times[generation] = default_timer()
+        return
+    start_time = _gc_start_times.pop(generation, None)
+    if start_time is None:
+        return
+    gc_collections_total.labels(generation=generation).inc()
+    gc_collected_objects_total.labels(generation=generation).inc(info['collected'])
+    gc_pause_seconds.labels(generation=generation).observe(max(default_timer() - start_time, 0))
+
+
+@contextmanager
+def stage(name):
+    """Measures the memory a stage of a prediction leaves allocated."""
+    if not _enabled or not metrics.recording():
+        yield
+        return
+    tracing = tracemalloc.is_tracing()
+    blocks = sys.getallocatedblocks()
+    traced = tracemalloc.get_traced_memory()[0] if tracing else 0
+    try:
+        yield
+    finally:
+        stage_allocated_blocks.labels(stage=name).observe(max(sys.getallocatedblocks() - blocks, 0))
+        if tracing:
+            stage_traced_bytes.labels(stage=name).observe(
+                max(tracemalloc.get_traced_memory()[0] - traced, 0))
+
+
+@contextmanager
+def track_arrays():
+    """Tracks the arrays recorded by a prediction with `record_array`."""
+    if not _enabled or not metrics.recording():
+        yield
+        return
+    request_arrays = _request_arrays()
+    stage_bytes = request_arrays.stage_bytes = {}
+    try:
+        yield
+    finally:
+        request_arrays.stage_bytes = None
+        with _record_lock:
+            peak = max(stage_bytes.values(), default=0)
+        prediction_peak_array_bytes.observe(peak)
+
+
+def record_array(stage_name, ndarray):
+    """Adds an array to the bytes a stage of the current prediction holds."""
+    stage_bytes = getattr(_request_arrays(), 'stage_bytes', None)
+    if stage_bytes is not None:
+        with _record_lock:
+            stage_bytes[stage_name] = stage_bytes.get(stage_name, 0) + ndarray.nbytes
+
+
+def propagate(fn):
+    """Binds the arrays tracked on the calling thread to `fn`, e.g. before
+    submitting `fn` to a thread pool."""
+    stage_bytes = getattr(_request_arrays(), 'stage_bytes', None)
+    if stage_bytes is None:
+        return fn
+
+    def bound(*args, **kwargs):
+        request_arrays = _request_arrays()
+        previous = getattr(request_arrays, 'stage_bytes', None)
+        request_arrays.stage_bytes = stage_bytes
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            request_arrays.stage_bytes = previous
+    return bound
+
+
+def _rss_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, ValueError):
+        return 0
+
+
+def format_report(top, key_type='lineno', previous=None):
+    """Returns a text report of the memory of the current process.
+
+    :param top: the number of allocation sites listed.
+    :param key_type: how allocations are grouped, `lineno`, `filename` or `traceback`.
+    :param previous: an earlier tracemalloc snapshot to report the growth since.
+    :return: a tuple of the report and the snapshot taken, None when not tracing.
+    """
+    lines = ['== process %d: rss %s, gc counts %s, allocated blocks %d' % (
+        os.getpid(), humansize(_rss_bytes()), gc.get_count(), sys.getallocatedblocks())]
+    if not tracemalloc.is_tracing():
+        lines.append('tracemalloc is not tracing')
+        return '\n'.join(lines) + '\n', None
+
+    traced, peak = tracemalloc.get_traced_memory()
+    lines.append('traced %s, peak %s, tracemalloc overhead %s' % (
+        humansize(traced), humansize(peak), humansize(tracemalloc.get_tracemalloc_memory())))
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, linecache.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap*>'),
+    ))
+    lines.append('top %d allocations by %s:' % (top, key_type))
+    for statistic in snapshot.statistics(key_type)[:top]:
+        lines.append('  %s' % statistic)
+    if previous is not None:
+        lines.append('top %d growth since the last report:' % top)
+        for statistic in snapshot.compare_to(previous, key_type)[:top]:
+            lines.append('  %s' % statistic)
+    return '\n'.join(lines) + '\n', snapshot
+
+
+def _process_start_time(pid):
+    """Returns the start time of a process in clock ticks since boot, None
+    if the process does not exist or /proc is unavailable."""
+    try:
+        with open('/proc/%d/stat' % pid) as f:
+            # The command in parentheses may contain spaces, the start time is
+            # the 22nd field.
+            return f.read().rsplit(')', 1)[1].split()[19]
+    except (IOError, IndexError):
+        return None
+
+
+def _pid_path(directory, pid):
+    return os.path.join(directory, '%d.pid' % pid)
+
+
+def _request_path(directory):
+    return os.path.join(directory, 'request')
+
+
+def _report_path(directory, pid):
+    return os.path.join(directory, '%d.report' % pid)
+
+
+class _SnapshotHandler(object):
+    """Writes a report on SNAPSHOT_SIGNAL, starting tracemalloc first if needed."""
+
+    def __init__(self, directory, frames):
+        self.directory = directory
+        self.frames = frames
+        self.previous = None
+
+    def __call__(self, signum, frame):
+        try:
+            top, key_type = 10, 'lineno'
+            try:
+                with open(_request_path(self.directory)) as f:
+                    top, key_type = f.read().split()
+                    top = int(top)
+            except (IOError, ValueError):
+                pass
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(max(self.frames, 1))
+                report = '== process %d: started tracing with tracemalloc, request again for a report\n' % \
+                    os.getpid()
+            else:
+                report, self.previous = format_report(top, key_type, self.previous)
+            path = _report_path(self.directory, os.getpid())
+            with open(path + '.tmp', 'w') as f:
+                f.write(report)
+            os.rename(path + '.tmp', path)
+        except Exception as e:
+            logger.exception(e)
+
+
+def start_profiling():
+    """Instruments the current serving process when MEMORY_PROFILING is set
+    and registers it for reports of the `/memory` route."""
+    global _enabled
+    if not as_boolean(os.getenv('MEMORY_PROFILING', settings.DEFAULT_MEMORY_PROFILING)) or _enabled:
+        return
+    _enabled = True
+    gc.callbacks.append(_on_gc)
+
+    frames = int(os.getenv('MEMORY_TRACEMALLOC_FRAMES', settings.DEFAULT_MEMORY_TRACEMALLOC_FRAMES))
+    if frames > 0 and not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+    directory = profile_dir()
+    os.makedirs(directory, exist_ok=True)
+    signal.signal(SNAPSHOT_SIGNAL, _SnapshotHandler(directory, frames))
+    with open(_pid_path(directory, os.getpid()), 'w') as f:
+        f.write(_process_start_time(os.getpid()) or '')
+    logger.info('Profiling the memory of process %d, reports are written to %s', os.getpid(), directory)
+
+
+def stop_profiling(pid):
+    """Unregisters a serving process that exited."""
+    directory = profile_dir()
+    for path in (_pid_path(directory, pid), _report_path(directory, pid)):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def memory_route(query):
+    """Collects reports from every registered serving process. Takes the
+    query parameters `top` (default 10) and `key_type` (default `lineno`).
+
+    :return: a tuple of the concatenated text reports and the content type.
+    """
+    params = parse_qs(query)
+    top = int(params.get('top', ['10'])[0])
+    key_type = params.get('key_type', ['lineno'])[0]
+    if key_type not in ('lineno', 'filename', 'traceback'):
+        key_type = 'lineno'
+    timeout_secs = float(os.getenv('MEMORY_REPORT_TIMEOUT_SECS', settings.DEFAULT_MEMORY_REPORT_TIMEOUT_SECS))
+
+    directory = profile_dir()
+    os.makedirs(directory, exist_ok=True)
+    with open(_request_path(directory), 'w') as f:
+        f.write('%d %s' % (top, key_type))
+
+    pending = []
+    for path in glob.glob(os.path.join(directory, '*.pid')):
+        pid = int(os.path.basename(path)[:-len('.pid')])
+        try:
+            with open(path) as f:
+                start_time = f.read().strip()
+        except IOError:
+            continue
+        # A registration left behind by a killed process may name a pid now
+        # used by an unrelated process, which SIGUSR2 would terminate.
+        if start_time != (_process_start_time(pid) or ''):
+            stop_profiling(pid)
+            continue
+        try:
+            os.remove(_report_path(directory, pid))
+        except OSError:
+            pass
+        try:
+            os.kill(pid, SNAPSHOT_SIGNAL)
+            pending.append(pid)
+        except ProcessLookupError:
+            stop_profiling(pid)
+
+    reports = []
+    deadline = default_timer() + timeout_secs
+    while pending and default_timer() < deadline:
+        for pid in list(pending):
+            path = _report_path(directory, pid)
+            try:
+                with open(path) as f:
+                    reports.append(f.read())
+                pending.remove(pid)
+            except IOError:
+                pass
+        if pending:
+            time.sleep(.05)
+    for pid in pending:
+        reports.append('== process %d: no report within %.1fs\n' % (pid, timeout_secs))
+    if not reports:
+        reports.append('No process profiles its memory, set MEMORY_PROFILING=1\n')
+    return '\n'.join(reports).encode('utf-8'), 'text/plain; charset=utf-8'
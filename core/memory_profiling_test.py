@@ -0,0 +1,84 @@
+import gc
+import os
+import shutil
+import signal
+import tempfile
+import tracemalloc
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from tf_serving_flask_app.core import memory_profiling
+
+
+class TestMemoryProfiling(unittest.TestCase):
+    def setUp(self):
+        self.profile_dir = tempfile.mkdtemp()
+        self.environ = mock.patch.dict(os.environ, {
+            'MEMORY_PROFILING': '1',
+            'MEMORY_PROFILE_DIR': self.profile_dir,
+        })
+        self.environ.start()
+
+    def tearDown(self):
+        if memory_profiling.is_enabled():
+            gc.callbacks.remove(memory_profiling._on_gc)
+            signal.signal(memory_profiling.SNAPSHOT_SIGNAL, signal.SIG_DFL)
+            memory_profiling._enabled = False
+        tracemalloc.stop()
+        self.environ.stop()
+        shutil.rmtree(self.profile_dir)
+
+    def test_disabled_is_a_no_op(self):
+        with memory_profiling.track_arrays():
+            memory_profiling.record_array('preprocess', np.zeros(8))
+        self.assertIsNone(getattr(memory_profiling._request_arrays(), 'stage_bytes', None))
+
+    def test_peak_array_bytes(self):
+        memory_profiling.start_profiling()
+        before = memory_profiling.prediction_peak_array_bytes._sum.get()
+        with memory_profiling.track_arrays():
+            memory_profiling.record_array('preprocess', np.zeros(100, np.uint8))
+            memory_profiling.propagate(memory_profiling.record_array)('preprocess', np.zeros(28, np.uint8))
+            memory_profiling.record_array('postprocess', np.zeros(64, np.uint8))
+        self.assertEqual(memory_profiling.prediction_peak_array_bytes._sum.get() - before, 128)
+
+    def test_overlapping_predictions(self):
+        memory_profiling.start_profiling()
+        before = memory_profiling.prediction_peak_array_bytes._sum.get()
+        first, second = memory_profiling.track_arrays(), memory_profiling.track_arrays()
+        first.__enter__()
+        second.__enter__()
+        first.__exit__(None, None, None)
+        memory_profiling.record_array('preprocess', np.zeros(16, np.uint8))
+        second.__exit__(None, None, None)
+        self.assertEqual(memory_profiling.prediction_peak_array_bytes._sum.get() - before, 0)
+
+    def test_stale_registration_is_not_signalled(self):
+        with open(os.path.join(self.profile_dir, '%d.pid' % os.getpid()), 'w') as f:
+            f.write('1')
+        with mock.patch('os.kill') as kill:
+            body, _ = memory_profiling.memory_route('')
+        kill.assert_not_called()
+        self.assertIn(b'No process profiles its memory', body)
+        self.assertEqual(os.listdir(self.profile_dir), ['request'])
+
+    def test_memory_route(self):
+        memory_profiling.start_profiling()
+        body, content_type = memory_profiling.memory_route('top=3')
+        self.assertIn(b'started tracing', body)
+        allocations = [bytearray(1024) for _ in range(100)]
+        body, content_type = memory_profiling.memory_route('top=3')
+        self.assertIn(b'top 3 allocations by lineno', body)
+        self.assertIn(b'memory_profiling_test.py', body)
+        self.assertTrue(content_type.startswith('text/plain'))
+        del allocations
+
+        memory_profiling.stop_profiling(os.getpid())
+        body, _ = memory_profiling.memory_route('')
+        self.assertIn(b'No process profiles its memory', body)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,50 +1,310 @@
 import inspect
 import functools
+import glob
+import logging
+import os
 import threading
+import time
+from contextlib import contextmanager
 from timeit import default_timer
 
-from flask import Flask
 from werkzeug.serving import is_running_from_reloader
 from prometheus_client import Counter, Histogram, Gauge, Summary
 from prometheus_client import multiprocess
 from prometheus_client import generate_latest, CollectorRegistry, CONTENT_TYPE_LATEST
 from prometheus_client import REGISTRY as DEFAULT_REGISTRY
+try:
+    from prometheus_client.mmap_dict import MmapedDict
+except ImportError:
+    from prometheus_client.core import _MmapedDict as MmapedDict
 
+from tf_serving_flask_app import settings
+from tf_serving_flask_app.core.metrics_exporter import MetricsExporter
 
-def register_endpoint(port, host='0.0.0.0', endpoint='/metrics'):
-    """Exposes Prometheus metrics as a separate flask application
-    on a different thread. This ensures that worker processes are
-    used only for prediction requests and frequently scraping metrics
-    does not result in a worker process not being available for serving.
+logger = logging.getLogger('core')
+
+
+def register_endpoint(port, host='0.0.0.0', endpoint='/metrics', routes=None):
+    """Exposes Prometheus metrics on a dedicated lightweight HTTP server
+    either on daemon threads or, with `METRICS_EXPORTER_MODE=process`, in a
+    sidecar process. This ensures that worker processes are used only for
+    prediction requests and frequently scraping metrics does not result in
+    a worker process not being available for serving.
+
+    Scrapes are served from a cache for `METRICS_SCRAPE_CACHE_TTL_SECS` and
+    the files of dead worker processes are periodically compacted every
+    `METRICS_COMPACTION_INTERVAL_SECS` so that the cost of a scrape does not
+    grow with the number of worker restarts.
 
     :param port: the HTTP port to expose the metrics endpoint on
     :param host: the HTTP host to listen on (default: `0.0.0.0`)
     :param endpoint: the URL path to expose the endpoint on
         (default: `/metrics`)
+    :param routes: an optional dict of additional routes from URL path to a
+        callable taking the query string and returning `(body, content type)`
     """
     if is_running_from_reloader():
         return
 
-    app = Flask('prometheus-metrics-exporter-%d' % port)
+    exporter_mode = os.getenv(
+        'METRICS_EXPORTER_MODE',
+        settings.DEFAULT_METRICS_EXPORTER_MODE)
+    if exporter_mode not in ('thread', 'process'):
+        raise ValueError('METRICS_EXPORTER_MODE should be one of `thread` or `process`, got `%s`' %
+                         exporter_mode)
+    cache_ttl_secs = float(os.getenv(
+        'METRICS_SCRAPE_CACHE_TTL_SECS',
+        settings.DEFAULT_METRICS_SCRAPE_CACHE_TTL_SECS))
+    compaction_interval_secs = float(os.getenv(
+        'METRICS_COMPACTION_INTERVAL_SECS',
+        settings.DEFAULT_METRICS_COMPACTION_INTERVAL_SECS))
+    scrape_cache = _ScrapeCache(cache_ttl_secs)
+
+    def prometheus_metrics(query):
+        return scrape_cache.get(), CONTENT_TYPE_LATEST
+
+    exporter_routes = dict(routes or {})
+    exporter_routes[endpoint] = prometheus_metrics
+    exporter = MetricsExporter(host, port, exporter_routes)
+
+    def start_compaction():
+        if compaction_interval_secs > 0:
+            compaction_thread = threading.Thread(target=_compact_periodically,
+                                                 args=(compaction_interval_secs,))
+            compaction_thread.setDaemon(True)
+            compaction_thread.start()
+
+    # Compaction runs in the process that serves scrapes since both are
+    # serialized on the same lock.
+    if exporter_mode == 'process':
+        exporter.start_process(on_start=start_compaction)
+    else:
+        exporter.start_thread()
+        start_compaction()
+    return exporter
+
+
+# Serializes scrapes and compaction since both read the multiprocess directory
+# and compaction removes the files it merges.
+_multiprocess_dir_lock = threading.Lock()
+
+# Worker processes marked dead whose files have not been compacted yet.
+_dead_pids = set()
+
+# Types of metrics whose per process values are summed across processes and
+# can therefore be merged into a single aggregate file. The gauges of a dead
+# process, of every multiprocess mode, are removed by `mark_process_dead`.
+_COMPACTABLE_TYPES = ('counter', 'histogram')
+
+
+def collect_multiprocess_metrics():
+    """Merges the metrics of all processes into the Prometheus text format."""
+    start_time = default_timer()
+    with _multiprocess_dir_lock:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        output = generate_latest(registry)
+    metrics_scrape_duration_seconds.observe(max(default_timer() - start_time, 0))
+    return output
+
 
-    @app.route(endpoint)
-    def prometheus_metrics():
+def collect_multiprocess_totals(names):
+    """Sums the samples of the named metrics over all processes and labels,
+    e.g. for a supervisor in the gunicorn master deciding on aggregate load.
+
+    :param names: sample names like `scheduler_inflight` or
+    `prediction_request_duration_seconds_count`.
+    :return: a dict from sample name to the total, 0 for missing samples.
+    """
+    totals = dict((name, 0.) for name in names)
+    with _multiprocess_dir_lock:
         registry = CollectorRegistry()
         multiprocess.MultiProcessCollector(registry)
-        headers = {'Content-Type': CONTENT_TYPE_LATEST}
-        return generate_latest(registry), 200, headers
+        for family in registry.collect():
+            for sample in family.samples:
+                # Samples are (name, labels, value, ...) tuples.
+                if sample[0] in totals:
+                    totals[sample[0]] += sample[2]
+    return totals
+
+
+class _ScrapeCache(object):
+    """Serves the last collected scrape for a short time-to-live so that
+    concurrent or redundant scrapes do not re-read every file."""
+
+    def __init__(self, ttl_secs):
+        self.ttl_secs = ttl_secs
+        self.lock = threading.Lock()
+        self.output = None
+        self.collected_at = 0
+
+    def get(self):
+        with self.lock:
+            now = default_timer()
+            if self.output is None or now - self.collected_at >= self.ttl_secs:
+                self.output = collect_multiprocess_metrics()
+                self.collected_at = now
+            return self.output
+
+
+def _remove_gauges(pid, path):
+    """Removes the gauge files of a process. Unlike prometheus_client, which
+    only removes `livesum` and `liveall` gauges, this also removes `min`, `max`
+    and `all` gauges, so that aggregates only cover live processes and the
+    files of restarted workers do not pile up."""
+    for f in glob.glob(os.path.join(path, 'gauge_*_%d.db' % pid)):
+        try:
+            os.remove(f)
+        except FileNotFoundError:
+            pass
+
+
+def mark_process_dead(pid, path=None):
+    """Removes the gauges of a dead worker process and queues its counter
+    and histogram files for compaction.
+
+    See https://github.com/prometheus/client_python#multiprocess-mode-gunicorn
+    """
+    path = path or os.environ.get('prometheus_multiproc_dir')
+    if not path:
+        return
+    with _multiprocess_dir_lock:
+        _remove_gauges(pid, path)
+        _dead_pids.add(pid)
+
+
+def _find_exited_pids(path):
+    """Finds processes with counter, histogram or gauge files that no longer
+    exist. This covers processes marked dead in another process, e.g. when
+    metrics are served from a sidecar process while the gunicorn master reaps
+    workers, and workers whose death was never marked, e.g. of a killed master.
+    """
+    exited_pids = set()
+    for filename in os.listdir(path):
+        typ, _, suffix = filename.partition('_')
+        pid = suffix.rpartition('_')[2][:-len('.db')] if typ == 'gauge' else suffix[:-len('.db')]
+        if (typ not in _COMPACTABLE_TYPES and typ != 'gauge') or not pid.isdigit():
+            continue
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            exited_pids.add(int(pid))
+        except PermissionError:
+            pass
+    return exited_pids
+
+
+def compact_dead_processes(path=None):
+    """Merges the counter and histogram files of dead worker processes into
+    one aggregate file per metric type, removes the merged files and removes
+    the gauge files of dead processes.
+
+    :return: the number of merged files.
+    """
+    path = path or os.environ.get('prometheus_multiproc_dir')
+    if not path:
+        return 0
+
+    num_merged_files = 0
+    with _multiprocess_dir_lock:
+        dead_pids = _dead_pids | _find_exited_pids(path)
+        for pid in dead_pids:
+            _remove_gauges(pid, path)
+        for typ in _COMPACTABLE_TYPES:
+            dead_files = [os.path.join(path, '%s_%d.db' % (typ, pid)) for pid in dead_pids]
+            dead_files = [f for f in dead_files if os.path.exists(f)]
+            if not dead_files:
+                continue
+
+            aggregate = MmapedDict(os.path.join(path, '%s_aggregate.db' % typ))
+            try:
+                for dead_file in dead_files:
+                    values = MmapedDict(dead_file)
+                    try:
+                        for (key, value) in list(values.read_all_values()):
+                            aggregate.write_value(key, aggregate.read_value(key) + value)
+                    finally:
+                        values.close()
+                    # Remove each file right after merging it so that an
+                    # interrupted compaction never counts a file twice.
+                    os.remove(dead_file)
+                    num_merged_files += 1
+            finally:
+                aggregate.close()
+        _dead_pids.clear()
+    return num_merged_files
+
+
+def _compact_periodically(interval_secs):
+    while True:
+        time.sleep(interval_secs)
+        try:
+            num_merged_files = compact_dead_processes()
+            if num_merged_files:
+                logger.info('Compacted %d metrics files of dead processes', num_merged_files)
+        except Exception as e:
+            logger.exception(e)
+
+
+# Cleared while a worker warms up so that synthetic predictions are not
+# recorded in the metrics of the prediction flow, which the autoscaler reads.
+_recording = True
+
+
+def recording():
+    """Returns False while the metrics of the prediction flow are suppressed."""
+    return _recording
+
+
+@contextmanager
+def suppressed():
+    """Suppresses the method decorators and the explicit observations of the
+    prediction flow in the current process, e.g. while warming up a worker."""
+    global _recording
+    previous = _recording
+    _recording = False
+    try:
+        yield
+    finally:
+        _recording = previous
+
+
+def create_histogram(name, description, labelnames=(), **kwargs):
+    """
+    Creates a Histogram for values that are observed explicitly
+    rather than through a method decorator, like payload sizes.
+    :param name: the name of the metric
+    :param description: the description of the metric
+    :param labelnames: the names of the labels of the metric
+    :param kwargs: additional keyword arguments for creating the Histogram
+    """
+    return Histogram(name, description, labelnames=labelnames,
+                     registry=DEFAULT_REGISTRY, **kwargs)
+
+
+def create_counter(name, description, labelnames=(), **kwargs):
+    """
+    Creates a Counter that is incremented explicitly.
+    :param name: the name of the metric
+    :param description: the description of the metric
+    :param labelnames: the names of the labels of the metric
+    :param kwargs: additional keyword arguments for creating the Counter
+    """
+    return Counter(name, description, labelnames=labelnames,
+                   registry=DEFAULT_REGISTRY, **kwargs)
 
-    def run_app():
-        # Since we run in a separate thread, we turn off debugging and
-        # the use of the reloader explicitly. The reloader expects the
-        # Flask application to run in the main thread and the metric
-        # app dies with a `ValueError: signal only works in main thread`
-        # if started with the reloader.
-        app.run(host=host, port=port, debug=False, use_reloader=False)
 
-    thread = threading.Thread(target=run_app)
-    thread.setDaemon(True)
-    thread.start()
+def create_gauge(name, description, labelnames=(), **kwargs):
+    """
+    Creates a Gauge that is set explicitly.
+    :param name: the name of the metric
+    :param description: the description of the metric
+    :param labelnames: the names of the labels of the metric
+    :param kwargs: additional keyword arguments for creating the Gauge,
+        e.g. `multiprocess_mode`
+    """
+    return Gauge(name, description, labelnames=labelnames,
+                 registry=DEFAULT_REGISTRY, **kwargs)
 
 
 def histogram(name, description, labels=None, **kwargs):
@@ -167,6 +427,9 @@ def _track(metric_type, metric_call, metric_kwargs, name, description, labels,
     def decorator(f):
         @functools.wraps(f)
         def func(*args, **kwargs):
+            if not _recording:
+                return f(*args, **kwargs)
+
             if before:
                 metric = get_metric(None)
                 before(metric)
@@ -188,3 +451,8 @@ def _track(metric_type, metric_call, metric_kwargs, name, description, labels,
 
     return decorator
 
+
+metrics_scrape_duration_seconds = create_histogram(
+    'metrics_scrape_duration_seconds',
+    'Duration of collecting the multiprocess metrics for a scrape in seconds',
+)
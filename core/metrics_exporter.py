@@ -0,0 +1,113 @@
+"""
+Defines a minimal HTTP server exporting metrics, used in place of a Flask
+development server so that scraping stays cheap and never competes with
+prediction requests.
+
+The exporter either runs on daemon threads of the current process or in a
+separate sidecar process that does not share the GIL with prediction threads.
+"""
+
+import gzip
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from tf_serving_flask_app.base.utils import accepts_gzip
+
+logger = logging.getLogger('core')
+
+# Responses smaller than this are not worth compressing.
+GZIP_MIN_BYTES = 1024
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    """Serves each scrape on its own daemon thread so that concurrent
+    scrapes do not queue behind each other."""
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _ExporterRequestHandler(BaseHTTPRequestHandler):
+    # Set on the subclass created per exporter.
+    routes = {}
+
+    def do_GET(self):
+        path, _, query = self.path.partition('?')
+        route = self.routes.get(path)
+        if route is None:
+            self.send_error(404)
+            return
+
+        try:
+            body, content_type = route(query)
+        except Exception as e:
+            logger.exception(e)
+            self.send_error(500)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        if len(body) >= GZIP_MIN_BYTES and accepts_gzip(self.headers.get('Accept-Encoding')):
+            body = gzip.compress(body)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes are frequent, keep them out of the application logs.
+        pass
+
+
+class MetricsExporter(object):
+    """Serves a table of routes on a dedicated HTTP server.
+
+    :param host: the HTTP host to listen on
+    :param port: the HTTP port to listen on
+    :param routes: a dict from URL path to a callable that takes the raw query
+        string and returns a `(body bytes, content type)` pair
+    """
+
+    def __init__(self, host, port, routes):
+        self.host = host
+        self.port = port
+        self.routes = dict(routes)
+
+    def _serve_forever(self):
+        handler = type('RequestHandler', (_ExporterRequestHandler,), {'routes': self.routes})
+        server = _ThreadingHTTPServer((self.host, self.port), handler)
+        logger.info('Exporting metrics at http://%s:%d/ from process %d',
+                    self.host, self.port, os.getpid())
+        server.serve_forever()
+
+    def start_thread(self):
+        """Serves on a daemon thread of the current process."""
+        thread = threading.Thread(target=self._serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+        return thread
+
+    def start_process(self, on_start=None):
+        """Serves from a sidecar process forked from the current process.
+
+        The sidecar exits when its parent dies, so a killed gunicorn master
+        does not leave an orphan holding the metrics port.
+
+        :param on_start: an optional callable run in the sidecar process once
+            it serves, e.g. to start background maintenance threads.
+        """
+        process = multiprocessing.Process(target=self._run_sidecar, args=(os.getpid(), on_start))
+        process.daemon = True
+        process.start()
+        return process
+
+    def _run_sidecar(self, parent_pid, on_start):
+        self.start_thread()
+        if on_start:
+            on_start()
+        while os.getppid() == parent_pid:
+            time.sleep(1)
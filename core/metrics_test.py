@@ -0,0 +1,81 @@
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+
+from tf_serving_flask_app.core import metrics
+
+
+class TestMultiprocessFiles(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        metrics._dead_pids.clear()
+        shutil.rmtree(self.path)
+
+    def touch(self, *filenames):
+        for filename in filenames:
+            open(os.path.join(self.path, filename), 'w').close()
+
+    def test_mark_process_dead_removes_every_gauge(self):
+        self.touch('gauge_max_101.db', 'gauge_min_101.db', 'gauge_all_101.db', 'gauge_livesum_101.db',
+                   'gauge_max_1011.db', 'counter_101.db')
+        metrics.mark_process_dead(101, self.path)
+        self.assertEqual(sorted(os.listdir(self.path)), ['counter_101.db', 'gauge_max_1011.db'])
+        self.assertIn(101, metrics._dead_pids)
+
+    def write_values(self, filename, values):
+        mmaped_dict = metrics.MmapedDict(os.path.join(self.path, filename))
+        for ((metric_name, name, labels), value) in values.items():
+            mmaped_dict.write_value(json.dumps([metric_name, name, dict(labels)], sort_keys=True), value)
+        mmaped_dict.close()
+
+    def test_compact_dead_processes(self):
+        dead_pid = subprocess.Popen(['true']).pid
+        os.waitpid(dead_pid, 0)
+        live_pid = os.getpid()
+        requests = ('requests_total', 'requests_total', (('status', '200'),))
+        latency_count = ('latency_seconds', 'latency_seconds_count', ())
+        latency_bucket = ('latency_seconds', 'latency_seconds_bucket', (('le', '+Inf'),))
+        latency_sum = ('latency_seconds', 'latency_seconds_sum', ())
+        self.write_values('counter_aggregate.db', {requests: 5.})
+        self.write_values('counter_%d.db' % dead_pid, {requests: 3.})
+        self.write_values('counter_%d.db' % live_pid, {requests: 1.})
+        self.write_values('histogram_%d.db' % dead_pid, {latency_count: 2., latency_bucket: 2., latency_sum: .5})
+        inflight = ('inflight', 'inflight', ())
+        for filename in ('gauge_max_%d.db' % dead_pid, 'gauge_all_%d.db' % dead_pid, 'gauge_max_%d.db' % live_pid):
+            self.write_values(filename, {inflight: 1.})
+
+        with mock.patch.dict(os.environ, {'prometheus_multiproc_dir': self.path}):
+            totals = metrics.collect_multiprocess_totals(['requests_total', 'latency_seconds_count'])
+            self.assertEqual(metrics.compact_dead_processes(), 2)
+            self.assertEqual(metrics.collect_multiprocess_totals(['requests_total', 'latency_seconds_count']),
+                             totals)
+            self.assertEqual(totals, {'requests_total': 9., 'latency_seconds_count': 2.})
+            self.assertEqual(metrics.compact_dead_processes(), 0)
+        self.assertEqual(sorted(os.listdir(self.path)), sorted([
+            'counter_aggregate.db', 'counter_%d.db' % live_pid, 'histogram_aggregate.db',
+            'gauge_max_%d.db' % live_pid]))
+
+
+class TestSuppressed(unittest.TestCase):
+    def test_decorators_skip_suppressed_calls(self):
+        @metrics.counter('suppressed_test_calls_total', 'Counts calls of the test function')
+        def call():
+            return 42
+
+        self.assertEqual(call(), 42)
+        with metrics.suppressed():
+            self.assertFalse(metrics.recording())
+            self.assertEqual(call(), 42)
+        self.assertTrue(metrics.recording())
+        self.assertEqual(call(), 42)
+        self.assertEqual(metrics.DEFAULT_REGISTRY.get_sample_value('suppressed_test_calls_total'), 2.)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+"""
+Fetches the signature of the served model through the GetModelMetadata API
+and validates the spec against it on startup.
+"""
+
+import logging
+
+from grpc import RpcError
+import tensorflow as tf
+from tensorflow_serving.apis.get_model_metadata_pb2 import GetModelMetadataRequest, SignatureDefMap
+
+from tf_serving_flask_app.base.exceptions import SignatureMismatchError
+from tf_serving_flask_app.core.grpc_channel import get_managed_channel
+
+logger = logging.getLogger('core')
+
+DEFAULT_SERVING_SIGNATURE_DEF_KEY = 'serving_default'
+
+
+def fetch_signature_def(model_spec, timeout_secs):
+    """Fetches the signature definition named in the model spec from the model server.
+
+    :param model_spec: The model specification naming the model, version and signature.
+    :param timeout_secs: The timeout of the metadata RPC.
+    :return: a SignatureDef protocol buffer.
+
+    :raises RpcError if the metadata could not be fetched and a SignatureMismatchError
+    if the model server does not serve the signature.
+    """
+    request = GetModelMetadataRequest()
+    request.model_spec.name = model_spec.name
+    if model_spec.version > 0:
+        request.model_spec.version.value = model_spec.version
+    request.metadata_field.append('signature_def')
+
+    managed_channel = get_managed_channel()
+    response = managed_channel.stub.GetModelMetadata(request, timeout=timeout_secs)
+
+    signature_def_map = SignatureDefMap()
+    response.metadata['signature_def'].Unpack(signature_def_map)
+
+    signature_name = model_spec.signature_name or DEFAULT_SERVING_SIGNATURE_DEF_KEY
+    if signature_name not in signature_def_map.signature_def:
+        raise SignatureMismatchError(
+            'Model `%s` does not serve a signature named `%s`, available signatures are %s' %
+            (model_spec.name, signature_name, sorted(signature_def_map.signature_def)))
+    return signature_def_map.signature_def[signature_name]
+
+
+def validate_transport_dtypes(spec_borg, signature_def):
+    """Checks that every input shipped in a compact transport dtype is accepted
+    in that dtype by the served signature.
+
+    :raises SignatureMismatchError for the first non-conformant input.
+    """
+    for (input_key, transport_dtype) in spec_borg.input_transport_dtypes.items():
+        if input_key not in spec_borg.input_specs:
+            raise SignatureMismatchError(
+                'Transport dtype specified for `%s` which is not an input in the spec' % input_key)
+        if input_key not in signature_def.inputs:
+            raise SignatureMismatchError(
+                'Input `%s` is not an input of the served signature' % input_key)
+
+        served_dtype = signature_def.inputs[input_key].dtype
+        transport_tf_dtype = tf.as_dtype(transport_dtype)
+        if served_dtype != transport_tf_dtype.as_datatype_enum:
+            raise SignatureMismatchError(
+                'Input `%s` is shipped as `%s` but the served signature expects `%s`' %
+                (input_key, transport_tf_dtype.name, tf.as_dtype(served_dtype).name))
+        logger.info('Input `%s` is shipped as `%s` and normalized by the model server',
+                    input_key, transport_tf_dtype.name)
+
+
+def validate_spec_against_served_model(spec_borg, timeout_secs):
+    """Validates the spec against the signature of the served model.
+
+    An unreachable model server only degrades to a warning since the
+    model server may legitimately come up after the Flask application.
+    Inputs are then shipped in their spec dtypes since the transport dtypes
+    could not be confirmed.
+
+    :return: the served SignatureDef or None if it could not be fetched.
+    :raises SignatureMismatchError if the spec does not conform to the signature.
+    """
+    try:
+        signature_def = fetch_signature_def(spec_borg.model_spec, timeout_secs)
+    except RpcError as e:
+        logger.warning('Skipping validation against the served model signature, '
+                       'failed fetching model metadata with `%s`', e)
+        if spec_borg.input_transport_dtypes:
+            logger.warning('Shipping inputs %s in their spec dtypes, the served signature could not '
+                           'confirm their transport dtypes', sorted(spec_borg.input_transport_dtypes))
+            spec_borg.drop_transport_dtypes()
+        return None
+
+    validate_transport_dtypes(spec_borg, signature_def)
+    return signature_def
@@ -26,5 +26,11 @@ class PassthroughPostprocessor(AbstractPostprocessor):
         """
         self.postprocessor_function = postprocessor_function
 
+    @property
+    def required_outputs(self):
+        """The output keys a model post-processor reads, as declared by its
+        function, which must be fetched whichever outputs a caller selects."""
+        return tuple(getattr(self.postprocessor_function, 'required_outputs', ()))
+
     def postprocess_impl(self, response):
         return self.postprocessor_function(response)
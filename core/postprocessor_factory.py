@@ -4,25 +4,50 @@ Defines a factory method for instantiating post-processor functions and callable
 
 import logging
 
-from tf_serving_flask_app.core import postprocessor
+from tf_serving_flask_app.core import builtin_postprocessors, postprocessor
 from tf_serving_flask_app.base.dynamic_imports import identity, \
     import_function_or_identity, \
     import_callable_class_or_identity, \
-    name
+    is_builtin, name, parse_builtin, safe_eval_lambda
 
 logger = logging.getLogger('core')
 
 
-def get_postprocessor(output_specification):
+def create_builtin_or_identity(full_name, builtins):
+    """Instantiates a built-in post-processor from a `builtin:` spec string,
+    degrading to the identity function on failure like dynamic imports do.
+    """
+    try:
+        builtin_name, params = parse_builtin(full_name)
+        return builtin_postprocessors.create(builtin_name, params, builtins)
+    except Exception as e:
+        logger.error(
+            'Failed instantiating built-in post-processor %s with exception %s, '
+            'degrading to the identity function',
+            full_name, e)
+    return identity
+
+
+def get_postprocessor(output_specification,
+                      builtins=builtin_postprocessors.output_postprocessors):
     """Factory method that returns a post-processor specific to the type
     mentioned in the output specification.
 
     :param output_specification: An output_pb2.Output that describes how
     the prediction response should be post-processed.
 
+    :param builtins: The registry of built-in post-processors that
+    `builtin:` prefixed post-processor functions are resolved against.
+
     https://github.com/faif/python-patterns/blob/master/creational/factory_method.py
     """
-    if output_specification.HasField('postprocessor_function'):
+    if output_specification.HasField('postprocessor_function') \
+            and is_builtin(output_specification.postprocessor_function):
+        logger.debug('Attempting to instantiate built-in post-processor "%s"' %
+                     output_specification.postprocessor_function)
+        postprocessor_function = create_builtin_or_identity(
+            output_specification.postprocessor_function, builtins)
+    elif output_specification.HasField('postprocessor_function'):
         logger.debug('Attempting to import post-processor function "%s"' %
                      output_specification.postprocessor_function)
         postprocessor_function = import_function_or_identity(
@@ -2,6 +2,7 @@
 
 import logging
 import os
+from timeit import default_timer
 from typing import Any, Dict
 
 from grpc import RpcError
@@ -11,14 +12,36 @@ from tensorflow_serving.apis.predict_pb2 import PredictRequest, PredictResponse
 from tf_serving_flask_app import settings
 from tf_serving_flask_app.base.exceptions import PredictionRpcError, PreprocessorError, PostprocessorError
 from tf_serving_flask_app.base.metaclasses import Singleton
-from tf_serving_flask_app.core.grpc_channel import ManagedChannel
-from tf_serving_flask_app.core import metrics
+from tf_serving_flask_app.core.cooperative_rpc import get_cooperative_rpc, map_in_threads
+from tf_serving_flask_app.core.grpc_channel import get_managed_channel
+from tf_serving_flask_app.core import memory_profiling, metrics
+from tf_serving_flask_app.core.scheduler import get_scheduler
 from tf_serving_flask_app.core.spec_borg import SpecBorg
 
 logger = logging.getLogger('core')
 
 PredictionInput = Dict[str, Any]
 
+# Serialized protocol buffer sizes before any gRPC compression, labeled with the
+# compression algorithm the request was sent with.
+_PAYLOAD_BYTES_BUCKETS = (1024, 16 * 1024, 64 * 1024, 256 * 1024, 1024 * 1024,
+                          4 * 1024 * 1024, 16 * 1024 * 1024, 64 * 1024 * 1024)
+prediction_rpc_request_bytes = metrics.create_histogram(
+    'prediction_rpc_request_bytes',
+    'Serialized size of prediction RPC requests in bytes',
+    labelnames=('compression',),
+    buckets=_PAYLOAD_BYTES_BUCKETS)
+prediction_rpc_response_bytes = metrics.create_histogram(
+    'prediction_rpc_response_bytes',
+    'Serialized size of prediction RPC responses in bytes',
+    labelnames=('compression',),
+    buckets=_PAYLOAD_BYTES_BUCKETS)
+
+input_preprocessor_duration_seconds = metrics.create_histogram(
+    'input_preprocessor_duration_seconds',
+    'Pre-processor duration of a single input in seconds',
+    labelnames=('input',))
+
 
 class PredictionFlow(metaclass=Singleton):
     """A prediction flow is a callable class composed of three instrumented stages:
@@ -28,9 +51,21 @@ class PredictionFlow(metaclass=Singleton):
     - Running the post-processor on output tensors and marshaling the output
       response.
     """
-    def __init__(self, prediction_rpc_timeout_secs):
+    def __init__(self, prediction_rpc_timeout_secs, signature_names=None, preprocessor_threads=1):
+        """
+        :param prediction_rpc_timeout_secs: The timeout of the prediction RPC.
+        :param signature_names: An optional list of signatures, e.g. the heads of
+        a multi-head model, that are all called with the same inputs in place of
+        the signature in the model spec. Their outputs are merged into a single
+        response.
+        :param preprocessor_threads: The size of the per process thread pool that
+        pre-processes the inputs of a multi-input prediction concurrently. A
+        single thread pre-processes inputs sequentially on the calling thread.
+        """
         self.spec_borg = None
         self.prediction_rpc_timeout_secs = prediction_rpc_timeout_secs
+        self.signature_names = signature_names or []
+        self.preprocessor_threads = preprocessor_threads
 
     def _initialize_spec(self):
         self.spec_borg = SpecBorg()
@@ -47,9 +82,10 @@ class PredictionFlow(metaclass=Singleton):
             request.model_spec.version.value = model_spec.version
         if model_spec.signature_name:
             request.model_spec.signature_name = model_spec.signature_name
-        logger.debug(
-            'Populated request with model attributes - name: `%s`, version: `%d`, signature_name: `%s`',
-            model_spec.name, model_spec.version, model_spec.signature_name)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                'Populated request with model attributes - name: `%s`, version: `%d`, signature_name: `%s`',
+                model_spec.name, model_spec.version, model_spec.signature_name)
 
     @metrics.histogram(
         'preprocessor_request_duration_seconds',
@@ -70,63 +106,139 @@ class PredictionFlow(metaclass=Singleton):
         """
         assert self.spec_borg
 
-        for (input_key, input_data) in prediction_input.items():
-            # The REST API request endpoint will die early with a bad request
-            # error if specified input keys in the spec are not present. We
-            # asssume this as a precondition.
-            assert input_key in self.spec_borg.input_preprocessors
-
-            preprocessor = self.spec_borg.input_preprocessors[input_key]
-            # Raises PreprocessorError for any failure.
-            ndarray = preprocessor.preprocess(input_data)
-            logger.debug('Pre-processed input into a numpy array of shape `%s`',
-                         ndarray.shape)
-
-            try:
-                features_tensor_proto = tf.contrib.util.make_tensor_proto(ndarray)
-            except (TypeError, ValueError) as e:
-                raise PreprocessorError(e)
-
-            prediction_rpc_request.inputs[input_key].CopyFrom(features_tensor_proto)
-            logger.debug(
-                'Populated the prediction RPC request input keyed by `%s` '
-                'with a feature tensor of shape `%s` and dtype `%s`',
-                input_key,
-                features_tensor_proto.tensor_shape,
-                features_tensor_proto.dtype)
+        # Independent inputs are pre-processed concurrently on OS threads since
+        # decoding, resizing and large array operations in PIL and NumPy
+        # release the GIL.
+        if len(prediction_input) > 1 and self.preprocessor_threads > 1:
+            jobs = list(prediction_input.items())
+            prepared = map_in_threads(memory_profiling.propagate(self._preprocess_one), jobs,
+                                      self.preprocessor_threads)
+            prepared_inputs = list(zip([input_key for (input_key, _) in jobs], prepared))
+        else:
+            prepared_inputs = [(input_key, self._preprocess_one(input_key, input_data))
+                               for (input_key, input_data) in prediction_input.items()]
+
+        for (input_key, prepared) in prepared_inputs:
+            features_tensor_proto = prediction_rpc_request.inputs[input_key]
+            self.spec_borg.input_conversion_plans[input_key].fill(features_tensor_proto, prepared)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    'Populated the prediction RPC request input keyed by `%s` '
+                    'with a feature tensor of shape `%s` and dtype `%s`',
+                    input_key,
+                    features_tensor_proto.tensor_shape,
+                    features_tensor_proto.dtype)
+
+    def _preprocess_one(self, input_key, input_data):
+        """Pre-processes a single input and prepares it for its conversion plan.
+
+        :return: the prepared input, filled into the request by the plan.
+        :raises PreprocessorError for any failure.
+        """
+        # The REST API request endpoint will die early with a bad request
+        # error if specified input keys in the spec are not present. We
+        # asssume this as a precondition.
+        assert input_key in self.spec_borg.input_preprocessors
+
+        start_time = default_timer()
+        preprocessor = self.spec_borg.input_preprocessors[input_key]
+        # Raises PreprocessorError for any failure.
+        ndarray = preprocessor.preprocess(input_data)
+        memory_profiling.record_array('preprocess', ndarray)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('Pre-processed input `%s` into a numpy array of shape `%s`',
+                         input_key, ndarray.shape)
+
+        # Raises PreprocessorError if the array does not fit the served signature.
+        prepared = self.spec_borg.input_conversion_plans[input_key].prepare(ndarray)
+
+        if metrics.recording():
+            input_preprocessor_duration_seconds.labels(input=input_key).observe(
+                max(default_timer() - start_time, 0))
+        return prepared
 
     @metrics.histogram(
         'model_prediction_duration_seconds',
         'Model prediction duration in seconds',
     )
-    def _make_prediction_rpc(self, request: PredictRequest):
+    def _make_prediction_rpc(self, request: PredictRequest, timeout_secs=None):
         """ Makes the actual gRPC for predictions.
 
         :param request: a populated prediction request protocol buffer
+        :param timeout_secs: the timeout of the RPC, `prediction_rpc_timeout_secs` if None
         :return: the gRPC response protocol buffer
         """
-        managed_channel = ManagedChannel()
-        logger.debug('Making a synchronous gRPC call for the prediction')
+        if timeout_secs is None:
+            timeout_secs = self.prediction_rpc_timeout_secs
+        managed_channel = get_managed_channel()
+        stub, compression = managed_channel.select_stub(request)
+        if metrics.recording():
+            prediction_rpc_request_bytes.labels(compression=compression).observe(request.ByteSize())
+        logger.debug('Making a gRPC call for the prediction')
+        cooperative_rpc = get_cooperative_rpc()
         try:
-            response = managed_channel.stub.Predict(
-                request,
-                timeout=self.prediction_rpc_timeout_secs)
+            if self.signature_names:
+                response = self._predict_signatures(stub, request, cooperative_rpc, timeout_secs)
+            else:
+                # Yields to other green threads of an eventlet worker while waiting.
+                response = cooperative_rpc.call(
+                    stub.Predict,
+                    request,
+                    timeout_secs)
         except RpcError as e:
             status_code = e.code()
             logger.error('Received a gRPC error with status code `%s`, status value `%s` and '
                          'details `%s`', status_code.name, status_code.value, e.details())
             raise PredictionRpcError(e)
+        if metrics.recording():
+            prediction_rpc_response_bytes.labels(compression=compression).observe(response.ByteSize())
         logger.debug('Successfully made the gRPC call')
         return response
 
+    def _predict_signatures(self, stub, request: PredictRequest, cooperative_rpc, timeout_secs):
+        """Makes one Predict call per configured signature in parallel with the
+        same inputs and merges the outputs into a single response.
+
+        The request is serialized when each call is issued, so we retarget the
+        signature of a single request instead of copying its input tensors.
+        Outputs of later signatures take precedence for output keys served by
+        several signatures. The calls share a single in flight RPC slot.
+        """
+        original_signature_name = request.model_spec.signature_name
+        futures = []
+        try:
+            with cooperative_rpc.slot(timeout_secs):
+                for signature_name in self.signature_names:
+                    request.model_spec.signature_name = signature_name
+                    futures.append(stub.Predict.future(
+                        request,
+                        timeout=timeout_secs))
+
+                signature_responses = [cooperative_rpc.wait(future) for future in futures]
+
+            response = PredictResponse()
+            for signature_response in signature_responses:
+                response.model_spec.CopyFrom(signature_response.model_spec)
+                for (output_key, output_tensor) in signature_response.outputs.items():
+                    response.outputs[output_key].CopyFrom(output_tensor)
+            return response
+        except RpcError:
+            for future in futures:
+                future.cancel()
+            raise
+        finally:
+            request.model_spec.signature_name = original_signature_name
+
     @metrics.histogram(
         'postprocessor_request_duration_seconds',
         'Post-processor request duration in seconds',
     )
-    def _postprocess_response(self, response: PredictResponse):
+    def _postprocess_response(self, response: PredictResponse, output_keys=None):
         """Post-processes the response into output meant to be serialized by REST.
 
         :param response: a prediction response protocol buffer
+        :param output_keys: an optional subset of the output keys in the spec
+        that are decoded and post-processed, all outputs otherwise.
         :return: a python dict from the output key specified in the spec
         to the post-processed result for that output key.
 
@@ -137,28 +249,36 @@ class PredictionFlow(metaclass=Singleton):
         """
         assert self.spec_borg
         final_response = {}
-        for (output_key, output_postprocessor) in self.spec_borg.output_postprocessors.items():
+        output_postprocessors = self.spec_borg.output_postprocessors
+        if output_keys:
+            output_postprocessors = dict((output_key, output_postprocessors[output_key])
+                                         for output_key in output_keys)
+        for (output_key, output_postprocessor) in output_postprocessors.items():
             try:
                 output_tensor = response.outputs[output_key]
             except KeyError as e:
                 raise PostprocessorError(e)
 
-            logger.debug('Received output tensor keyed by `%s`of shape `%s` and dtype `%s`',
-                         output_key,
-                         output_tensor.tensor_shape,
-                         output_tensor.dtype)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug('Received output tensor keyed by `%s`of shape `%s` and dtype `%s`',
+                             output_key,
+                             output_tensor.tensor_shape,
+                             output_tensor.dtype)
 
             try:
                 output_ndarray = tf.contrib.util.make_ndarray(output_tensor)
             except TypeError as e:
                 raise PostprocessorError(e)
 
-            logger.debug('Converted the output tensor into a numpy array of shape `%s`',
-                         output_ndarray.shape)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug('Converted the output tensor into a numpy array of shape `%s`',
+                             output_ndarray.shape)
+            memory_profiling.record_array('postprocess', output_ndarray)
 
             # Raises a PostprocessorError.
             final_response[output_key] = output_postprocessor.postprocess(output_ndarray)
-            logger.debug('Successfully ran the post-processor over the output numpy array for key `%s`', output_key)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug('Successfully ran the post-processor over the output numpy array for key `%s`', output_key)
 
         return final_response
 
@@ -175,11 +295,25 @@ class PredictionFlow(metaclass=Singleton):
         final_response = self.spec_borg.postprocessor.postprocess(output_dict)
         return final_response
 
-    def __call__(self, prediction_input: PredictionInput):
+    def __call__(self, prediction_input: PredictionInput, output_keys=None, raw_response=False,
+                 priority=None, timeout_secs=None):
         """Makes a prediction on extracted flask request input and
         returns an output dict to be serialized through REST.
 
+        :param prediction_input: Maps input keys to extracted flask request data.
+        :param output_keys: An optional validated subset of the output keys in
+        the spec. Only these outputs are computed by the model server, shipped
+        back and post-processed, and the model post-processor receives only them.
+        :param raw_response: Whether to return the PredictResponse protocol
+        buffer of the model server without post-processing it.
+        :param priority: The priority class the prediction is admitted in, the
+        default class if None.
+        :param timeout_secs: An optional timeout of the prediction RPC shorter
+        than `prediction_rpc_timeout_secs`, e.g. the time left to warm up.
+
         :raises:
+        - a BadInputError for an unknown priority class.
+        - an AdmissionTimeoutError if the prediction is not admitted in time.
         - a PreprocessorError for a failure converting `prediction_input` into
         tensors for transport.
         - a PredictionRpcError for a failure with the RPC.
@@ -187,12 +321,59 @@ class PredictionFlow(metaclass=Singleton):
         a dict that is then serialized.
         """
         self._initialize_spec()
+        with get_scheduler().admit(priority), memory_profiling.track_arrays():
+            prediction_rpc_request = PredictRequest()
+            self._populate_model_attributes(prediction_rpc_request)
+            # Signatures called in parallel may not serve every filtered output and
+            # the model server rejects filters naming outputs a signature lacks.
+            if output_keys and not self.signature_names:
+                prediction_rpc_request.output_filter.extend(output_keys)
+            with memory_profiling.stage('preprocess'):
+                self._preprocess_input(prediction_input, prediction_rpc_request)
+            response = self._make_prediction_rpc(prediction_rpc_request, timeout_secs)
+            if raw_response:
+                return response
+            with memory_profiling.stage('postprocess'):
+                response = self._postprocess_response(response, output_keys)
+                return self._model_postprocess(response)
+
+    def predict_ndarrays(self, input_ndarrays, output_keys=None):
+        """Makes a prediction on batches of pre-processed numpy arrays for
+        offline scoring.
+
+        :param input_ndarrays: Maps input keys to batches prepared by the
+        `prepare_batch` method of their conversion plans.
+        :param output_keys: An optional validated subset of the output keys in the spec.
+        :return: a dict from output key to the output numpy array.
+
+        :raises:
+        - a PreprocessorError for a failure converting the arrays into tensors.
+        - a PredictionRpcError for a failure with the RPC.
+        """
+        self._initialize_spec()
         prediction_rpc_request = PredictRequest()
         self._populate_model_attributes(prediction_rpc_request)
-        self._preprocess_input(prediction_input, prediction_rpc_request)
+        if output_keys and not self.signature_names:
+            prediction_rpc_request.output_filter.extend(output_keys)
+        for (input_key, batched) in input_ndarrays.items():
+            self.spec_borg.input_conversion_plans[input_key].fill_batch(
+                prediction_rpc_request.inputs[input_key], batched)
         response = self._make_prediction_rpc(prediction_rpc_request)
-        response = self._postprocess_response(response)
-        return self._model_postprocess(response)
+        output_keys = output_keys or self.spec_borg.output_postprocessors.keys()
+        return dict((output_key, tf.contrib.util.make_ndarray(response.outputs[output_key]))
+                    for output_key in output_keys if output_key in response.outputs)
+
+    def postprocess_ndarrays(self, output_ndarrays):
+        """Runs the output and model post-processors of the spec over the
+        output numpy arrays of a single prediction.
+
+        :raises PostprocessorError for a failure in any post-processor.
+        """
+        self._initialize_spec()
+        output_postprocessors = self.spec_borg.output_postprocessors
+        results = dict((output_key, output_postprocessors[output_key].postprocess(ndarray))
+                       for (output_key, ndarray) in output_ndarrays.items())
+        return self._model_postprocess(results)
 
 
 def create_prediction_flow():
@@ -200,4 +381,10 @@ def create_prediction_flow():
     prediction_rpc_timeout_secs = int(os.getenv(
         'PREDICTION_RPC_TIMEOUT_SECS',
         settings.DEFAULT_PREDICTION_RPC_TIMEOUT_SECS))
-    return PredictionFlow(prediction_rpc_timeout_secs)
+    signature_names = [name.strip() for name in os.getenv(
+        'PREDICTION_SIGNATURE_NAMES',
+        settings.DEFAULT_PREDICTION_SIGNATURE_NAMES).split(',') if name.strip()]
+    preprocessor_threads = int(os.getenv(
+        'PREPROCESSOR_THREADS',
+        settings.DEFAULT_PREPROCESSOR_THREADS))
+    return PredictionFlow(prediction_rpc_timeout_secs, signature_names, preprocessor_threads)
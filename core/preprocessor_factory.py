@@ -5,14 +5,18 @@ callable classes.
 
 import logging
 
+import numpy as np
+
 from spec.proto.input_pb2 import Input
-from tf_serving_flask_app.core import file_preprocessor, \
+from tf_serving_flask_app.core import builtin_preprocessors, \
+    dtypes, \
+    file_preprocessor, \
     image_preprocessor, \
     text_preprocessor
 from tf_serving_flask_app.base.dynamic_imports import identity, \
     import_function_or_identity, \
     import_callable_class_or_identity, \
-    name, safe_eval_lambda
+    is_builtin, name, parse_builtin, safe_eval_lambda
 
 logger = logging.getLogger('core')
 
@@ -23,8 +27,36 @@ valid_inputs = [
 ]
 valid_inputs = dict((i, 0) for i in valid_inputs)
 
+# Maps input types to the registry of built-in pre-processors available to them.
+builtin_registries = {
+    Input.TEXT: builtin_preprocessors.text_preprocessors,
+}
+
 
-def get_preprocessor(input_specification, data_format):
+def create_builtin_or_identity(input_specification):
+    """Instantiates a built-in pre-processor from a `builtin:` spec string,
+    degrading to the identity function on failure like dynamic imports do.
+
+    Built-ins receive the shape of the input and its dtype when integral.
+    """
+    full_name = input_specification.preprocessor_function
+    try:
+        builtin_name, params = parse_builtin(full_name)
+        spec_params = {'shape': tuple(input_specification.shape)}
+        numpy_dtype = dtypes.numpy_dtypes.get(input_specification.dtype)
+        if numpy_dtype is not None and np.issubdtype(numpy_dtype, np.integer):
+            spec_params['dtype'] = numpy_dtype
+        registry = builtin_registries.get(input_specification.type, {})
+        return builtin_preprocessors.create(builtin_name, params, registry, **spec_params)
+    except Exception as e:
+        logger.error(
+            'Failed instantiating built-in pre-processor %s with exception %s, '
+            'degrading to the identity function',
+            full_name, e)
+    return identity
+
+
+def get_preprocessor(input_specification, data_format, transport_dtype=None, image_budget=None):
     """Factory method that returns a pre-processor specific to the type
     mentioned in the input specification.
 
@@ -40,12 +72,22 @@ def get_preprocessor(input_specification, data_format):
     For 3D data, CHANNELS_LAST assumes (conv_dim1, conv_dim2, conv_dim3, channels)
     while CHANNELS_FIRST assumes (channels, conv_dim1, conv_dim2, conv_dim3).
 
+    :param transport_dtype: An optional compact dtype image inputs are shipped in.
+
+    :param image_budget: An optional image_preprocessor.ImageBudget enforced on
+    image inputs before decoding.
+
     https://github.com/faif/python-patterns/blob/master/creational/factory_method.py
     """
     if input_specification.type not in valid_inputs:
         raise NotImplementedError
 
-    if input_specification.HasField('preprocessor_function'):
+    if input_specification.HasField('preprocessor_function') \
+            and is_builtin(input_specification.preprocessor_function):
+        logger.debug('Attempting to instantiate built-in pre-processor "%s"' %
+                     input_specification.preprocessor_function)
+        preprocessor_function = create_builtin_or_identity(input_specification)
+    elif input_specification.HasField('preprocessor_function'):
         logger.debug('Attempting to import pre-processor function "%s"' %
                      input_specification.preprocessor_function)
         preprocessor_function = import_function_or_identity(
@@ -73,7 +115,13 @@ def get_preprocessor(input_specification, data_format):
             input_specification.shape,
             input_specification.image,
             preprocessor_function,
-            data_format)
+            data_format,
+            transport_dtype,
+            image_budget)
+
+    if transport_dtype:
+        logger.warning('Transport dtypes are only supported for image inputs, ignoring `%s` for `%s`',
+                       transport_dtype.__name__, input_specification.signature_def_key)
 
     if input_specification.type == Input.FILE:
         logger.debug('Instantiating a file pre-processor wrapping "%s"' %
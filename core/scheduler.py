@@ -0,0 +1,225 @@
+"""
+Defines a per-worker admission scheduler that separates interactive and bulk
+traffic into priority classes.
+
+Every prediction is admitted through the scheduler of its process before it
+pre-processes inputs or calls the model server. A prediction runs right away
+when the worker and its class are below their concurrency limits and no
+earlier prediction of its class is waiting. Otherwise it queues with its
+class, and freed slots go to the waiting class whose next prediction has the
+lowest virtual finishing time. Each admission advances the virtual time of a
+class by `1 / weight`, so under contention classes share slots in proportion
+to their weights.
+"""
+
+import logging
+import os
+import threading
+from collections import deque
+from contextlib import contextmanager
+from timeit import default_timer
+
+from tf_serving_flask_app import settings
+from tf_serving_flask_app.base.exceptions import AdmissionTimeoutError, BadInputError
+from tf_serving_flask_app.core import metrics
+
+logger = logging.getLogger('core')
+
+scheduler_queue_wait_seconds = metrics.create_histogram(
+    'scheduler_queue_wait_seconds',
+    'Time predictions waited for admission in seconds',
+    labelnames=('priority',),
+    buckets=(.001, .005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5., 10., 30.))
+scheduler_inflight = metrics.create_gauge(
+    'scheduler_inflight',
+    'Number of admitted predictions in flight',
+    labelnames=('priority',),
+    multiprocess_mode='livesum')
+scheduler_queued = metrics.create_gauge(
+    'scheduler_queued',
+    'Number of predictions waiting for admission',
+    labelnames=('priority',),
+    multiprocess_mode='livesum')
+scheduler_timeouts_total = metrics.create_counter(
+    'scheduler_timeouts_total',
+    'Number of predictions that timed out waiting for admission',
+    labelnames=('priority',))
+prediction_class_duration_seconds = metrics.create_histogram(
+    'prediction_class_duration_seconds',
+    'Duration of admitted predictions in seconds excluding the queue wait',
+    labelnames=('priority',))
+
+
+class PriorityClass(object):
+    """A class of traffic with a scheduling weight and a concurrency limit.
+
+    :param name: The name requests select the class by.
+    :param weight: The relative share of contended slots.
+    :param limit: The maximum predictions of the class in flight, 0 for no limit.
+    """
+
+    def __init__(self, name, weight=1., limit=0):
+        if weight <= 0:
+            raise ValueError('Priority class `%s` needs a positive weight' % name)
+        self.name = name
+        self.weight = float(weight)
+        self.limit = int(limit)
+        self.inflight = 0
+        self.waiters = deque()
+        self.virtual_finish = 0.
+
+    def has_capacity(self):
+        return not self.limit or self.inflight < self.limit
+
+
+def parse_priority_classes(value):
+    """Parses comma separated `<name>:<weight>[:<limit>]` triples, e.g.
+    `interactive:8,bulk:1:4`, into a list of priority classes."""
+    priority_classes = []
+    for triple in filter(None, (t.strip() for t in value.split(','))):
+        fields = [field.strip() for field in triple.split(':')]
+        name = fields[0]
+        weight = float(fields[1]) if len(fields) > 1 and fields[1] else 1.
+        limit = int(fields[2]) if len(fields) > 2 and fields[2] else 0
+        priority_classes.append(PriorityClass(name, weight, limit))
+    return priority_classes
+
+
+class Scheduler(object):
+    """Admits predictions of a worker by priority class with weighted fair
+    queuing and per class concurrency limits.
+
+    :param priority_classes: The list of priority classes.
+    :param default_class: The name of the class of predictions that select none.
+    :param max_concurrency: The maximum predictions in flight across all
+    classes, 0 for no limit.
+    :param queue_timeout_secs: The longest a prediction waits for admission.
+    """
+
+    def __init__(self, priority_classes, default_class, max_concurrency=0, queue_timeout_secs=30.):
+        self.classes = dict((priority_class.name, priority_class) for priority_class in priority_classes)
+        if default_class not in self.classes:
+            raise ValueError('Default priority class `%s` is not one of %s' %
+                             (default_class, sorted(self.classes)))
+        self.default_class = default_class
+        self.max_concurrency = max_concurrency
+        self.queue_timeout_secs = queue_timeout_secs
+        self.inflight = 0
+        self.virtual_time = 0.
+        self._lock = threading.Lock()
+
+    def resolve(self, name=None):
+        """Returns the priority class named `name` or the default class.
+
+        :raises BadInputError for an unknown priority class.
+        """
+        if not name:
+            return self.classes[self.default_class]
+        try:
+            return self.classes[name]
+        except KeyError:
+            raise BadInputError('Unknown priority class `%s`, expected one of %s' %
+                                (name, sorted(self.classes)))
+
+    def _has_capacity(self):
+        return not self.max_concurrency or self.inflight < self.max_concurrency
+
+    def _activate(self, priority_class):
+        """Catches up the virtual time of a class that becomes backlogged, so a
+        class does not bank credit for the time it was idle."""
+        if not priority_class.waiters:
+            priority_class.virtual_finish = max(priority_class.virtual_finish, self.virtual_time)
+
+    def _start(self, priority_class):
+        start = priority_class.virtual_finish
+        priority_class.virtual_finish = start + 1. / priority_class.weight
+        self.virtual_time = max(self.virtual_time, start)
+        priority_class.inflight += 1
+        self.inflight += 1
+
+    def _dispatch(self):
+        """Admits waiters while there is capacity, picking the eligible class
+        with the lowest virtual finishing time. Called with the lock held."""
+        while self._has_capacity():
+            eligible = [priority_class for priority_class in self.classes.values()
+                        if priority_class.waiters and priority_class.has_capacity()]
+            if not eligible:
+                return
+            # Ties go to the heavier class.
+            priority_class = min(eligible, key=lambda c: (c.virtual_finish + 1. / c.weight, -c.weight))
+            waiter = priority_class.waiters.popleft()
+            self._start(priority_class)
+            waiter.set()
+
+    def _release(self, priority_class):
+        with self._lock:
+            priority_class.inflight -= 1
+            self.inflight -= 1
+            self._dispatch()
+
+    @contextmanager
+    def admit(self, name=None):
+        """Blocks until a prediction of the priority class `name` is admitted
+        and releases its slot on exit.
+
+        :return: the admitted priority class.
+        :raises BadInputError for an unknown priority class and
+        AdmissionTimeoutError if it is not admitted within the queue timeout.
+        """
+        priority_class = self.resolve(name)
+        start_time = default_timer()
+        waiter = None
+        with self._lock:
+            self._activate(priority_class)
+            if self._has_capacity() and priority_class.has_capacity() and not priority_class.waiters:
+                self._start(priority_class)
+            else:
+                waiter = threading.Event()
+                priority_class.waiters.append(waiter)
+
+        if waiter is not None:
+            scheduler_queued.labels(priority=priority_class.name).inc()
+            try:
+                admitted = waiter.wait(self.queue_timeout_secs)
+                if not admitted:
+                    with self._lock:
+                        # Admitted between timing out and taking the lock.
+                        admitted = waiter.is_set()
+                        if not admitted:
+                            priority_class.waiters.remove(waiter)
+            finally:
+                scheduler_queued.labels(priority=priority_class.name).dec()
+            if not admitted:
+                scheduler_timeouts_total.labels(priority=priority_class.name).inc()
+                raise AdmissionTimeoutError('Timed out after %.1fs waiting for admission in priority '
+                                            'class `%s`' % (self.queue_timeout_secs, priority_class.name))
+
+        admitted_time = default_timer()
+        scheduler_queue_wait_seconds.labels(priority=priority_class.name).observe(
+            max(admitted_time - start_time, 0))
+        scheduler_inflight.labels(priority=priority_class.name).inc()
+        try:
+            yield priority_class
+        finally:
+            scheduler_inflight.labels(priority=priority_class.name).dec()
+            prediction_class_duration_seconds.labels(priority=priority_class.name).observe(
+                max(default_timer() - admitted_time, 0))
+            self._release(priority_class)
+
+
+# Schedulers keyed by the pid of the process that created them, since the
+# state of a preloaded master must not leak into forked workers.
+_process_schedulers = {}
+
+
+def get_scheduler():
+    """Returns the scheduler of the current process configured from the environment."""
+    pid = os.getpid()
+    scheduler = _process_schedulers.get(pid)
+    if scheduler is None:
+        scheduler = _process_schedulers.setdefault(pid, Scheduler(
+            parse_priority_classes(os.getenv('PRIORITY_CLASSES', settings.DEFAULT_PRIORITY_CLASSES)),
+            os.getenv('PRIORITY_CLASS', settings.DEFAULT_PRIORITY_CLASS),
+            int(os.getenv('SCHEDULER_MAX_CONCURRENCY', settings.DEFAULT_SCHEDULER_MAX_CONCURRENCY)),
+            float(os.getenv('SCHEDULER_QUEUE_TIMEOUT_SECS', settings.DEFAULT_SCHEDULER_QUEUE_TIMEOUT_SECS))))
+    return scheduler
@@ -0,0 +1,62 @@
+import threading
+import time
+import unittest
+
+from tf_serving_flask_app.base.exceptions import AdmissionTimeoutError, BadInputError
+from tf_serving_flask_app.core import scheduler
+
+
+class TestScheduler(unittest.TestCase):
+    def test_parse_priority_classes(self):
+        interactive, bulk = scheduler.parse_priority_classes('interactive:8, bulk:1:4')
+        self.assertEqual((interactive.name, interactive.weight, interactive.limit), ('interactive', 8., 0))
+        self.assertEqual((bulk.name, bulk.weight, bulk.limit), ('bulk', 1., 4))
+
+    def test_unknown_priority_class(self):
+        s = scheduler.Scheduler(scheduler.parse_priority_classes('interactive:1'), 'interactive')
+        with s.admit() as priority_class:
+            self.assertEqual(priority_class.name, 'interactive')
+        with self.assertRaises(BadInputError):
+            with s.admit('batch'):
+                pass
+
+    def test_class_limit(self):
+        s = scheduler.Scheduler(scheduler.parse_priority_classes('interactive:8,bulk:1:1'), 'interactive',
+                                queue_timeout_secs=.05)
+        with s.admit('bulk'):
+            with self.assertRaises(AdmissionTimeoutError):
+                with s.admit('bulk'):
+                    pass
+            with s.admit('interactive'):
+                self.assertEqual(s.inflight, 2)
+        self.assertEqual(s.inflight, 0)
+        self.assertFalse(s.classes['bulk'].waiters)
+
+    def test_weighted_fair_admission(self):
+        s = scheduler.Scheduler(scheduler.parse_priority_classes('interactive:3,bulk:1'), 'interactive',
+                                max_concurrency=1)
+        order = []
+
+        def predict(name):
+            with s.admit(name):
+                order.append(name)
+
+        admission = s.admit('interactive')
+        admission.__enter__()
+        threads = [threading.Thread(target=predict, args=(name,))
+                   for name in ['bulk'] * 4 + ['interactive'] * 4]
+        for thread in threads:
+            thread.start()
+        while sum(len(c.waiters) for c in s.classes.values()) < len(threads):
+            time.sleep(.001)
+        admission.__exit__(None, None, None)
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(order, ['interactive', 'interactive', 'bulk', 'interactive',
+                                 'interactive', 'bulk', 'bulk', 'bulk'])
+        self.assertEqual(s.inflight, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,12 @@
 import logging
+import os
 
 from spec.reader import load_pipeline_spec_from_json
+from tf_serving_flask_app import settings
+from tf_serving_flask_app.core import builtin_postprocessors
+from tf_serving_flask_app.core import conversion_plans
+from tf_serving_flask_app.core import dtypes
+from tf_serving_flask_app.core import image_preprocessor
 from tf_serving_flask_app.core import preprocessor_factory
 from tf_serving_flask_app.core import postprocessor_factory
 
@@ -32,9 +38,21 @@ class SpecBorg(object):
         # outputs.
         self.model_spec = pipeline_spec.model[0]
 
+        # The SignatureDef of the served model once fetched on startup.
+        self.signature_def = None
+
         # assuming there will be at max one post processor at model level
         self.postprocessor = postprocessor_factory.get_postprocessor(
-                self.model_spec)
+                self.model_spec, builtins=builtin_postprocessors.model_postprocessors)
+
+        # A dict from input signature to the compact numpy dtype the input
+        # is shipped in when it differs from the spec dtype.
+        self.input_transport_dtypes = dtypes.parse_transport_dtypes(os.getenv(
+            'INPUT_TRANSPORT_DTYPES',
+            settings.DEFAULT_INPUT_TRANSPORT_DTYPES))
+
+        # Budgets enforced on image inputs from their headers before decoding.
+        self.image_budget = image_preprocessor.ImageBudget.from_env()
 
         # A dict from input signature to associated specification.
         self.input_specs = {}
@@ -46,7 +64,9 @@ class SpecBorg(object):
             assert input_key
             self.input_specs[input_key] = input_spec
             self.input_preprocessors[input_key] = preprocessor_factory.get_preprocessor(
-                input_spec, self.model_spec.data_format)
+                input_spec, self.model_spec.data_format,
+                self.input_transport_dtypes.get(input_key),
+                self.image_budget)
 
         # A dict from output signature to associated specification.
         self.output_specs = {}
@@ -60,3 +80,17 @@ class SpecBorg(object):
             self.output_postprocessors[output_key] = postprocessor_factory.get_postprocessor(
                 output_spec)
 
+        # A dict from input signature to the plan converting its pre-processed
+        # arrays into tensors, recompiled once the served signature is fetched.
+        self.input_conversion_plans = conversion_plans.compile_plans(self)
+
+    def drop_transport_dtypes(self):
+        """Ships every input in its spec dtype again, rebuilding the affected
+        pre-processors and conversion plans. Used when the served signature
+        could not confirm that it accepts the transport dtypes."""
+        input_keys = [input_key for input_key in self.input_transport_dtypes if input_key in self.input_specs]
+        self.input_transport_dtypes = {}
+        for input_key in input_keys:
+            self.input_preprocessors[input_key] = preprocessor_factory.get_preprocessor(
+                self.input_specs[input_key], self.model_spec.data_format, None, self.image_budget)
+        self.input_conversion_plans = conversion_plans.compile_plans(self)
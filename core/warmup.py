@@ -0,0 +1,139 @@
+"""
+Warms up a freshly started worker by pushing synthetic inputs through the
+full prediction flow before the worker accepts traffic.
+
+The first predictions of a worker are slow since PIL plugins load lazily, the
+gRPC channel connects, NumPy and TensorFlow code paths are paged in and the
+model server may not have warmed up the model itself.
+"""
+
+import io
+import logging
+import os
+from timeit import default_timer
+
+from PIL import Image
+
+from spec.proto.input_pb2 import Input
+from spec.proto.model_pb2 import Model
+from tf_serving_flask_app.core import metrics
+from tf_serving_flask_app.core.prediction_flow import create_prediction_flow
+from tf_serving_flask_app.core.spec_borg import SpecBorg
+
+logger = logging.getLogger('core')
+
+warmup_duration_seconds = metrics.create_histogram(
+    'warmup_duration_seconds',
+    'Duration of warming up a worker in seconds',
+    labelnames=('status',),
+    buckets=(.1, .25, .5, 1., 2.5, 5., 10., 30., 60., 120.))
+
+# Fallback dimensions for image inputs whose spec has neither a target size
+# nor a fully defined shape.
+DEFAULT_WARMUP_IMAGE_SIZE = 224
+
+
+def _image_size(input_spec, data_format):
+    """Returns the (width, height) of a synthetic image conforming to the spec."""
+    if input_spec.image.target_width > 0 and input_spec.image.target_height > 0:
+        return input_spec.image.target_width, input_spec.image.target_height
+
+    shape = list(input_spec.shape)
+    if len(shape) >= 3:
+        height, width = shape[-2:] if data_format == Model.CHANNELS_FIRST else shape[-3:-1]
+        if height > 0 and width > 0:
+            return width, height
+    return DEFAULT_WARMUP_IMAGE_SIZE, DEFAULT_WARMUP_IMAGE_SIZE
+
+
+def synthesize_input(input_key, input_spec, data_format, samples_dir=None):
+    """Returns synthetic input data for an input spec in the form the REST
+    API extracts it from a request.
+
+    A file named after the input key in `samples_dir` takes precedence over
+    synthesized data and is required for FILE inputs, whose content only the
+    spec's pre-processor function knows.
+
+    :return: a binary file object for IMAGE and FILE inputs, a str for TEXT
+    inputs or None if the input cannot be synthesized.
+    """
+    sample_path = os.path.join(samples_dir, input_key) if samples_dir else None
+    if sample_path and os.path.isfile(sample_path):
+        with open(sample_path, 'rb') as f:
+            content = f.read()
+        return content.decode('utf-8') if input_spec.type == Input.TEXT else io.BytesIO(content)
+
+    if input_spec.type == Input.IMAGE:
+        # A JPEG exercises the decoder plugin most requests go through.
+        imagefp = io.BytesIO()
+        Image.new('RGB', _image_size(input_spec, data_format), color=(128, 128, 128)).save(
+            imagefp, format='JPEG')
+        imagefp.seek(0)
+        return imagefp
+
+    if input_spec.type == Input.TEXT:
+        return 'warm up'
+
+    return None
+
+
+def synthesize_inputs(samples_dir=None):
+    """Returns synthetic prediction flow inputs for every input in the spec
+    or None if any of them cannot be synthesized."""
+    spec_borg = SpecBorg()
+    prediction_input = {}
+    for (input_key, input_spec) in spec_borg.input_specs.items():
+        input_data = synthesize_input(input_key, input_spec, spec_borg.model_spec.data_format, samples_dir)
+        if input_data is None:
+            logger.warning('Cannot synthesize warm-up data for input `%s`, provide a sample '
+                           'named after the input key in WARMUP_SAMPLES_DIR', input_key)
+            return None
+        prediction_input[input_key] = input_data
+    return prediction_input
+
+
+def warm_up(iterations, samples_dir=None, timeout_secs=0):
+    """Runs synthetic predictions through the full prediction flow.
+
+    Failures are logged rather than raised since the model server may come
+    up after the worker, and the first failure ends the warm-up early.
+    The metrics of the prediction flow are suppressed for warm-up predictions
+    so that they do not skew latencies and the autoscaler.
+
+    :param timeout_secs: the time the whole warm-up may take, 0 for no limit.
+    Warm-up runs before the worker's first heartbeat, so this must stay below
+    the gunicorn worker timeout. The prediction RPCs are bounded by the time
+    left and no iteration starts once it ran out.
+    :return: True if all warm-up predictions succeeded.
+    """
+    start_time = default_timer()
+    deadline = start_time + timeout_secs if timeout_secs > 0 else None
+    prediction_flow = create_prediction_flow()
+    succeeded = False
+    for iteration in range(iterations):
+        rpc_timeout_secs = None
+        if deadline is not None:
+            remaining_secs = deadline - default_timer()
+            if remaining_secs <= 0:
+                logger.warning('Warm-up ran out of its %.1fs after %d of %d predictions',
+                               timeout_secs, iteration, iterations)
+                break
+            rpc_timeout_secs = min(remaining_secs, prediction_flow.prediction_rpc_timeout_secs)
+        prediction_input = synthesize_inputs(samples_dir)
+        if prediction_input is None:
+            break
+        try:
+            with metrics.suppressed():
+                prediction_flow(prediction_input, timeout_secs=rpc_timeout_secs)
+        except Exception as e:
+            logger.warning('Warm-up prediction %d of %d failed with `%s: %s`',
+                           iteration + 1, iterations, type(e).__name__, e)
+            break
+    else:
+        succeeded = iterations > 0
+
+    duration = max(default_timer() - start_time, 0)
+    warmup_duration_seconds.labels(status='success' if succeeded else 'failure').observe(duration)
+    logger.info('Warmed up process %d with %d iterations in %.3fs, success: %s',
+                os.getpid(), iterations, duration, succeeded)
+    return succeeded
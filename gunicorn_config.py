@@ -1,7 +1,17 @@
+import gc
 import multiprocessing
+import os
 
-from prometheus_client import multiprocess
-from tf_serving_flask_app.app import register_metrics
+from tf_serving_flask_app import settings
+from tf_serving_flask_app.core import cpu_layout
+
+# Limits the native thread pools before the application first imports NumPy,
+# since the libraries size them when they are loaded.
+cpu_layout.limit_native_threads(cpu_layout.native_threads_from_env())
+
+from tf_serving_flask_app.app import register_metrics  # noqa: E402
+from tf_serving_flask_app.base.utils import as_boolean  # noqa: E402
+from tf_serving_flask_app.core import memory_profiling, metrics  # noqa: E402
 
 # Registers multiprocess metrics.
 register_metrics()
@@ -25,9 +35,34 @@ worker_connections = 1000
 
 loglevel = 'info'
 
+# Workers silent for longer are killed and restarted. Signature validation
+# and warm-up run before a worker's first heartbeat, so
+# MODEL_METADATA_TIMEOUT_SECS plus WARMUP_TIMEOUT_SECS must stay below it.
+# http://docs.gunicorn.org/en/stable/settings.html#timeout
+timeout = 30
+
+# Loads the spec, imports and pre-processors once in the master so that
+# workers share them copy-on-write. Workers create their gRPC channels,
+# validate the served signature and warm up in `post_worker_init`.
+# http://docs.gunicorn.org/en/stable/settings.html#preload-app
+preload_app = as_boolean(os.getenv('GUNICORN_PRELOAD_APP', settings.DEFAULT_GUNICORN_PRELOAD_APP))
+
+
+# Pins workers to CPUs or NUMA nodes with `WORKER_CPU_AFFINITY`.
+layout = cpu_layout.CpuLayout.from_env()
+
+
+def on_starting(server):
+    if layout.enabled:
+        server.log.info("Pinning workers to CPU slots %s", layout.describe())
+
 
 def pre_fork(server, worker):
-    pass
+    cpu_layout.assign_slot(layout, server, worker)
+
+
+def post_fork(server, worker):
+    cpu_layout.pin_worker(layout, worker, cpu_layout.native_threads_from_env())
 
 
 def pre_exec(server):
@@ -35,8 +70,29 @@ def pre_exec(server):
 
 
 def when_ready(server):
+    # Moves every object of the preloaded application into a permanent
+    # generation that the garbage collector never touches, so collections
+    # in workers do not write to and un-share the pages holding them.
+    if preload_app and hasattr(gc, 'freeze'):
+        gc.freeze()
+        server.log.info("Froze %d objects of the preloaded application", gc.get_freeze_count())
     server.log.info("Server is ready. Spawning workers")
 
+    # Imported in the master only, since workers never scale themselves.
+    from tf_serving_flask_app.core import autoscaler
+    autoscaler.start_autoscaler(server, workers)
+
+
+def post_worker_init(worker):
+    # Imported in the worker so that its metrics are created after forking.
+    from tf_serving_flask_app.core import hub_monitor
+    if worker_class == 'eventlet':
+        hub_monitor.start_hub_monitor()
+
+    if preload_app:
+        from tf_serving_flask_app.app import initialize_worker
+        initialize_worker()
+
 
 def worker_abort(worker):
     worker.log.info("worker received SIGABRT signal")
@@ -44,4 +100,5 @@ def worker_abort(worker):
 
 # See https://github.com/prometheus/client_python#multiprocess-mode-gunicorn
 def child_exit(server, worker):
-    multiprocess.mark_process_dead(worker.pid)
+    metrics.mark_process_dead(worker.pid)
+    memory_profiling.stop_profiling(worker.pid)
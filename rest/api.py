@@ -2,21 +2,34 @@
 Dynamically assembles a Flask-RestPlus API from the pipeline specification.
 """
 
-import json
 import logging
+import time
+from timeit import default_timer
 
 from flask import request, Response
 from flask_restplus import Api, Resource
 from werkzeug.datastructures import FileStorage
 
 from spec.proto.input_pb2 import Input
-from tf_serving_flask_app.base.encoders import NumpyEncoder
+from tf_serving_flask_app.base.exceptions import AdmissionTimeoutError, BadInputError, NotAcceptableError
 from tf_serving_flask_app.core import metrics
 from tf_serving_flask_app.core.prediction_flow import create_prediction_flow
 from tf_serving_flask_app.core.spec_borg import SpecBorg
+from tf_serving_flask_app.rest import response_formats
+from tf_serving_flask_app.rest.traffic_capture import get_traffic_capture
 
 logger = logging.getLogger('rest')
 
+# Shared by the flask-restplus resource and the WSGI fast path.
+prediction_request_total = metrics.create_counter(
+    'prediction_request_total',
+    'Total number of prediction requests',
+    labelnames=('method', 'status'))
+prediction_request_duration_seconds = metrics.create_histogram(
+    'prediction_request_duration_seconds',
+    'Prediction request duration in seconds',
+    labelnames=('method', 'status', 'path'))
+
 
 def create_prediction_api_from_spec(route='/predict'):
     """Dynamically generates a Flask-RestPlus resource from the given specification.
@@ -46,35 +59,33 @@ def create_prediction_api_from_spec(route='/predict'):
                                         location='form',
                                         type=str,
                                         required=True)
+    request_parser.add_argument('outputs',
+                                location='args',
+                                type=str,
+                                required=False,
+                                help='Comma separated subset of the outputs %s to compute and return' %
+                                     ', '.join(sorted(spec_borg.output_specs)))
+
+    # The priority class is selected by the X-Priority header or the route.
+    priority_route = route + '/<string:priority>'
 
-    @api.route(route)
+    @api.route(route, priority_route)
     class Prediction(Resource):
-        @api.doc(description='Make a prediction with the model %s' % model_name,
+        @api.doc(description='Make a prediction with the model %s. The results are returned '
+                             'in the format negotiated through the Accept header among %s.' %
+                             (model_name, ', '.join(response_formats.supported_mimetypes)),
                  responses={
                      200: 'Success',
                      400: 'Bad request',
-                     500: 'Internal server error'
+                     406: 'Results not representable in the accepted format',
+                     500: 'Internal server error',
+                     503: 'Timed out waiting for admission in the priority class'
                  })
         @api.expect(request_parser)
-        @metrics.counter(
-            'prediction_request_total',
-            'Total number of prediction requests',
-            labels={
-                'method': lambda: request.method,
-                'status': lambda r: r.status_code,
-            },
-        )
-        @metrics.histogram(
-            'prediction_request_duration_seconds',
-            'Prediction request duration in seconds',
-            labels={
-                'method': lambda: request.method,
-                'status': lambda r: r.status_code,
-                'path': lambda: request.path
-            },
-        )
-        def post(self):
+        def post(self, priority=None):
+            start_time = default_timer()
             try:
+                output_keys = parse_output_filter(request.args.get('outputs'), spec_borg)
                 prediction_flow_input = {}
                 for (input_key, input_spec) in spec_borg.input_specs.items():
                     if input_spec.type == Input.IMAGE or input_spec.type == Input.FILE:
@@ -82,21 +93,119 @@ def create_prediction_api_from_spec(route='/predict'):
 
                     if input_spec.type == Input.TEXT:
                         prediction_flow_input[input_key] = request.form[input_key]
-            except KeyError as e:
-                logger.exception(e)
-                errmsg = 'Inputs not conformant with signature and type specified in the spec: %s' % e
-                return Response(errmsg, status=400)
-
-            try:
-                prediction_flow = create_prediction_flow()
-                results = prediction_flow(prediction_flow_input)
-                results_json = json.dumps(results, cls=NumpyEncoder)
-                return Response(results_json, status=200, mimetype='application/json')
-            except Exception as e:
-                logger.exception(e)
-                errmsg = 'Failed to make a prediction with `%s`: %s' % (type(e).__name__, e)
-                return Response(errmsg, status=500)
+            except (KeyError, BadInputError) as e:
+                response = bad_inputs_response(e)
+            else:
+                response = make_prediction_response(prediction_flow_input, output_keys,
+                                                    request.headers.get('Accept'),
+                                                    request.headers.get('Accept-Encoding'),
+                                                    priority or request.headers.get('X-Priority'))
+            # Labeled by route template since the priority in the path is client supplied.
+            observe_prediction_request(request.method, priority_route if priority else route,
+                                       response.status_code, start_time)
+            return response
 
     return api
 
 
+def observe_prediction_request(method, path, status, start_time):
+    """Records the count and duration of a prediction request."""
+    prediction_request_total.labels(method=method, status=status).inc()
+    prediction_request_duration_seconds.labels(method=method, status=status, path=path).observe(
+        max(default_timer() - start_time, 0))
+
+
+def parse_output_filter(outputs, spec_borg):
+    """Parses the comma separated outputs a caller selected, adding the
+    outputs the model post-processor reads.
+
+    :return: a list of distinct output keys or None if the caller did not
+    select outputs.
+    :raises BadInputError for an output that is not in the spec.
+    """
+    if not outputs:
+        return None
+    output_keys = []
+    for output_key in outputs.split(','):
+        output_key = output_key.strip()
+        if output_key and output_key not in output_keys:
+            output_keys.append(output_key)
+    unknown_output_keys = [output_key for output_key in output_keys
+                           if output_key not in spec_borg.output_specs]
+    if unknown_output_keys:
+        raise BadInputError('Unknown outputs %s, expected a subset of %s' %
+                            (unknown_output_keys, sorted(spec_borg.output_specs)))
+    if not output_keys:
+        return None
+    output_keys.extend(output_key for output_key in spec_borg.postprocessor.required_outputs
+                       if output_key in spec_borg.output_specs and output_key not in output_keys)
+    return output_keys
+
+
+def bad_inputs_response(e):
+    logger.exception(e)
+    errmsg = 'Inputs not conformant with signature and type specified in the spec: %s' % e
+    return Response(errmsg, status=400)
+
+
+def make_prediction_response(prediction_flow_input, output_keys=None, accept=None, accept_encoding=None,
+                             priority=None):
+    """Runs the prediction flow on extracted request inputs and serializes
+    the results into a response.
+
+    :param prediction_flow_input: Maps input keys to extracted request data.
+    :param output_keys: An optional validated subset of outputs to return.
+    :param accept: The Accept header of the request selecting the response format.
+    :param accept_encoding: The Accept-Encoding header of the request.
+    :param priority: The priority class selected by the request, if any.
+    :return: a response with the serialized results or the error.
+    """
+    traffic_capture = get_traffic_capture()
+    captured_inputs = None
+    if traffic_capture:
+        # Capturing is best effort, a failure reading the inputs must not fail the request.
+        try:
+            captured_inputs = traffic_capture.sample(prediction_flow_input)
+        except Exception as e:
+            logger.exception(e)
+    if captured_inputs is None:
+        return _make_prediction_response(prediction_flow_input, output_keys, accept, accept_encoding, priority)
+
+    arrival_time = time.time()
+    start_time = default_timer()
+    response = _make_prediction_response(prediction_flow_input, output_keys, accept, accept_encoding, priority)
+    try:
+        traffic_capture.write(captured_inputs, arrival_time, default_timer() - start_time,
+                              response.status_code, output_keys, accept, priority)
+    except Exception as e:
+        logger.exception(e)
+    return response
+
+
+def _make_prediction_response(prediction_flow_input, output_keys, accept, accept_encoding, priority):
+    mimetype = response_formats.negotiate(accept)
+    try:
+        prediction_flow = create_prediction_flow()
+        results = prediction_flow(prediction_flow_input, output_keys,
+                                  raw_response=mimetype == response_formats.PROTOBUF,
+                                  priority=priority)
+        body, content_encoding = response_formats.compress(
+            response_formats.serialize(results, mimetype), accept_encoding)
+    except BadInputError as e:
+        return bad_inputs_response(e)
+    except NotAcceptableError as e:
+        logger.warning(e)
+        return Response(str(e), status=406)
+    except AdmissionTimeoutError as e:
+        logger.warning(e)
+        return Response(str(e), status=503)
+    except Exception as e:
+        logger.exception(e)
+        errmsg = 'Failed to make a prediction with `%s`: %s' % (type(e).__name__, e)
+        return Response(errmsg, status=500)
+
+    response = Response(body, status=200, mimetype=mimetype)
+    response.vary.update(('Accept', 'Accept-Encoding'))
+    if content_encoding:
+        response.content_encoding = content_encoding
+    return response
@@ -0,0 +1,94 @@
+"""
+Defines a lean WSGI fast path for the prediction route.
+
+The spec is compiled once into an input extractor and prediction requests are
+served straight from the WSGI environment, bypassing Flask routing,
+flask-restplus resource dispatch and request parsing. All other routes,
+including the Swagger documentation, are served by the Flask application.
+"""
+
+import logging
+from timeit import default_timer
+from urllib.parse import parse_qs
+
+from werkzeug.formparser import parse_form_data
+
+from spec.proto.input_pb2 import Input
+from tf_serving_flask_app.base.exceptions import BadInputError
+from tf_serving_flask_app.core.spec_borg import SpecBorg
+from tf_serving_flask_app.rest.api import bad_inputs_response, make_prediction_response, \
+    observe_prediction_request, parse_output_filter
+
+logger = logging.getLogger('rest')
+
+
+def compile_input_extractor(spec_borg):
+    """Compiles the input specs into a function extracting prediction flow
+    input from parsed form data without branching on input types per request.
+
+    :return: a function of `(form, files)` returning a dict from input key to
+    request data and raising a KeyError for a missing input.
+    """
+    file_keys = tuple(input_key for (input_key, input_spec) in spec_borg.input_specs.items()
+                      if input_spec.type == Input.IMAGE or input_spec.type == Input.FILE)
+    form_keys = tuple(input_key for (input_key, input_spec) in spec_borg.input_specs.items()
+                      if input_spec.type == Input.TEXT)
+
+    def extract(form, files):
+        prediction_flow_input = {}
+        for input_key in file_keys:
+            prediction_flow_input[input_key] = files[input_key]
+        for input_key in form_keys:
+            prediction_flow_input[input_key] = form[input_key]
+        return prediction_flow_input
+
+    return extract
+
+
+class FastPredictionMiddleware(object):
+    """WSGI middleware that serves POST requests to the prediction route
+    directly and delegates every other request to the wrapped application.
+
+    :param wsgi_app: The WSGI application of the Flask app.
+    :param route: The route of the prediction resource.
+    """
+
+    def __init__(self, wsgi_app, route='/predict'):
+        self.wsgi_app = wsgi_app
+        self.route = route
+        self.priority_route_prefix = route + '/'
+        self.priority_route = route + '/<string:priority>'
+        self.spec_borg = SpecBorg()
+        self.extract_input = compile_input_extractor(self.spec_borg)
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if environ.get('REQUEST_METHOD') != 'POST':
+            return self.wsgi_app(environ, start_response)
+        # The priority class is selected by the X-Priority header or the route.
+        # Requests are labeled by route template since the priority in the
+        # path is client supplied.
+        if path == self.route:
+            priority = environ.get('HTTP_X_PRIORITY')
+            route = self.route
+        elif path.startswith(self.priority_route_prefix) and '/' not in path[len(self.priority_route_prefix):]:
+            priority = path[len(self.priority_route_prefix):]
+            route = self.priority_route
+        else:
+            return self.wsgi_app(environ, start_response)
+
+        start_time = default_timer()
+        _, form, files = parse_form_data(environ)
+        query = parse_qs(environ.get('QUERY_STRING', ''))
+        try:
+            output_keys = parse_output_filter(','.join(query.get('outputs', [])), self.spec_borg)
+            prediction_flow_input = self.extract_input(form, files)
+        except (KeyError, BadInputError) as e:
+            response = bad_inputs_response(e)
+        else:
+            response = make_prediction_response(prediction_flow_input, output_keys,
+                                                environ.get('HTTP_ACCEPT'),
+                                                environ.get('HTTP_ACCEPT_ENCODING'),
+                                                priority)
+        observe_prediction_request('POST', route, response.status_code, start_time)
+        return response(environ, start_response)
@@ -0,0 +1,131 @@
+"""
+Serializes prediction results into the format negotiated through the Accept
+header of a prediction request.
+
+JSON stays the default. Binary formats ship tensors as raw array buffers
+instead of decimal strings:
+
+- `application/x-npz` a NumPy `.npz` archive with one array per output, nested
+  results are keyed by their `/` joined path, e.g. `predictions/scores`.
+- `application/x-npy` a NumPy `.npy` array for results holding a single array.
+- `application/msgpack` MessagePack where arrays are maps of `dtype`, `shape`
+  and the raw `data` buffer, available when the msgpack package is installed.
+- `application/x-protobuf` the serialized PredictResponse of the model server,
+  skipping post-processing altogether.
+"""
+
+import gzip
+import io
+import json
+import os
+
+import numpy as np
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+
+from tf_serving_flask_app import settings
+from tf_serving_flask_app.base.encoders import NumpyEncoder
+from tf_serving_flask_app.base.utils import accepts_gzip
+from tf_serving_flask_app.base.exceptions import NotAcceptableError
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON = 'application/json'
+NPY = 'application/x-npy'
+NPZ = 'application/x-npz'
+MSGPACK = 'application/msgpack'
+PROTOBUF = 'application/x-protobuf'
+
+# Mimetypes clients commonly send for the same format.
+_ALIASES = {
+    'application/x-msgpack': MSGPACK,
+    'application/protobuf': PROTOBUF,
+}
+
+# In order of preference when the client accepts several formats equally.
+supported_mimetypes = [JSON, NPZ, NPY, PROTOBUF] + ([MSGPACK] if msgpack else [])
+_offered_mimetypes = supported_mimetypes + [alias for (alias, mimetype) in _ALIASES.items()
+                                            if mimetype in supported_mimetypes]
+
+GZIP_MIN_BYTES = int(os.getenv('RESPONSE_GZIP_MIN_BYTES', settings.DEFAULT_RESPONSE_GZIP_MIN_BYTES))
+# Favors latency over ratio, tensors of floats barely compress further.
+GZIP_COMPRESS_LEVEL = 1
+
+
+def negotiate(accept_header):
+    """Returns the supported mimetype best matching an Accept header, JSON
+    when the header is missing or matches none of the supported formats."""
+    if not accept_header:
+        return JSON
+    best_match = parse_accept_header(accept_header, MIMEAccept).best_match(_offered_mimetypes)
+    return _ALIASES.get(best_match, best_match) or JSON
+
+
+def flatten_results(results, prefix=''):
+    """Flattens nested result dicts into a dict from `/` joined keys to arrays.
+
+    :raises NotAcceptableError for results that have no fixed dtype array
+    representation, e.g. lists mixing labels and None.
+    """
+    if not isinstance(results, dict):
+        array = np.asarray(results)
+        if array.dtype == object:
+            raise NotAcceptableError('Result `%s` cannot be represented as a NumPy array' % prefix)
+        return {prefix: array}
+
+    arrays = {}
+    for (key, value) in results.items():
+        arrays.update(flatten_results(value, '%s/%s' % (prefix, key) if prefix else str(key)))
+    return arrays
+
+
+def _encode_msgpack(obj):
+    if isinstance(obj, np.ndarray):
+        if obj.dtype == object:
+            return obj.tolist()
+        return {'dtype': obj.dtype.str, 'shape': list(obj.shape), 'data': np.ascontiguousarray(obj).tobytes()}
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError('Cannot serialize %r to MessagePack' % type(obj))
+
+
+def serialize(results, mimetype):
+    """Serializes post-processed results, or a PredictResponse for protobuf.
+
+    :return: the serialized body as bytes.
+    :raises NotAcceptableError if the results cannot be represented in the mimetype.
+    """
+    if mimetype == PROTOBUF:
+        return results.SerializeToString()
+
+    if mimetype == MSGPACK:
+        return msgpack.packb(results, default=_encode_msgpack, use_bin_type=True)
+
+    if mimetype == NPZ or mimetype == NPY:
+        arrays = flatten_results(results)
+        buf = io.BytesIO()
+        if mimetype == NPZ:
+            np.savez(buf, **arrays)
+        elif len(arrays) == 1:
+            np.save(buf, next(iter(arrays.values())), allow_pickle=False)
+        else:
+            raise NotAcceptableError('Results with %d arrays cannot be represented as a single '
+                                     '.npy array, accept %s instead' % (len(arrays), NPZ))
+        return buf.getvalue()
+
+    return json.dumps(results, cls=NumpyEncoder).encode('utf-8')
+
+
+def compress(body, accept_encoding):
+    """Gzips bodies of at least GZIP_MIN_BYTES when the client accepts it,
+    i.e. when the Accept-Encoding header gives gzip a non-zero quality.
+
+    :return: a tuple of the body and the content encoding or None.
+    """
+    if (GZIP_MIN_BYTES > 0 and len(body) >= GZIP_MIN_BYTES and
+            accepts_gzip(accept_encoding)):
+        return gzip.compress(body, compresslevel=GZIP_COMPRESS_LEVEL), 'gzip'
+    return body, None
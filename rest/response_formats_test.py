@@ -0,0 +1,74 @@
+import gzip
+import io
+import json
+import unittest
+
+import numpy as np
+
+from tf_serving_flask_app.base.exceptions import NotAcceptableError
+from tf_serving_flask_app.rest import response_formats
+
+
+class TestResponseFormats(unittest.TestCase):
+    def setUp(self):
+        self.results = {
+            'probabilities': np.array([[.25, .75]], dtype=np.float32),
+            'top_k': {'indices': np.array([[1, 0]]), 'labels': [['dog', 'cat']]},
+        }
+
+    def test_negotiate(self):
+        self.assertEqual(response_formats.negotiate(None), response_formats.JSON)
+        self.assertEqual(response_formats.negotiate('*/*'), response_formats.JSON)
+        self.assertEqual(response_formats.negotiate('text/html'), response_formats.JSON)
+        self.assertEqual(response_formats.negotiate('application/x-npz'), response_formats.NPZ)
+        self.assertEqual(response_formats.negotiate('application/json;q=0.5, application/x-npy'),
+                         response_formats.NPY)
+        self.assertEqual(response_formats.negotiate('application/protobuf'), response_formats.PROTOBUF)
+
+    def test_serialize_json(self):
+        body = response_formats.serialize({'labels': [['dog', 'cat']]}, response_formats.JSON)
+        self.assertEqual(json.loads(body.decode('utf-8')), {'labels': [['dog', 'cat']]})
+
+    def test_serialize_npz(self):
+        body = response_formats.serialize(self.results, response_formats.NPZ)
+        arrays = np.load(io.BytesIO(body))
+        self.assertEqual(sorted(arrays.files), ['probabilities', 'top_k/indices', 'top_k/labels'])
+        np.testing.assert_array_equal(arrays['probabilities'], self.results['probabilities'])
+        np.testing.assert_array_equal(arrays['top_k/labels'], [['dog', 'cat']])
+
+    def test_serialize_npy(self):
+        body = response_formats.serialize({'probabilities': self.results['probabilities']},
+                                          response_formats.NPY)
+        np.testing.assert_array_equal(np.load(io.BytesIO(body)), self.results['probabilities'])
+        with self.assertRaises(NotAcceptableError):
+            response_formats.serialize(self.results, response_formats.NPY)
+        with self.assertRaises(NotAcceptableError):
+            response_formats.serialize({'labels': [['dog', None]]}, response_formats.NPZ)
+
+    @unittest.skipIf(response_formats.msgpack is None, 'msgpack is not installed')
+    def test_serialize_msgpack(self):
+        body = response_formats.serialize(self.results, response_formats.MSGPACK)
+        decoded = response_formats.msgpack.unpackb(body, raw=False)
+        probabilities = decoded['probabilities']
+        np.testing.assert_array_equal(
+            np.frombuffer(probabilities['data'], probabilities['dtype']).reshape(probabilities['shape']),
+            self.results['probabilities'])
+
+    def test_compress(self):
+        body = b'0' * response_formats.GZIP_MIN_BYTES
+        compressed, content_encoding = response_formats.compress(body, 'gzip, deflate')
+        self.assertEqual(content_encoding, 'gzip')
+        self.assertEqual(gzip.decompress(compressed), body)
+        self.assertEqual(response_formats.compress(body, None), (body, None))
+        self.assertEqual(response_formats.compress(b'{}', 'gzip'), (b'{}', None))
+
+    def test_compress_honors_quality(self):
+        body = b'0' * response_formats.GZIP_MIN_BYTES
+        for accept_encoding in ('gzip;q=0', 'gzip;q=0, deflate', '*;q=0', 'identity', 'gzip;q=0, *'):
+            self.assertEqual(response_formats.compress(body, accept_encoding), (body, None))
+        for accept_encoding in ('gzip;q=0.5', 'deflate, *', 'GZIP'):
+            self.assertEqual(response_formats.compress(body, accept_encoding)[1], 'gzip')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,187 @@
+"""
+Samples production prediction requests into rotating capture files that
+`benchmarks/replay_traffic.py` re-drives for performance testing.
+
+Each serving process appends to its own files named
+`capture-<pid>-<sequence>.bin` in TRAFFIC_CAPTURE_DIR. A file is a sequence of
+records. Each record is a 4 byte big-endian header length, a UTF-8 JSON header,
+and the raw bytes of its inputs in header order. The header holds the arrival
+time, the duration and status of the response, the selected outputs, the
+Accept header and the priority class. Each input entry has its key, its
+kind, and for files the filename, content type and length in bytes.
+
+Captures hold the raw inputs of real users and must be handled accordingly.
+"""
+
+import glob
+import heapq
+import json
+import logging
+import os
+import random
+import struct
+import threading
+
+from tf_serving_flask_app import settings
+
+logger = logging.getLogger('rest')
+
+_HEADER_LENGTH = struct.Struct('>I')
+
+FILE = 'file'
+TEXT = 'text'
+
+
+class CapturedInput(object):
+    """Raw bytes of a request input read for capture."""
+
+    def __init__(self, key, kind, data, filename=None, content_type=None):
+        self.key = key
+        self.kind = kind
+        self.data = data
+        self.filename = filename
+        self.content_type = content_type
+
+
+class TrafficCapture(object):
+    """Samples requests of the current process into rotating files.
+
+    :param directory: the directory capture files are written to.
+    :param sample_rate: the fraction of requests captured.
+    :param max_file_bytes: the size after which a new file is started.
+    :param max_files: the files of the process kept, oldest are removed first.
+    :param max_input_bytes: requests with a file input larger than this are
+    not captured, 0 for no limit.
+    """
+
+    def __init__(self, directory, sample_rate, max_file_bytes, max_files, max_input_bytes=0):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.max_file_bytes = max_file_bytes
+        self.max_files = max(max_files, 1)
+        self.max_input_bytes = max_input_bytes
+        self.sequence = 0
+        self.file = None
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def sample(self, prediction_flow_input):
+        """Reads the inputs of a sampled request, leaving file streams rewound
+        for the prediction flow.
+
+        :return: a list of CapturedInput or None if the request is not sampled
+        or has a file input over the size limit.
+        """
+        if random.random() >= self.sample_rate:
+            return None
+        captured_inputs = []
+        for (input_key, input_data) in prediction_flow_input.items():
+            if isinstance(input_data, str):
+                captured_inputs.append(CapturedInput(input_key, TEXT, input_data.encode('utf-8')))
+                continue
+            stream = input_data.stream
+            position = stream.tell()
+            # Oversized inputs are rejected by the image budget and never read
+            # into memory whole.
+            if self.max_input_bytes:
+                stream.seek(0, os.SEEK_END)
+                nbytes = stream.tell() - position
+                stream.seek(position)
+                if nbytes > self.max_input_bytes:
+                    return None
+            data = stream.read()
+            stream.seek(position)
+            captured_inputs.append(CapturedInput(input_key, FILE, data, input_data.filename,
+                                                 input_data.content_type))
+        return captured_inputs
+
+    def _path(self, sequence):
+        return os.path.join(self.directory, 'capture-%d-%06d.bin' % (os.getpid(), sequence))
+
+    def _rotate(self):
+        if self.file is not None:
+            self.file.close()
+            self.sequence += 1
+        self.file = open(self._path(self.sequence), 'ab')
+        paths = sorted(glob.glob(os.path.join(self.directory, 'capture-%d-*.bin' % os.getpid())))
+        for path in paths[:-self.max_files]:
+            os.remove(path)
+
+    def write(self, captured_inputs, arrival_time, duration_secs, status, output_keys=None,
+              accept=None, priority=None):
+        """Appends a sampled request to the current capture file."""
+        header = {
+            'time': arrival_time,
+            'duration_secs': duration_secs,
+            'status': status,
+            'outputs': output_keys,
+            'accept': accept,
+            'priority': priority,
+            'inputs': [dict(key=captured_input.key, kind=captured_input.kind,
+                            filename=captured_input.filename, content_type=captured_input.content_type,
+                            length=len(captured_input.data))
+                       for captured_input in captured_inputs],
+        }
+        header_bytes = json.dumps(header).encode('utf-8')
+        with self.lock:
+            if self.file is None or self.file.tell() >= self.max_file_bytes:
+                self._rotate()
+            self.file.write(_HEADER_LENGTH.pack(len(header_bytes)))
+            self.file.write(header_bytes)
+            for captured_input in captured_inputs:
+                self.file.write(captured_input.data)
+            self.file.flush()
+
+
+def read_capture_file(path):
+    """Yields `(header, {input key: bytes})` pairs of the records of a capture
+    file, stopping at a record truncated by a process that died writing it."""
+    with open(path, 'rb') as f:
+        while True:
+            length_bytes = f.read(_HEADER_LENGTH.size)
+            if len(length_bytes) < _HEADER_LENGTH.size:
+                return
+            header_bytes = f.read(_HEADER_LENGTH.unpack(length_bytes)[0])
+            try:
+                header = json.loads(header_bytes.decode('utf-8'))
+            except ValueError:
+                return
+            inputs = {}
+            for entry in header['inputs']:
+                data = f.read(entry['length'])
+                if len(data) < entry['length']:
+                    return
+                inputs[entry['key']] = data
+            yield header, inputs
+
+
+def read_captures(directory):
+    """Yields the records of every capture file in a directory in the order
+    they arrived across processes."""
+    paths = sorted(glob.glob(os.path.join(directory, 'capture-*.bin')))
+    return heapq.merge(*[read_capture_file(path) for path in paths], key=lambda record: record[0]['time'])
+
+
+# Keyed by the pid of the process that created them, so workers forked from a
+# preloaded master write their own files.
+_process_traffic_captures = {}
+
+
+def get_traffic_capture():
+    """Returns the traffic capture of the current process or None when
+    TRAFFIC_CAPTURE_RATE is 0."""
+    sample_rate = float(os.getenv('TRAFFIC_CAPTURE_RATE', settings.DEFAULT_TRAFFIC_CAPTURE_RATE))
+    if sample_rate <= 0:
+        return None
+    pid = os.getpid()
+    traffic_capture = _process_traffic_captures.get(pid)
+    if traffic_capture is None:
+        traffic_capture = _process_traffic_captures.setdefault(pid, TrafficCapture(
+            os.getenv('TRAFFIC_CAPTURE_DIR', settings.DEFAULT_TRAFFIC_CAPTURE_DIR),
+            sample_rate,
+            int(os.getenv('TRAFFIC_CAPTURE_MAX_FILE_BYTES', settings.DEFAULT_TRAFFIC_CAPTURE_MAX_FILE_BYTES)),
+            int(os.getenv('TRAFFIC_CAPTURE_MAX_FILES', settings.DEFAULT_TRAFFIC_CAPTURE_MAX_FILES)),
+            int(os.getenv('IMAGE_MAX_BYTES', settings.DEFAULT_IMAGE_MAX_BYTES))))
+        logger.info('Capturing %.2f%% of the prediction requests of process %d into %s',
+                    sample_rate * 100., pid, traffic_capture.directory)
+    return traffic_capture
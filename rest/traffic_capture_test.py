@@ -0,0 +1,58 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from werkzeug.datastructures import FileStorage
+
+from tf_serving_flask_app.rest import traffic_capture
+
+
+class TestTrafficCapture(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        capture = traffic_capture.TrafficCapture(self.directory, 1., 1024 * 1024, 2)
+        image = FileStorage(io.BytesIO(b'\x89PNG image'), filename='cat.png', content_type='image/png')
+        captured_inputs = capture.sample({'image': image, 'caption': u'a cat'})
+        # The prediction flow still reads the whole image.
+        self.assertEqual(image.stream.read(), b'\x89PNG image')
+        capture.write(captured_inputs, 20., .05, 200, ['scores'], 'application/json', 'bulk')
+        capture.write(captured_inputs, 10., .07, 500)
+
+        records = list(traffic_capture.read_captures(self.directory))
+        self.assertEqual([header['time'] for (header, _) in records], [20., 10.])
+        header, inputs = records[0]
+        self.assertEqual(inputs, {'image': b'\x89PNG image', 'caption': b'a cat'})
+        self.assertEqual((header['status'], header['outputs'], header['priority']), (200, ['scores'], 'bulk'))
+        self.assertEqual(header['inputs'][0]['filename'], 'cat.png')
+
+    def test_rotation_and_truncated_records(self):
+        capture = traffic_capture.TrafficCapture(self.directory, 1., 10, 2)
+        captured_inputs = [traffic_capture.CapturedInput('caption', traffic_capture.TEXT, b'x' * 10)]
+        for i in range(4):
+            capture.write(captured_inputs, float(i), 0., 200)
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+        with open(capture.file.name, 'ab') as f:
+            f.write(b'\0\0')
+        self.assertEqual([header['time'] for (header, _) in traffic_capture.read_captures(self.directory)],
+                         [2., 3.])
+
+    def test_oversized_inputs_are_not_captured(self):
+        capture = traffic_capture.TrafficCapture(self.directory, 1., 1024, 1, max_input_bytes=4)
+        image = FileStorage(io.BytesIO(b'\x89PNG image'), filename='cat.png')
+        self.assertIsNone(capture.sample({'image': image}))
+        self.assertEqual(image.stream.tell(), 0)
+
+    def test_sample_rate(self):
+        capture = traffic_capture.TrafficCapture(self.directory, 0., 1024, 1)
+        self.assertIsNone(capture.sample({'caption': u'a cat'}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,18 +8,146 @@ DEFAULT_FLASK_SERVER_PORT = 5001
 DEFAULT_FLASK_DEBUG = False
 DEFAULT_FLASK_PROFILE = False
 
+# Loads the application once in the gunicorn master and forks workers
+# sharing its memory copy-on-write.
+DEFAULT_GUNICORN_PRELOAD_APP = False
+
+# Scales gunicorn workers at runtime with SIGTTIN and SIGTTOU from the load,
+# accept backlog and latency of the workers. Bounds of 0 default to the number
+# of CPUs and the configured number of workers. The load of a worker is its
+# admitted and queued predictions.
+DEFAULT_AUTOSCALE_ENABLED = False
+DEFAULT_AUTOSCALE_MIN_WORKERS = 0
+DEFAULT_AUTOSCALE_MAX_WORKERS = 0
+DEFAULT_AUTOSCALE_INTERVAL_SECS = 5
+DEFAULT_AUTOSCALE_TARGET_LOAD_PER_WORKER = 4
+DEFAULT_AUTOSCALE_BACKLOG_THRESHOLD = 16
+# Mean prediction latency above which workers are added, 0 ignores latency.
+DEFAULT_AUTOSCALE_LATENCY_THRESHOLD_SECS = 0
+DEFAULT_AUTOSCALE_SCALE_UP_INTERVALS = 2
+DEFAULT_AUTOSCALE_SCALE_DOWN_INTERVALS = 12
+DEFAULT_AUTOSCALE_COOLDOWN_SECS = 30
+
+# Serves the prediction route from a lean WSGI fast path bypassing
+# flask-restplus request parsing.
+DEFAULT_FAST_PREDICT_PATH = False
+
 # Flask-Restplus settings
 RESTPLUS_SWAGGER_UI_DOC_EXPANSION = 'list'
 RESTPLUS_VALIDATE = True
 RESTPLUS_MASK_SWAGGER = False
 RESTPLUS_ERROR_404_HELP = True
 
+# Comma separated `<name>:<weight>[:<concurrency limit>]` priority classes that
+# requests select with the X-Priority header or a `/predict/<class>` route, and
+# the class of requests selecting none. Contended slots of a worker are shared
+# in proportion to the weights; a limit of 0 leaves a class unlimited.
+DEFAULT_PRIORITY_CLASSES = 'interactive:8,bulk:1:4'
+DEFAULT_PRIORITY_CLASS = 'interactive'
+# Predictions in flight per worker across all classes, 0 for no limit.
+DEFAULT_SCHEDULER_MAX_CONCURRENCY = 0
+DEFAULT_SCHEDULER_QUEUE_TIMEOUT_SECS = 30
+
+# Prediction responses in a negotiated format at least this large are gzipped
+# for clients accepting it, 0 disables compression.
+DEFAULT_RESPONSE_GZIP_MIN_BYTES = 16 * 1024
+
 # Default TensorFlow serving backend.
 DEFAULT_TF_SERVER_NAME = '0.0.0.0'
 DEFAULT_TF_SERVER_PORT = 9000
 DEFAULT_PREDICTION_RPC_TIMEOUT_SECS = 30
+# Comma separated signatures called in parallel with the same inputs in
+# place of the model spec signature, e.g. `embedding,classification`.
+DEFAULT_PREDICTION_SIGNATURE_NAMES = ''
+
+# Threads per process pre-processing the inputs of multi-input models concurrently.
+DEFAULT_PREPROCESSOR_THREADS = 4
+
+# Comma separated `<input key>:<dtype>` pairs, e.g. `image:uint8`, for image
+# inputs that are shipped in a compact dtype and normalized by the served model.
+DEFAULT_INPUT_TRANSPORT_DTYPES = ''
+# Validates the spec against the served model signature on startup.
+DEFAULT_VALIDATE_MODEL_SIGNATURE = True
+DEFAULT_MODEL_METADATA_TIMEOUT_SECS = 10
+
+# Budgets on input images checked from their headers before decoding, 0 for
+# no limit. Oversized JPEGs are decoded at a reduced scale instead of being
+# rejected when downsampling is enabled.
+DEFAULT_IMAGE_MAX_PIXELS = 40000000
+DEFAULT_IMAGE_MAX_BYTES = 20 * 1024 * 1024
+DEFAULT_IMAGE_DOWNSAMPLE_OVERSIZED = False
+
+# Synthetic predictions run on startup before serving traffic. Files named
+# after input keys in the samples directory replace synthesized inputs. The
+# whole warm-up is bounded by WARMUP_TIMEOUT_SECS, which together with
+# MODEL_METADATA_TIMEOUT_SECS must stay below the gunicorn worker timeout.
+DEFAULT_WARMUP_ENABLED = True
+DEFAULT_WARMUP_ITERATIONS = 3
+DEFAULT_WARMUP_SAMPLES_DIR = ''
+DEFAULT_WARMUP_TIMEOUT_SECS = 15
+
+# gRPC channel tuning for the TensorFlow serving backend.
+# Compression is one of `none`, `deflate` or `gzip` and only applies to
+# prediction requests at least GRPC_COMPRESSION_MIN_BYTES large.
+DEFAULT_GRPC_COMPRESSION = 'none'
+DEFAULT_GRPC_COMPRESSION_MIN_BYTES = 64 * 1024
+# Batched float32 image tensors easily exceed gRPC's 4 MB receive default.
+DEFAULT_GRPC_MAX_SEND_MESSAGE_LENGTH = 64 * 1024 * 1024
+DEFAULT_GRPC_MAX_RECEIVE_MESSAGE_LENGTH = 64 * 1024 * 1024
+# HTTP/2 stream window in bytes; 0 keeps the gRPC default.
+DEFAULT_GRPC_HTTP2_WINDOW_SIZE = 0
+DEFAULT_GRPC_HTTP2_BDP_PROBE = True
+# How eventlet workers wait for prediction RPCs without blocking their hub,
+# one of `future`, `tpool` or `blocking`, and the RPCs a process has in
+# flight at once, 0 for no limit.
+DEFAULT_GRPC_COOPERATIVE_MODE = 'future'
+DEFAULT_GRPC_MAX_INFLIGHT_RPCS = 64
 
 # Configuration for the Flask app running on a separate thread for metrics.
 DEFAULT_METRICS_HOST = '0.0.0.0'
 DEFAULT_METRICS_PORT = 5002
+# `thread` serves metrics on daemon threads of the process registering the
+# endpoint, `process` from a sidecar process that does not share its GIL.
+DEFAULT_METRICS_EXPORTER_MODE = 'thread'
+# Scrapes within the time-to-live are served from the last collection.
+DEFAULT_METRICS_SCRAPE_CACHE_TTL_SECS = 2
+# Interval for merging the metrics files of dead workers, 0 disables compaction.
+DEFAULT_METRICS_COMPACTION_INTERVAL_SECS = 60
+
+
+# Eventlet hub monitoring of gunicorn workers.
+DEFAULT_EVENTLET_HUB_MONITOR = False
+DEFAULT_EVENTLET_HUB_MONITOR_INTERVAL_SECS = 0.1
+DEFAULT_EVENTLET_HUB_BLOCK_THRESHOLD_SECS = 0.5
+
+# Asynchronous logging of the production logging configuration. Records
+# beyond the queue capacity are dropped and counted. Warnings and errors of a
+# call site are limited to a burst and then a rate, 0 logs every record.
+DEFAULT_LOG_QUEUE_CAPACITY = 10000
+DEFAULT_LOG_BATCH_SIZE = 256
+DEFAULT_LOG_FLUSH_INTERVAL_SECS = 0.05
+DEFAULT_LOG_RATE_LIMIT_PER_SEC = 1
+DEFAULT_LOG_RATE_LIMIT_BURST = 10
+
+# Sampling of prediction requests into rotating capture files for replay,
+# 0 disables capturing. The size and number of files are per process.
+DEFAULT_TRAFFIC_CAPTURE_RATE = 0
+DEFAULT_TRAFFIC_CAPTURE_DIR = '/tmp/traffic-capture'
+DEFAULT_TRAFFIC_CAPTURE_MAX_FILE_BYTES = 64 * 1024 * 1024
+DEFAULT_TRAFFIC_CAPTURE_MAX_FILES = 8
+
+# Memory instrumentation of serving processes and the `/memory` route of the
+# metrics exporter. With 0 frames tracemalloc starts on the first report.
+DEFAULT_MEMORY_PROFILING = False
+DEFAULT_MEMORY_TRACEMALLOC_FRAMES = 0
+# Defaults to `memory` under prometheus_multiproc_dir, or else a directory in
+# the system temporary directory.
+DEFAULT_MEMORY_PROFILE_DIR = ''
+DEFAULT_MEMORY_REPORT_TIMEOUT_SECS = 10
 
+# Pinning of gunicorn workers to CPUs: `none`, `cpu` for slots of
+# WORKER_CPUS_PER_WORKER CPUs or `numa` for a slot per NUMA node.
+DEFAULT_WORKER_CPU_AFFINITY = 'none'
+DEFAULT_WORKER_CPUS_PER_WORKER = 1
+# Size of the OpenMP and BLAS thread pools of each worker, 0 for the library defaults.
+DEFAULT_NATIVE_THREADS_PER_WORKER = 1
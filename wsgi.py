@@ -1,4 +1,8 @@
+import os
+
+from tf_serving_flask_app import settings
 from tf_serving_flask_app.app import bootstrap_app
+from tf_serving_flask_app.base.utils import as_boolean
 
 
 def app(spec):
@@ -19,5 +23,9 @@ def app(spec):
     specified through a more nuanced DSL. Exporting FLASK_DEBUG
     while in gunicorn is not going to work as expected and developers
     should run the standalone mode whenever debugging is required.
+
+    With GUNICORN_PRELOAD_APP the application is loaded once in the master
+    and workers are initialized in the `post_worker_init` hook instead.
     """
-    return bootstrap_app(spec)
+    preload_app = as_boolean(os.getenv('GUNICORN_PRELOAD_APP', settings.DEFAULT_GUNICORN_PRELOAD_APP))
+    return bootstrap_app(spec, initialize=not preload_app)